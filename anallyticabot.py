@@ -11,6 +11,9 @@ setup_plotly_theme()
 # Dialogs page
 from app.dialogs.dialog_flow import dialogflow_page
 
+# Entities page
+from app.entities.mentions import entity_mentions_page
+
 # Intents page
 from app.intents.stop_words import stop_words_page
 from app.intents.watson_prediction import watson_prediction_page
@@ -38,6 +41,7 @@ app.add_app("Home", main_page)
 app.add_app("Counterexamples Manager", counterexamples_page, logged_page=True)
 app.add_app("Decomposition Analysis", decomposition_page, logged_page=True)
 app.add_app("Dialog Flow", dialogflow_page, logged_page=True)
+app.add_app("Entity Mentions", entity_mentions_page, logged_page=True)
 app.add_app("Examples Similarity", similarity_page, logged_page=True)
 app.add_app("Intents Discovery", discovery_page, logged_page=True)
 app.add_app("Metrics - Conversations", conversation_metrics_page, logged_page=True)
@@ -31,7 +31,8 @@ def dialogflow_page(state):
     config['title'] = col_1.text_input('Title', value=title_default)
     config['commonRootPathName'] = config['title']
     logs_date = col_2.date_input(
-        'Logs date range', value=(start_date, end_date))
+        'Logs date range', value=(start_date, end_date),
+        help='Conversations are counted in the day (UTC) of their first turn.')
 
     col_1, col_2, col_3, col_4 = st.columns(4)
     config['maxChildrenInNode'] = col_1.number_input('Max children in node', value=6)
@@ -41,13 +42,36 @@ def dialogflow_page(state):
 
     config['nodeWidth'] = col_3.number_input('Node width', value=250, step=10)
     config['linkWidth'] = col_4.number_input('Link width', value=400, step=10)
+    min_flows = col_1.number_input('Min visits per node', min_value=1, value=1,
+                                   help='Nodes with fewer visits are merged into an "others" node, making the report smaller.')
+    compare = col_2.checkbox('Compare with previous period', value=False,
+                             help='Node metrics are compared with the same number of days before the logs date range.')
+
+    col_1, col_2, col_3 = st.columns(3)
+    path_symbols = col_1.selectbox('Path steps', options=(('intent', 'node'), ('intent',), ('node',)),
+                                   format_func=lambda x: ' and '.join('intents' if s == 'intent' else 'dialog nodes' for s in x))
+    path_support = col_2.number_input('Min conversations with the path (%)', min_value=0.01, max_value=100.0, value=1.0,
+                                      help='Paths found in fewer conversations are not reported.')
+    path_length = col_3.number_input('Max path length', min_value=2, max_value=10, value=5)
+    max_logs = col_1.number_input('Max logs per request', min_value=500, max_value=100000, value=5000, step=500,
+                                  help='Days that are not processed yet are requested at once, the days left out '
+                                       'by this limit are processed again next time.')
 
     if st.button("Generate report"):
         with st.spinner('Processing data...'):
-            from src.dialogs.dialog_flow import prepare_data, generate_html_report
+            from src.dialogs.dialog_flow import get_flow_cache, flows_to_records, generate_html_report
+            from src.dialogs.node_index import get_node_index
+            from src.dialogs.node_metrics import summarize_node_metrics, node_metric_deltas
+            from src.dialogs.path_mining import conversation_sequences, frequent_paths
             from src.connectors.watson_assistant import WatsonAssistant
+            from src.metrics.rollups import covered_days, days_between
             from app.helper_functions import download_link
 
+            skill_id = state.watson_args["skill_id"]
+            periods = [(logs_date[0], logs_date[1])]
+            if compare:
+                periods.append((logs_date[0] - (logs_date[1] - logs_date[0]), logs_date[0]))
+
             try:
                 wa = WatsonAssistant(apikey=state.watson_args["apikey"],
                                     service_endpoint=state.watson_args["endpoint"],
@@ -55,18 +79,35 @@ def dialogflow_page(state):
 
                 workspace = wa.get_workspace()
 
-                query_logs = wa.define_query_by_date(logs_date[0], logs_date[1])
-                logs = wa.get_logs(query=query_logs)
+                # Only the days that were not processed for this workspace version are requested, one query per
+                # range of consecutive days. The periods are adjacent, the previous one comes first.
+                flow_cache = get_flow_cache(skill_id, workspace)
+                truncated = []
+                one_day = datetime.timedelta(days=1)
+                for start, end in flow_cache.missing_ranges(periods[-1][0], periods[0][1]):
+                    # With the day before and after, see FlowCache.
+                    logs = wa.get_logs(query=wa.define_query_by_date(start - one_day, end + one_day), max_logs=max_logs)
+                    complete = True
+                    if len(logs) >= max_logs:
+                        # Newest logs first, the days (and their day before) after the oldest log are complete.
+                        covered = set(covered_days([log["request_timestamp"] for log in logs], start - one_day,
+                                                   end + one_day, truncated=True))
+                        complete = {day for day in days_between(start, end) if day - one_day in covered}
+                        truncated.extend(str(day) for day in days_between(start, end) if day not in complete)
+                    flow_cache.update(logs, start, end, complete=complete)
             except Exception as error:
                 logger.error(
                     {"message": "Failed to fetch Watson Assistant logs.", "exception": error})
                 st.error("Failed to fetch Watson Assistant logs.")
+                st.stop()
 
-            skill_id = state.watson_args["skill_id"]
+            if len(truncated) > 0:
+                st.warning("The requests reached {} logs, these days are incomplete and "
+                           "will be processed again: {}.".format(max_logs, ", ".join(truncated)))
 
             try:
-                data = prepare_data(logs, skill_id, workspace)
-                html_report = generate_html_report(config, data)
+                data = flows_to_records(flow_cache.flows(logs_date[0], logs_date[1]))
+                html_report = generate_html_report(config, data, min_flows=min_flows)
                 result = download_link(
                     html_report, 'dialog_flow.html', 'Download Dialog Flow report')
                 st.markdown(result, unsafe_allow_html=True)
@@ -75,4 +116,48 @@ def dialogflow_page(state):
                     {"message": "Failed to generate Dialog Flow report.", "exception": error})
                 st.error("Failed to generate Dialog Flow report.")
 
+            # Node metrics are summed from the daily rollups, the flow tree isn't needed.
+            try:
+                node_index = get_node_index(workspace)
+                node_metrics = summarize_node_metrics(flow_cache.node_metrics(*periods[0]), node_index)
+                if compare:
+                    previous = summarize_node_metrics(flow_cache.node_metrics(*periods[1]), node_index)
+                    node_metrics = node_metric_deltas(node_metrics, previous)
+                state.dialog_node_metrics = node_metrics
+            except Exception as error:
+                logger.error(
+                    {"message": "Failed to compute dialog node metrics.", "exception": error})
+                st.error("Failed to compute dialog node metrics.")
+
+            # Paths anywhere in the conversations, the flow tree only has paths from the first turn.
+            try:
+                sequences = conversation_sequences(flow_cache.canonical(*periods[0]), symbols=path_symbols)
+                state.dialog_frequent_paths = frequent_paths(sequences, min_support=path_support / 100,
+                                                             max_length=path_length)
+            except Exception as error:
+                logger.error(
+                    {"message": "Failed to mine frequent paths.", "exception": error})
+                st.error("Failed to mine frequent paths.")
+
+    if state.dialog_node_metrics is not None:
+        st.subheader("Dialog nodes")
+        st.markdown("""
+        Visits, drop-offs (conversations that ended in the node), reroutes (the next turn didn't continue in the node's children) and average turns to reach each node. Click a column to sort.
+        """)
+        node_metrics = state.dialog_node_metrics
+        node_types = st.multiselect('Nodes', ['Root nodes', 'Child nodes'], default=['Root nodes', 'Child nodes'])
+        is_root = node_metrics["depth"].fillna(0) == 0
+        if 'Root nodes' not in node_types:
+            node_metrics = node_metrics[~is_root]
+        if 'Child nodes' not in node_types:
+            node_metrics = node_metrics[is_root]
+        st.dataframe(node_metrics)
+
+    if state.dialog_frequent_paths is not None:
+        st.subheader("Frequent paths")
+        st.markdown("""
+        Most common sequences of consecutive intents and dialog nodes, anywhere in the conversations.
+        """)
+        st.dataframe(state.dialog_frequent_paths)
+
     state.sync()
@@ -0,0 +1,102 @@
+import datetime
+import streamlit as st
+from app.helper_functions import *
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+
+
+def entity_mentions_page(state):
+    logger.info({"message": "Loading Entity Mentions page."})
+    st.title("Entity Mentions")
+
+    st.markdown("""
+    How the entities of your skill are mentioned by the users.
+
+    All values and synonyms of the workspace entities are compiled into one matcher and each log input is scanned once, so you can see:
+
+    - **Coverage**: the logs that mention each entity and the synonyms that are never used;
+    - **Unmatched terms**: frequent words that aren't part of any synonym, with the closest synonym when they look like a misspelling;
+    - **Synonym gaps**: mentions detected by Watson Assistant (e.g. by fuzzy matching) that aren't a synonym of the value yet.
+
+    Pattern values and system entities are not analyzed.
+    """)
+
+    from src.connectors.log_sampling import SAMPLING_OPTIONS
+
+    end_date = datetime.datetime.now()
+    start_date = end_date - datetime.timedelta(days=7)
+
+    col1, col2 = st.columns(2)
+    logs_date = col1.date_input('Logs date range', value=(start_date, end_date))
+    sampling = col2.selectbox('Sampling', list(SAMPLING_OPTIONS.keys()),
+                              help='Which logs of the date range are analyzed.')
+    col1, col2 = st.columns(2)
+    max_logs = col1.number_input('Max logs', min_value=100, max_value=100000, value=5000, step=1000)
+    top_terms = col2.number_input('Unmatched terms', min_value=10, max_value=500, value=50, step=10)
+    exclude_stop_words = st.checkbox('Not consider stop words in the unmatched terms', value=True)
+
+    if st.button("Analyze"):
+        with st.spinner('Processing data...'):
+            from src.connectors.watson_assistant import WatsonAssistant
+            from src.entities.mentions import EntityMatcher, log_entity_inputs, mention_analysis
+            from src.intents.stop_words import get_stop_words
+
+            try:
+                wa = WatsonAssistant(apikey=state.watson_args["apikey"],
+                                     service_endpoint=state.watson_args["endpoint"],
+                                     default_skill_id=state.watson_args["skill_id"])
+
+                workspace = wa.get_workspace()
+                query_logs = wa.define_query_by_date(logs_date[0], logs_date[1])
+                logs = wa.get_logs(query=query_logs, max_logs=max_logs, sampling=SAMPLING_OPTIONS[sampling])
+            except Exception as error:
+                logger.error({"message": "Failed to fetch Watson Assistant data.", "exception": error})
+                st.error("Failed to fetch Watson Assistant data.")
+                st.stop()
+
+            texts, detected = log_entity_inputs(logs)
+            if len(workspace.get("entities", [])) == 0 or len(texts) == 0:
+                logger.error({"message": "It's seems that this skill has no entities or logs available."})
+                st.error("It's seems that this skill has no entities or logs available.")
+                st.stop()
+
+            try:
+                stopwords = get_stop_words(texts)["words"].tolist() if exclude_stop_words else None
+                matcher = EntityMatcher(workspace["entities"])
+                state.entity_mentions = mention_analysis(texts, matcher, detected=detected, stopwords=stopwords,
+                                                         top_terms=top_terms)
+                state.entity_mentions["logs"] = len(texts)
+            except Exception as error:
+                logger.error({"message": "Failed to analyze entity mentions.", "exception": error})
+                st.error("Failed to analyze entity mentions.")
+
+    if state.entity_mentions is not None:
+        analysis = state.entity_mentions
+
+        col1, col2, col3 = st.columns(3)
+        col1.metric(label="Logs", value=analysis["logs"])
+        col2.metric(label="Logs with entities", value=f'{analysis["logs_share"]:.1%}')
+        col3.metric(label="Unused synonyms", value=int((analysis["synonyms"]["mentions"] == 0).sum()))
+
+        st.subheader("Coverage")
+        st.dataframe(analysis["coverage"])
+
+        entity = st.selectbox('Synonyms of', analysis["coverage"]["entity"].tolist())
+        df_synonyms = analysis["synonyms"][analysis["synonyms"]["entity"] == entity]
+        st.dataframe(df_synonyms.sort_values(by="mentions", ascending=False))
+
+        st.subheader("Unmatched terms")
+        st.dataframe(analysis["unmatched"])
+        link = download_link(analysis["unmatched"], "unmatched_terms.csv", "Download CSV file")
+        st.markdown(link, unsafe_allow_html=True)
+
+        st.subheader("Synonym gaps")
+        if len(analysis["gaps"]) > 0:
+            st.dataframe(analysis["gaps"])
+            link = download_link(analysis["gaps"], "synonym_gaps.csv", "Download CSV file")
+            st.markdown(link, unsafe_allow_html=True)
+        else:
+            st.info("All mentions detected by Watson Assistant are synonyms of their values.")
+
+    state.sync()
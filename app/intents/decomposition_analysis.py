@@ -23,7 +23,7 @@ def decomposition_page(state):
         "Which algorithm do you want to run?", options=['PCA', 'TSNE', 'truncated SVD'])
 
     if st.button("Run analysis"):
-        from src.intents.decomposition_analysis import ExamplesDA, IntentsDA, prepareDataIntents
+        from src.intents.decomposition_analysis import run_decomposition
         from src.connectors.watson_assistant import WatsonAssistant
 
         wa = WatsonAssistant(apikey=state.watson_args["apikey"],
@@ -32,25 +32,42 @@ def decomposition_page(state):
 
         data = wa.get_intents()
 
-        # Decomposition Analysis - Examples
-        pca_examples = ExamplesDA(examples=data["examples"], intents=data["intents"],
-                                  decomposition_method=decomposition_method)
+        # Only the key is kept in the session state, the fitted maps stay in memory.
+        key = run_decomposition(data["examples"], data["intents"], method=decomposition_method,
+                                stopwords=isinstance(state.stopwords, list), stopwords_file=state.stopwords)
+        state.decomposition = {"key": key, "method": decomposition_method}
 
-        if isinstance(state.stopwords, list):
-            pca_examples.text_processing(
-                stopwords=True, stopwords_file=state.stopwords)
+    analysis = None
+    if state.decomposition is not None:
+        from src.intents.decomposition_analysis import get_decomposition
 
-        pca_examples.prepare_data()
-        pca_examples.generate_fig(
-            title="Examples - Decomposition Analysis ({})".format(decomposition_method))
+        analysis = get_decomposition(state.decomposition["key"])
+        if analysis is None:
+            st.info("The analysis isn't in memory anymore, please run it again.")
+
+    if analysis is not None:
+        from src.intents.decomposition_analysis import add_examples_trace
 
-        # Decomposition Analysis - Intents
-        pca_intents = IntentsDA(examples=data["examples"], intents=data["intents"],
-                                decomposition_method=decomposition_method)
+        pca_examples = analysis["examples"]
+        pca_intents = analysis["intents"]
+        method = state.decomposition["method"]
 
-        pca_intents.data = prepareDataIntents(pca_examples.data)
+        pca_examples.generate_fig(
+            title="Examples - Decomposition Analysis ({})".format(method))
         pca_intents.generate_fig(
-            title="Intents - Decomposition Analysis ({})".format(decomposition_method))
+            title="Intents - Decomposition Analysis ({})".format(method))
+
+        st.markdown("""
+        ## Where would new examples fall?
+        Write one example per line to see where they land in the charts below, without running the analysis again.
+        """)
+        new_examples = st.text_area("New examples")
+        new_examples = [e.strip() for e in new_examples.split("\n") if len(e.strip()) > 0]
+
+        if len(new_examples) > 0:
+            df_new = pca_examples.project(new_examples)
+            add_examples_trace(pca_examples.fig, df_new)
+            add_examples_trace(pca_intents.fig, df_new)
 
         st.markdown("""
         ## Examples - Decomposition Analysis
@@ -68,4 +85,15 @@ def decomposition_page(state):
         """)
         st.plotly_chart(pca_intents.fig, use_container_width=True)
 
+        st.markdown("""
+        ## Conflicting intents
+        The charts above are a 2D approximation. Here the intents are compared using all the words of their examples.
+
+        The overlap is the sum of how scattered the examples of both intents are divided by the distance between the intents, the higher it is the more they conflict.
+        """)
+        pairs = analysis["overlap"]["pairs"]
+        link = download_link(pairs, "conflicting_intents.csv", "Download CSV file")
+        st.markdown(link, unsafe_allow_html=True)
+        st.dataframe(pairs)
+
     state.sync()
\ No newline at end of file
@@ -1,3 +1,4 @@
+import datetime
 import pandas as pd
 import streamlit as st
 from app.helper_functions import *
@@ -66,6 +67,12 @@ def discovery_page(state):
             df = read_df(uploaded_file, cols_names=["examples"])
             unlabeled_examples = df["examples"].tolist()
     elif sim_option == "Watson Assistant":
+        from src.connectors.log_sampling import SAMPLING_OPTIONS
+        sampling = st.selectbox('Sampling', list(SAMPLING_OPTIONS.keys()),
+                                help='Which 5000 logs of the last 7 days are analyzed.')
+        fetch_confidence = st.slider('Confidence of the logs to get', min_value=0.0, max_value=1.0,
+                                     value=(0.0, 1.0), step=0.01,
+                                     help='Filtered by Watson Assistant, so more logs of this range fit in the 5000 logs.')
         if st.button("Get logs"):
             # Getting Watson logs
             st.write("Loading Watson Assistant logs.")
@@ -74,7 +81,10 @@ def discovery_page(state):
                                  service_endpoint=state.watson_args["endpoint"],
                                  default_skill_id=state.watson_args["skill_id"])
 
-            logs = wa.get_logs()
+            end_date = datetime.datetime.now()
+            query_logs = wa.define_query(end_date - datetime.timedelta(days=7), end_date,
+                                         confidence=fetch_confidence, has_text=True)
+            logs = wa.get_logs(query=query_logs, sampling=SAMPLING_OPTIONS[sampling])
             if len(logs) > 0:
                 state.discovery_data = pd.DataFrame(prepare_logs(logs))
             else:
@@ -103,11 +113,28 @@ def discovery_page(state):
 
             unlabeled_examples = data["input"].tolist()
 
+    method = st.radio("Which clustering method do you want to run?", options=[
+        "K-Means", "Hierarchical"])
+    st.write('"Hierarchical" builds the clusters tree once, so you can change the number of topics without running the analysis again.')
+
+    dedup = st.checkbox('Remove near-duplicate messages before clustering',
+                        help='Near-duplicates are found with MinHash LSH, only the first message of each group is clustered.')
+    if dedup:
+        dedup_threshold = st.slider('Near-duplicates similarity (Jaccard)', min_value=0.5, max_value=1.0,
+                                    value=0.8, step=0.05)
+
     if unlabeled_examples != None:
         if st.button("Run analysis"):
             st.write("## Working on the data")
             st.write("We are preparing the data, this may take some time.")
 
+            if dedup:
+                from src.nlp_utils.near_duplicates import deduplicate
+
+                kept, _ = deduplicate(unlabeled_examples, threshold=dedup_threshold)
+                st.write("Near-duplicate messages removed: {}".format(len(unlabeled_examples) - len(kept)))
+                unlabeled_examples = [unlabeled_examples[i] for i in kept]
+
             # imports
             import plotly.express as px
             from src.intents.discovery import IntentsDiscovery
@@ -120,51 +147,71 @@ def discovery_page(state):
                 intents_discovery.text_processing(
                     stopwords=state.stopwords, inplace=True)
 
-            # Find best n_clusters
-            st.write("Starting tests to find the best `n_clusters`.")
-            intents_discovery.search_n_clusters()
+            if method == "Hierarchical":
+                state.discovery_tree = intents_discovery.build_cluster_tree()
+            else:
+                state.discovery_tree = None
 
-            clustering_data = intents_discovery.clustering(
-                n_clusters=intents_discovery.n_clusters)
+                # Find best n_clusters
+                st.write("Starting tests to find the best `n_clusters`.")
+                intents_discovery.search_n_clusters()
 
-            df = pd.DataFrame(
-                {"examples": clustering_data["data"], "labels": clustering_data["labels"]})
+                clustering_data = intents_discovery.clustering(
+                    n_clusters=intents_discovery.n_clusters)
 
-            st.markdown("""
-            ## Silhouette score
-            To evaluate how the unsupervised model is performing, we’ll use [Silhouette](https://en.wikipedia.org/wiki/Silhouette_(clustering)) score.
-            """)
+                df = pd.DataFrame(
+                    {"examples": clustering_data["data"], "labels": clustering_data["labels"]})
 
-            df_score = pd.DataFrame(intents_discovery.search_data)
+                st.markdown("""
+                ## Silhouette score
+                To evaluate how the unsupervised model is performing, we’ll use [Silhouette](https://en.wikipedia.org/wiki/Silhouette_(clustering)) score.
+                """)
 
-            st.plotly_chart(px.line(df_score, x="n_clusters", y="silhouette_score",
-                                    title="Silhouette score"), use_container_width=True)
+                df_score = pd.DataFrame(intents_discovery.search_data)
 
-            st.markdown("""
-            ## Clustered messages
-            See below the clustered messages or download it as csv file.
-            """)
+                st.plotly_chart(px.line(df_score, x="n_clusters", y="silhouette_score",
+                                        title="Silhouette score"), use_container_width=True)
 
-            link = download_link(df, "clustered_examples.csv",
-                                 "Download CSV file")
+                display_clusters(df)
 
-            st.markdown(link, unsafe_allow_html=True)
+    if method == "Hierarchical" and state.discovery_tree is not None:
+        tree = state.discovery_tree
+        max_clusters = min(100, len(tree.data))
+        n_clusters = st.slider("Number of topics", min_value=2, max_value=max(max_clusters, 2),
+                               value=min(10, max_clusters), step=1)
 
-            st.dataframe(df)
+        df = pd.DataFrame({"examples": tree.data, "labels": tree.cut(n_clusters)})
+        display_clusters(df)
 
-            st.markdown("""
-            ## Topics
+    state.sync()
 
-            Below we can see the topics that were found.
-            """)
 
-            df_topics = df.groupby("labels").count()
-            df_topics.sort_values("examples", inplace=True, ascending=True)
-            df_topics.reset_index(inplace=True)
-            
-            fig_title = "{} topics for {} messages.".format(len(df_topics), df_topics["examples"].sum())
-            fig = px.bar(df_topics, x="examples", y="labels", orientation="h", hover_name="labels", hover_data=["labels"], title=fig_title)
-            fig.layout.update(showlegend=False)
-            st.plotly_chart(fig, use_container_width=True)
+def display_clusters(df):
+    import plotly.express as px
 
-    state.sync()
+    st.markdown("""
+    ## Clustered messages
+    See below the clustered messages or download it as csv file.
+    """)
+
+    link = download_link(df, "clustered_examples.csv",
+                         "Download CSV file")
+
+    st.markdown(link, unsafe_allow_html=True)
+
+    st.dataframe(df)
+
+    st.markdown("""
+    ## Topics
+
+    Below we can see the topics that were found.
+    """)
+
+    df_topics = df.groupby("labels").count()
+    df_topics.sort_values("examples", inplace=True, ascending=True)
+    df_topics.reset_index(inplace=True)
+
+    fig_title = "{} topics for {} messages.".format(len(df_topics), df_topics["examples"].sum())
+    fig = px.bar(df_topics, x="examples", y="labels", orientation="h", hover_name="labels", hover_data=["labels"], title=fig_title)
+    fig.layout.update(showlegend=False)
+    st.plotly_chart(fig, use_container_width=True)
@@ -51,6 +51,12 @@ def similarity_page(state):
                       "Compare all examples", "Compare examples inside intents"])
     st.write('For large datasets/skills, "Compare all examples" can take too a long time.')
 
+    dedup = st.checkbox('Remove near-duplicate examples before the analysis',
+                        help='Near-duplicates are found with MinHash LSH, only the first example of each group is compared.')
+    if dedup:
+        dedup_threshold = st.slider('Near-duplicates similarity (Jaccard)', min_value=0.5, max_value=1.0,
+                                    value=0.8, step=0.05)
+
     if st.button("Run analysis"):
         if sim_option == "Watson Assistant":
             from src.connectors.watson_assistant import WatsonAssistant
@@ -61,6 +67,13 @@ def similarity_page(state):
             data = wa.get_intents()
             data = pd.DataFrame(data)
 
+        if dedup:
+            from src.nlp_utils.near_duplicates import deduplicate
+
+            kept, _ = deduplicate(data["examples"].tolist(), threshold=dedup_threshold)
+            st.write("Near-duplicate examples removed: {}".format(len(data) - len(kept)))
+            data = data.iloc[kept].reset_index(drop=True)
+
         if method == "Compare all examples":
             from src.intents.similarity import apply_similarity
 
@@ -45,9 +45,26 @@ def watson_prediction_page(state):
 
     # RUN ANALYSIS
     if isinstance(state.watson_prediction, pd.DataFrame):
-        if len(state.watson_prediction) >= 500:
-            warning_msg = "Caution! This analysis will make several API calls and will incur costs. It will make {} API calls.".format(
-                len(state.watson_prediction["examples"].tolist()))
+        dedup = st.checkbox('Send only one example of each near-duplicate group',
+                            help='Near-duplicates are found with MinHash LSH and get the prediction of the first example of their group, saving API calls.')
+        data = state.watson_prediction.reset_index(drop=True)
+        if dedup:
+            from src.nlp_utils.near_duplicates import deduplicate
+
+            dedup_threshold = st.slider('Near-duplicates similarity (Jaccard)', min_value=0.5, max_value=1.0,
+                                        value=0.9, step=0.05)
+            # Kept while the examples and threshold don't change, the page runs again on each interaction.
+            dedup_key = (dedup_threshold, int(pd.util.hash_pandas_object(data["examples"], index=False).sum()))
+            if state.watson_dedup is None or state.watson_dedup["key"] != dedup_key:
+                kept, groups = deduplicate(data["examples"].tolist(), threshold=dedup_threshold)
+                state.watson_dedup = {"key": dedup_key, "kept": kept, "groups": groups}
+            kept, groups = state.watson_dedup["kept"], state.watson_dedup["groups"]
+        else:
+            kept, groups = data.index.to_numpy(), data.index.to_numpy()
+
+        if len(kept) >= 500:
+            warning_msg = "Caution! This analysis will make several API calls and will incur costs. It will make {} API calls for {} examples.".format(
+                len(kept), len(data))
             logger.warning({"message": warning_msg})
             st.warning(warning_msg)
 
@@ -55,11 +72,20 @@ def watson_prediction_page(state):
             if "watson_intent_0" not in state.watson_prediction.columns:
                 st.write("Getting Watson predictions.")
 
-            data_processed = run_wa_preds(df=state.watson_prediction,
+            if dedup:
+                st.write("API calls saved: {}".format(len(data) - len(kept)))
+
+            data_processed = run_wa_preds(df=data.iloc[kept],
                                           watson_apikey=state.watson_args["apikey"],
                                           watson_endpoint=state.watson_args["endpoint"],
                                           watson_skill=state.watson_args["skill_id"])
 
+            # Near-duplicates get the predictions of the first example of their group.
+            watson_columns = [col for col in data_processed.columns if col.startswith("watson_")]
+            data_processed.index = kept
+            data_processed = pd.concat([data.drop(columns=watson_columns, errors="ignore"),
+                                        data_processed.loc[groups, watson_columns].reset_index(drop=True)], axis=1)
+
             state.watson_prediction = cache_df(data_processed.copy())
 
     # SHOW DATASET
@@ -24,25 +24,69 @@ def conversation_metrics_page(state):
     args['Date'] = col1.selectbox('Datetime variable', ('request_timestamp', 'response_timestamp'))    
     args['Sessions'] = col2.text_input('Conversation id', value='response.context.conversation_id')
     args['Active users'] = col2.text_input('User variable', value='response.context.global.system.user_id')
+    args['approximate'] = col1.checkbox('Approximate distinct counts', value=False,
+                                        help='Count sessions and active users with HyperLogLog sketches, with a bounded memory for long date ranges.')
+    args['error_rate'] = col2.number_input('Approximation error', min_value=0.005, max_value=0.1,
+                                           value=0.035, step=0.005, format='%.3f',
+                                           help='Relative error of the distinct counts, the hourly sketches keep it at least 3.25%.')
+    args['max_logs'] = col1.number_input('Max logs per day', min_value=500, max_value=100000, value=5000, step=500,
+                                         help='Days with more logs are fetched again next time, only the newest logs are included.')
+    args['resolution_intents'] = st.text_input('Resolution intents (optional)', value='',
+                                               help='Comma-separated intents that mean the user need was resolved, used for turns to resolution.')
+    args['resolution_intents'] = [intent.strip() for intent in args['resolution_intents'].split(',') if intent.strip()]
 
     if st.button("Get logs"):
         with st.spinner("Getting logs..."):
             from src.metrics.conversation import logs_to_dataframe
+            from src.metrics.rollups import get_rollup_store
             from src.connectors.watson_assistant import WatsonAssistant
             wa = WatsonAssistant(apikey=state.watson_args["apikey"],
                                     service_endpoint=state.watson_args["endpoint"],
                                     default_skill_id=state.watson_args["skill_id"])
-            
-            query_logs = wa.define_query_by_date(args['logs_date'][0], args['logs_date'][1])
-            logs = wa.get_logs(query=query_logs)
-            state.logs = logs_to_dataframe(logs, args['Date'])
 
-    if state.logs is not None:
-        from src.metrics.conversation import get_metrics, gen_plotly_datetime
-        
-        df_logs = state.logs
-        
-        metrics = get_metrics(df_logs, args)
+            # Only the days that are not in the rollups yet are requested, one day at a time.
+            store = get_rollup_store(state.watson_args["skill_id"], args['Date'],
+                                     args['Sessions'], args['Active users'],
+                                     approximate=args['approximate'], error_rate=args['error_rate'],
+                                     freq="H", resolution_intents=args['resolution_intents'])
+            truncated = []
+            for start, end in store.missing_ranges(args['logs_date'][0], args['logs_date'][1]):
+                for day, logs, complete in wa.iter_daily_logs(start, end, max_logs=args['max_logs']):
+                    df_logs = logs_to_dataframe(logs, args['Date'],
+                                                columns=[args['Sessions'], args['Active users'],
+                                                         'response.intents.0.intent'])
+                    store.update(df_logs, day, day + datetime.timedelta(days=1), complete=complete)
+                    if not complete:
+                        truncated.append(str(day))
+
+            if len(truncated) > 0:
+                st.warning("These days reached {} logs and only the newest ones are included, "
+                           "they will be fetched again: {}.".format(args['max_logs'], ", ".join(truncated)))
+
+            state.conversation_metrics = {"Date": args['Date'], "Sessions": args['Sessions'],
+                                          "Active users": args['Active users'],
+                                          "approximate": args['approximate'],
+                                          "error_rate": args['error_rate'],
+                                          "resolution_intents": args['resolution_intents'],
+                                          "logs_date": args['logs_date']}
+
+    if state.conversation_metrics is not None:
+        import pytz
+        from src.metrics.conversation import gen_plotly_datetime, FREQUENCIES
+        from src.metrics.rollups import get_rollup_store
+
+        params = state.conversation_metrics
+        store = get_rollup_store(state.watson_args["skill_id"], params['Date'],
+                                 params['Sessions'], params['Active users'],
+                                 approximate=params['approximate'], error_rate=params['error_rate'],
+                                 freq="H", resolution_intents=params['resolution_intents'])
+        start, end = params['logs_date'][0], params['logs_date'][1]
+
+        metrics = store.metrics(start, end)
+        if metrics["sessions_count"] is None:
+            st.error("Failed to get session counts.")
+        if metrics["active_users"] is None:
+            st.error('Failed to get active users. Please, check "User variable" on advanced options.')
 
         c1, c2, c3, c4 = st.columns(4)
         
@@ -51,11 +95,34 @@ def conversation_metrics_page(state):
         c3.metric(label="Avg messages per session", value=metrics["avg_messages"])
         c4.metric(label="Active users", value=metrics["active_users"])
 
-        # Plotly Datetime per day
-        fig_date_options = list(args.keys())
-        fig_date_options = [e for e in fig_date_options if e not in ['logs_date', 'Date']]
-        fig_date_option = st.selectbox('Options', fig_date_options)
-        fig_date = gen_plotly_datetime(df_logs, args, fig_date_option)
+        # Plotly Datetime per time bucket
+        c1, c2, c3 = st.columns(3)
+        fig_date_option = c1.selectbox('Options', ['Sessions', 'Active users', 'Messages'])
+        freq = FREQUENCIES[c2.selectbox('Granularity', list(FREQUENCIES.keys()), index=1)]
+        tz = c3.selectbox('Timezone', pytz.common_timezones,
+                          index=pytz.common_timezones.index('UTC'))
+
+        fig_date = gen_plotly_datetime(store.resample(start, end, freq=freq, tz=tz), fig_date_option, freq=freq)
         st.plotly_chart(fig_date, use_container_width=True)
 
+        # Session-level metrics
+        from src.metrics.sessions import gen_plotly_sessions
+        st.subheader("Sessions")
+        sessions = store.select_sessions(start, end)
+
+        c1, c2, c3 = st.columns(3)
+        c1.metric(label="Median turns per session",
+                  value=float(sessions["turns"].median()) if len(sessions) > 0 else None)
+        c2.metric(label="Median session duration (s)",
+                  value=round(float(sessions["duration_seconds"].median()), 1) if len(sessions) > 0 else None)
+        if len(params['resolution_intents']) > 0 and len(sessions) > 0:
+            c3.metric(label="Resolution rate",
+                      value=f"{sessions['turns_to_resolution'].notnull().mean():.1%}")
+
+        fig_sessions_option = st.selectbox('Session feature', ['Turns', 'Duration (seconds)', 'Turns to resolution'])
+        fig_sessions_var = {'Turns': 'turns', 'Duration (seconds)': 'duration_seconds',
+                            'Turns to resolution': 'turns_to_resolution'}[fig_sessions_option]
+        fig_sessions = gen_plotly_sessions(sessions, fig_sessions_var, title=fig_sessions_option)
+        st.plotly_chart(fig_sessions, use_container_width=True)
+
     state.sync()
\ No newline at end of file
@@ -1,6 +1,7 @@
 import streamlit as st
 import logging
 import datetime
+from src.connectors.log_sampling import SAMPLING_OPTIONS
 
 def intents_metrics_page(state):
     logging.info({"message": "Loading Metrics - Intents page."})
@@ -19,28 +20,85 @@ def intents_metrics_page(state):
     col1, col2 = st.beta_columns(2)
     args['logs_date'] = col1.date_input('Logs date', value=(start_date, end_date))
     args['Date'] = col2.selectbox('Datetime variable', ('request_timestamp', 'response_timestamp'))
+    args['sampling'] = col1.selectbox('Sampling', list(SAMPLING_OPTIONS.keys()),
+                                      help='Which 5000 logs are analyzed when the date range has more logs.')
+    args['intents'] = col2.text_input('Intents (optional)', value='',
+                                      help='Comma-separated intents, only logs with one of these intents as the top intent are analyzed.')
+    args['intents'] = [intent.strip() for intent in args['intents'].split(',') if intent.strip()]
+    args['max_logs'] = col1.number_input('Max logs per day', min_value=500, max_value=100000, value=5000, step=500,
+                                         help='Logs per day kept for the anomaly detection, days with more logs are fetched again next time.')
 
     args['threshold'] = st.slider('Threshold', min_value=0.01, max_value=1.0, value=(0.6, 1.0), step=0.01)
 
     if st.button("Get logs"):
         with st.spinner("Getting logs..."):
             from src.metrics.conversation import logs_to_dataframe
+            from src.metrics.log_frame import log_frame_to_parquet
+            from src.metrics.intents import IntentLogIndex, ambiguity_analysis
+            from src.metrics.rollups import get_intent_store, covered_days, days_between, to_utc_timestamp
             from src.connectors.watson_assistant import WatsonAssistant
-            wa = WatsonAssistant(apikey=state.watson_args["apikey"],
-                                    service_endpoint=state.watson_args["endpoint"],
-                                    default_skill_id=state.watson_args["skill_id"])
-            
-            query_logs = wa.define_query_by_date(args['logs_date'][0], args['logs_date'][1])
-            logs = wa.get_logs(query=query_logs)
-            state.logs = logs_to_dataframe(logs, args['Date'])
-
-    if state.logs is not None:
-        from src.metrics.intents import gen_plotly_intents, filter_df
-        df_logs = state.logs
+            try:
+                wa = WatsonAssistant(apikey=state.watson_args["apikey"],
+                                        service_endpoint=state.watson_args["endpoint"],
+                                        default_skill_id=state.watson_args["skill_id"])
+
+                max_logs = 5000
+                query_logs = wa.define_query(args['logs_date'][0], args['logs_date'][1], intents=args['intents'])
+                logs = wa.get_logs(query=query_logs, max_logs=max_logs, sampling=SAMPLING_OPTIONS[args['sampling']])
+                df_all = logs_to_dataframe(logs, args['Date'], columns={'response.intents': 'list'})
+
+                # The intent volumes of the anomaly detection need all logs of each day, the days fully
+                # covered by the logs above are reused, the others are requested one day at a time.
+                store = get_intent_store(state.watson_args["skill_id"], args['Date'])
+                covered = set()
+                if SAMPLING_OPTIONS[args['sampling']] is None and len(args['intents']) == 0:
+                    covered = set(covered_days(df_all['request_timestamp'], args['logs_date'][0],
+                                               args['logs_date'][1], truncated=len(logs) >= max_logs))
+                truncated = []
+                for start, end in store.missing_ranges(args['logs_date'][0], args['logs_date'][1]):
+                    for day in days_between(start, end):
+                        next_day = day + datetime.timedelta(days=1)
+                        if day in covered:
+                            day_timestamps = df_all['response_timestamp']
+                            df_day = df_all[((day_timestamps >= to_utc_timestamp(day))
+                                             & (day_timestamps < to_utc_timestamp(next_day))).to_numpy()]
+                            store.update(df_day, day, next_day)
+                            continue
+                        for _, day_logs, complete in wa.iter_daily_logs(day, next_day, max_logs=args['max_logs']):
+                            store.update(logs_to_dataframe(day_logs, args['Date']), day, next_day, complete=complete)
+                            if not complete:
+                                truncated.append(str(day))
+                if len(truncated) > 0:
+                    st.warning("These days reached {} logs and are left out of the anomaly detection, "
+                               "they will be fetched again: {}.".format(args['max_logs'], ", ".join(truncated)))
+
+                df_logs = df_all
+                if len(args['intents']) > 0:
+                    # The API filter matches the intents at any rank, only the top intent is kept.
+                    top_intent = df_logs['response.intents.0.intent'].astype('object')
+                    df_logs = df_logs[top_intent.isin(args['intents']).to_numpy()].reset_index(drop=True)
+
+                # The page state is only replaced when all the requests succeeded.
+                state.intent_log_index = IntentLogIndex(df_logs)
+                state.intent_ambiguity = ambiguity_analysis(df_logs)
+                state.intent_coverage = None
+                state.intents_metrics = {"Date": args['Date'], "logs_date": args['logs_date'],
+                                         "intents": args['intents'], "sampling": args['sampling']}
+                # Handed over as parquet bytes, cheap to hash on each rerun. All intents were used above.
+                state.logs = log_frame_to_parquet(df_logs.drop(columns=['response.intents'], errors='ignore'))
+            except Exception as error:
+                logging.error({"message": "Failed to get logs.", "exception": error})
+                st.error("Failed to get logs.")
+
+    if state.logs is not None and state.intents_metrics is not None:
+        from src.metrics.intents import gen_plotly_intents
+        from app.helper_functions import download_link
+        from src.metrics.log_frame import cached_log_frame
+        df_logs = cached_log_frame(state.logs)
 
         try:
             # Filter intents
-            columns = [col for col in df_logs.columns if 'response.intents' in col]
+            columns = [col for col in df_logs.columns if 'response.intents.' in col]
             columns = columns + ['Date', 'request.input.text']
             main_intent = 'response.intents.0.intent'
             df_logs = df_logs[df_logs[main_intent].notnull()]
@@ -53,17 +111,130 @@ def intents_metrics_page(state):
             logging.error({"message": "Failed to generate graph.", "exception": error})
             st.error("Failed to generate graph.")
 
-        # Intents export
-        df_intents = filter_df(df_logs, args["threshold"])
-        for intent in df_intents["intent"].unique():
-            try:
-                with st.expander(intent):
-                    for row in df_intents[df_intents["intent"] == intent].to_dict(orient="records"):
-                        c1, c2 = st.columns(2)
-                        c1.text(row["input"])
-                        c2.text(row["confidence"])
-            except Exception as error:
-                logging.error({"message": "Failed to generate export.", "exception": error})
-                st.error("Failed to generate export.")
+        # Confidence and ambiguity
+        from src.metrics.intents import gen_plotly_confidence, gen_plotly_margins, ambiguous_pairs
+        st.subheader("Confidence and ambiguity")
+        ambiguity = state.intent_ambiguity
+
+        c1, c2 = st.columns(2)
+        hist_intent = c1.selectbox('Confidence distribution', [None] + list(ambiguity["histograms"].index),
+                                   format_func=lambda x: "All intents" if x is None else x)
+        c1.plotly_chart(gen_plotly_confidence(ambiguity["histograms"], hist_intent), use_container_width=True)
+        max_margin = c2.slider('Max margin', min_value=0.0, max_value=1.0, value=0.1, step=0.01,
+                               help='Logs where the top-1 minus top-2 confidence is up to this margin are ambiguous.')
+        c2.plotly_chart(gen_plotly_margins(ambiguity["margins"]), use_container_width=True)
+
+        pairs = ambiguous_pairs(ambiguity["ambiguous"], max_margin)
+        st.markdown(f"**Competing intents** ({pairs['logs'].sum()} ambiguous logs)")
+        st.dataframe(pairs)
+        st.markdown("**Most ambiguous utterances**")
+        st.dataframe(ambiguity["ambiguous"][ambiguity["ambiguous"]["margin"] <= max_margin].head(100))
+
+        # Anomaly detection
+        from src.metrics.anomalies import detect_intent_anomalies, gen_plotly_anomalies, ANOMALY_METHODS
+        from src.metrics.conversation import FREQUENCIES
+        from src.metrics.rollups import get_intent_store
+        st.subheader("Anomaly detection")
+        store = get_intent_store(state.watson_args["skill_id"], state.intents_metrics["Date"])
+        history = store.loaded_range()
+        if history is None:
+            st.info("Load complete days of logs to detect anomalies.")
+        else:
+            st.markdown(f"Intent volume and mean confidence of all days loaded in this session "
+                        f"({history[0]} to {history[1] - datetime.timedelta(days=1)}), "
+                        f"compared to the previous time buckets.")
+
+            c1, c2, c3, c4 = st.columns(4)
+            freq = FREQUENCIES[c1.selectbox('Granularity', ['Hour', 'Day', 'Week'], index=1)]
+            method = c2.selectbox('Method', ANOMALY_METHODS,
+                                  format_func=lambda x: {"mad": "Rolling median/MAD", "ewma": "EWMA"}[x])
+            window = c3.number_input('Window', min_value=3, max_value=60, value=7, step=1)
+            anomaly_threshold = c4.number_input('Score threshold', min_value=1.0, max_value=10.0, value=3.5, step=0.5)
+
+            series = store.intent_series(history[0], history[1], freq=freq)
+            if len(series["volume"]) <= window:
+                st.info("Load more days to detect anomalies with this window.")
+            else:
+                anomalies = detect_intent_anomalies(series, method, int(window), anomaly_threshold)
+                st.dataframe(anomalies.head(100))
+                if len(anomalies) > 0:
+                    c1, c2 = st.columns(2)
+                    anomaly_intent = c1.selectbox('Anomalous intent', list(anomalies["intent"].unique()))
+                    anomaly_metric = c2.selectbox('Metric', ['volume', 'confidence'])
+                    st.plotly_chart(gen_plotly_anomalies(series, anomalies, anomaly_intent, anomaly_metric),
+                                    use_container_width=True)
+
+        # Training coverage
+        st.subheader("Training coverage")
+        st.markdown("Logs far from all training examples, where the skill probably needs new examples.")
+        c1, c2, c3 = st.columns(3)
+        max_similarity = c1.slider('Max similarity to the nearest example', min_value=0.0, max_value=1.0,
+                                   value=0.5, step=0.05)
+        max_clusters = c2.number_input('Max clusters per intent', min_value=1, max_value=20, value=5, step=1)
+        coverage_max_logs = c3.number_input('Max logs compared', min_value=1000, max_value=100000, value=20000,
+                                            step=1000, help='Logs of the date range requested for the comparison.')
+        if st.button("Compare with training examples"):
+            with st.spinner("Searching nearest examples..."):
+                from src.intents.coverage import coverage_analysis
+                from src.connectors.watson_assistant import WatsonAssistant
+                from src.metrics.conversation import logs_to_dataframe
+                try:
+                    wa = WatsonAssistant(apikey=state.watson_args["apikey"],
+                                         service_endpoint=state.watson_args["endpoint"],
+                                         default_skill_id=state.watson_args["skill_id"])
+                    training = wa.get_intents()
+
+                    # The inputs are requested apart, with more logs than the ones loaded above.
+                    params = state.intents_metrics
+                    query_logs = wa.define_query(params['logs_date'][0], params['logs_date'][1],
+                                                 intents=params['intents'], has_text=True)
+                    logs = wa.get_logs(query=query_logs, max_logs=coverage_max_logs,
+                                       sampling=SAMPLING_OPTIONS[params['sampling']])
+                    df_inputs = logs_to_dataframe(logs, params['Date'])
+                    if len(params['intents']) > 0:
+                        df_inputs = df_inputs[df_inputs['response.intents.0.intent'].astype('object').isin(params['intents'])]
+                    df_inputs = df_inputs[df_inputs['request.input.text'].notnull()]
+                    state.intent_coverage = coverage_analysis(df_inputs['request.input.text'].tolist(),
+                                                              df_inputs['response.intents.0.intent'].tolist(),
+                                                              training["examples"], training["intents"])
+                except Exception as error:
+                    logging.error({"message": "Failed to compute training coverage.", "exception": error})
+                    st.error("Failed to compute training coverage.")
+
+        if state.intent_coverage is not None:
+            import pandas as pd
+            from src.intents.coverage import low_coverage_clusters
+            df_coverage = state.intent_coverage
+            df_low = df_coverage[df_coverage["similarity"] < max_similarity]
+            st.write("Low coverage logs: {} of {}".format(len(df_low), len(df_coverage)))
+            # Kept while the coverage and parameters don't change, the page runs again on each interaction.
+            clusters_key = (int(pd.util.hash_pandas_object(df_coverage, index=False).sum()), max_similarity, max_clusters)
+            if state.intent_low_coverage is None or state.intent_low_coverage["key"] != clusters_key:
+                clusters = low_coverage_clusters(df_coverage, max_similarity, max_clusters)
+                state.intent_low_coverage = {"key": clusters_key, "clusters": clusters}
+            st.dataframe(state.intent_low_coverage["clusters"])
+            st.markdown(download_link(df_low.sort_values(by="similarity"), "low_coverage.csv", "Download CSV"),
+                        unsafe_allow_html=True)
+
+        # Logs browser
+        st.subheader("Logs by intent")
+        index = state.intent_log_index
+        counts = index.counts(args["threshold"])
+        intents = [intent for intent, count in sorted(counts.items(), key=lambda x: -x[1]) if count > 0]
+
+        c1, c2, c3 = st.columns([2, 2, 1])
+        intent = c1.selectbox('Intent', [None] + intents,
+                              format_func=lambda x: "All intents" if x is None else f"{x} ({counts[x]})")
+        query = c2.text_input('Search')
+        page_size = c3.selectbox('Rows per page', [10, 25, 50, 100], index=1)
+
+        positions = index.search(intent, args["threshold"], query)
+        n_pages = max(1, -(-len(positions) // page_size))
+        page = st.number_input(f'Page (of {n_pages})', min_value=1, max_value=n_pages, value=1, step=1)
+
+        st.dataframe(index.page(positions, page - 1, page_size))
+        if st.button(f"Export {len(positions)} logs"):
+            st.markdown(download_link(index.rows.iloc[positions], "intents.csv", "Download CSV"),
+                        unsafe_allow_html=True)
 
     state.sync()
\ No newline at end of file
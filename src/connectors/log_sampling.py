@@ -0,0 +1,138 @@
+import random
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+
+SAMPLING_MODES = ["reservoir", "day", "intent"]
+# Sampling options shown on the pages, None keeps the newest logs.
+SAMPLING_OPTIONS = {"Newest logs": None, "Uniform over the date range": "reservoir",
+                    "Same size per day": "day", "Same size per top intent": "intent"}
+
+
+def log_day(log):
+    return (log.get("response_timestamp") or log.get("request_timestamp") or "")[:10]
+
+
+def log_top_intent(log):
+    try:
+        return log["response"]["intents"][0]["intent"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+class ReservoirSampler:
+    def __init__(self, size: int, seed=None):
+        """
+        Uniform sample of a stream of logs with a bounded memory (reservoir sampling, algorithm R).
+
+        Arguments:
+        - size (int, required): sample size.
+        - seed (int or str, optional): random seed.
+        """
+        self.size = size
+        self.seen = 0
+        self.sample = []
+        self._random = random.Random(seed)
+
+    def add(self, logs):
+        for log in logs:
+            if len(self.sample) < self.size:
+                self.sample.append(log)
+            else:
+                j = self._random.randrange(self.seen + 1)
+                if j < self.size:
+                    self.sample[j] = log
+            self.seen += 1
+        return self
+
+    def resize(self, size):
+        """
+        Reduce the sample size, a random subset of a uniform sample is still uniform.
+        """
+        if size < len(self.sample):
+            self.sample = self._random.sample(self.sample, size)
+        self.size = size
+        return self
+
+    def result(self):
+        return list(self.sample)
+
+
+class StratifiedSampler:
+    def __init__(self, size: int, key, seed: int = None):
+        """
+        Sample of a stream of logs with the same size for each stratum (e.g. day or top intent).
+
+        A reservoir is kept per stratum and, when a new stratum is found, all reservoirs are
+        reduced to size / strata (rounded up), so the memory is bounded by size plus the strata.
+        The result has at most size logs, see allocation().
+
+        Arguments:
+        - size (int, required): total sample size.
+        - key (callable, required): returns the stratum of a log, e.g. log_day or log_top_intent.
+        - seed (int, optional): random seed.
+        """
+        self.size = size
+        self.key = key
+        self.seed = seed
+        self.strata = {}
+
+    def add(self, logs):
+        for log in logs:
+            stratum = self.key(log)
+            if stratum not in self.strata:
+                seed = None if self.seed is None else f"{self.seed}-{stratum}"
+                self.strata[stratum] = ReservoirSampler(self.size, seed=seed)
+                capacity = -(-self.size // len(self.strata))
+                for sampler in self.strata.values():
+                    sampler.resize(capacity)
+            self.strata[stratum].add([log])
+        return self
+
+    @property
+    def seen(self):
+        return sum(sampler.seen for sampler in self.strata.values())
+
+    def counts(self):
+        """
+        Logs seen per stratum, to weight the sample back to the population.
+        """
+        return {stratum: sampler.seen for stratum, sampler in self.strata.items()}
+
+    def allocation(self):
+        """
+        Sample size per stratum: size / strata, the remainder goes to the largest strata,
+        so with more strata than size the smallest ones are left out.
+        """
+        base, remainder = divmod(self.size, max(1, len(self.strata)))
+        largest = sorted(self.strata, key=lambda stratum: -self.strata[stratum].seen)
+        return {stratum: base + (i < remainder) for i, stratum in enumerate(largest)}
+
+    def result(self):
+        allocation = self.allocation()
+        return [log for stratum, sampler in self.strata.items()
+                for log in sampler.resize(allocation[stratum]).sample]
+
+
+def get_sampler(mode: str, size: int, seed: int = None):
+    """
+    Create a log sampler for WatsonAssistant.get_logs().
+
+    Arguments:
+    - mode (str, required): "reservoir" (uniform over the date range), "day" or "intent" (stratified).
+    - size (int, required): sample size.
+    - seed (int, optional): random seed.
+
+    Output:
+    - ReservoirSampler or StratifiedSampler object.
+    """
+
+    if mode == "reservoir":
+        return ReservoirSampler(size, seed=seed)
+    if mode == "day":
+        return StratifiedSampler(size, log_day, seed=seed)
+    if mode == "intent":
+        return StratifiedSampler(size, log_top_intent, seed=seed)
+
+    logger.error({"message": "Invalid sampling mode.", "mode": mode})
+    raise ValueError(f"Invalid sampling mode: {mode}. Use one of {SAMPLING_MODES}.")
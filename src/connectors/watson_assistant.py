@@ -6,6 +6,7 @@ from tryagain import retries
 import datetime
 import pandas as pd
 from src.helper_functions import setup_logger
+from src.connectors.log_sampling import get_sampler
 
 logger = setup_logger()
 
@@ -311,7 +312,54 @@ class WatsonAssistant:
             start=start_date, end=end_date)
         return query
 
-    def get_logs(self, skill_id: str = None, query: str = None, sort: str = "-request_timestamp", max_logs: int = 5000):
+    def define_query(self, start_date: datetime.datetime, end_date: datetime.datetime, intents: list = None,
+                     confidence: tuple = None, language: str = None, has_text: bool = False, text: str = None):
+        """
+        Helper function to push page filters down to the Watson API query, so fewer logs are downloaded.
+
+        Arguments:
+        - start_date (pandas.TimeStamp or datetime.datetime, required): see define_query_by_date().
+        - end_date (pandas.TimeStamp or datetime.datetime, required): see define_query_by_date().
+        - intents (list, optional): logs with any of these intents.
+        - confidence (tuple, optional): (min, max) intent confidence, e.g. (0.3, 0.6). Bounds of 0 and 1 are left out.
+        - language (str, optional): skill language, e.g. "en".
+        - has_text (bool, optional, default is False): only logs with a user input text, e.g. leaves out the
+        welcome node requests.
+        - text (str, optional): logs whose user input contains this text.
+
+        Output:
+        - Watson API query as str object, the filters are combined with AND.
+        """
+
+        filters = [self.define_query_by_date(start_date, end_date)]
+
+        if intents:
+            filters.append("response.intents:({})".format("|".join("intent::" + intent for intent in intents)))
+
+        if confidence is not None:
+            bounds = []
+            if confidence[0] > 0:
+                bounds.append("confidence>={}".format(confidence[0]))
+            if confidence[1] < 1:
+                bounds.append("confidence<={}".format(confidence[1]))
+            if len(bounds) > 0:
+                filters.append("response.intents:({})".format(",".join(bounds)))
+
+        if language:
+            filters.append("language::{}".format(language))
+
+        if has_text:
+            filters.append('request.input.text::!""')
+
+        if text:
+            filters.append('request.input.text:"{}"'.format(text.replace('"', '\\"')))
+
+        query = ",".join(filters)
+        logger.info({"message": "Query defined.", "query": query})
+        return query
+
+    def get_logs(self, skill_id: str = None, query: str = None, sort: str = "-request_timestamp", max_logs: int = 5000,
+                 sampling: str = None, seed: int = None):
         """
 
         Arguments:
@@ -319,6 +367,10 @@ class WatsonAssistant:
         - query (str, optional, default is None and will return logs for last 7 days): The query to be passed to Watson API, see IBM Cloud docs for more details.
         - sort (str, optional, default is "-request_timestamp"): The sort parameter to be passed to Watson API, see IBM Cloud docs for more details.
         - max_logs (int, optional, default is 5000): The max quantity of logs to be collected.
+        - sampling (str, optional, default is None): Instead of the first max_logs logs, read all pages of the query
+        and keep a sample of max_logs logs: "reservoir" (uniform over the date range), "day" or "intent"
+        (same sample size per day or per top intent). See src.connectors.log_sampling.
+        - seed (int, optional): random seed of the sampling.
 
         Output:
         - A list with logs requested.
@@ -327,7 +379,8 @@ class WatsonAssistant:
         if skill_id == None:
             skill_id = self.default_skill_id
 
-        logger.info({"message": "Getting logs from Watson Assistant.", "skill_id": skill_id, "query": query, "sort": sort, "max_logs": max_logs})
+        logger.info({"message": "Getting logs from Watson Assistant.", "skill_id": skill_id, "query": query, "sort": sort,
+                     "max_logs": max_logs, "sampling": sampling})
 
         if query == None:
             # query for last 7 days
@@ -335,10 +388,12 @@ class WatsonAssistant:
             start_date = end_date - datetime.timedelta(days=7)
             query = self.define_query_by_date(start_date, end_date)
 
+        sampler = get_sampler(sampling, max_logs, seed=seed) if sampling is not None else None
+
         logs = []
         try:
             current_cursor = None
-            while max_logs > 0:
+            while max_logs > 0 or sampler is not None:
                 response = self.assistant.list_logs(
                     workspace_id=skill_id,
                     page_limit=500,
@@ -347,9 +402,12 @@ class WatsonAssistant:
                     filter=query
                 ).get_result()
 
-                min_num = min(max_logs, len(response['logs']))
-                logs.extend(response['logs'][:min_num])
-                max_logs = max_logs - min_num
+                if sampler is not None:
+                    sampler.add(response['logs'])
+                else:
+                    min_num = min(max_logs, len(response['logs']))
+                    logs.extend(response['logs'][:min_num])
+                    max_logs = max_logs - min_num
                 current_cursor = None
 
                 if 'pagination' in response:
@@ -357,6 +415,8 @@ class WatsonAssistant:
                         current_cursor = response['pagination']['next_cursor']
                     else:
                         break
+                else:
+                    break
                 
         except WatsonApiException:
             logger.error({"message": "You've reached the rate limit of log api, refer to https://www.ibm.com/watson/developercloud/assistant/api/v1/curl.html?curl#list-logs for additional information."})
@@ -366,6 +426,36 @@ class WatsonAssistant:
             logger.error({"message": "Failed to get logs from Watson Assistant.", "exception": error, "skill_id": skill_id, "query": query})
             raise Exception(error)      
 
+        if sampler is not None:
+            logs = sampler.result()
+            logger.info({"message": "Logs sampled.", "sampling": sampling, "seen": sampler.seen, "sampled": len(logs)})
+
         self.watson_logs = logs
         return logs
      
+
+    def iter_daily_logs(self, start_date: datetime.date, end_date: datetime.date, skill_id: str = None,
+                        max_logs: int = 5000):
+        """
+        Get the logs of [start_date, end_date) with one query per day, so a busy day can't hide the others.
+
+        Arguments:
+        - start_date (datetime.date, required): first day.
+        - end_date (datetime.date, required): day after the last one, like define_query_by_date().
+        - skill_id (str, optional, default will be provided by class): The skill/worksapce id of your Watson Assistant.
+        - max_logs (int, optional, default is 5000): The max quantity of logs collected per day.
+
+        Output:
+        - A generator of (day, logs, complete) tuples, complete is False when the day reached max_logs logs,
+        so only the newest ones may have been collected.
+        """
+
+        day = start_date
+        while day < end_date:
+            next_day = day + datetime.timedelta(days=1)
+            logs = self.get_logs(skill_id=skill_id, query=self.define_query_by_date(day, next_day), max_logs=max_logs)
+            complete = len(logs) < max_logs
+            if not complete:
+                logger.info({"message": "Logs of the day truncated.", "day": str(day), "max_logs": max_logs})
+            yield day, logs, complete
+            day = next_day
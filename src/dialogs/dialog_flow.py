@@ -5,12 +5,23 @@
 # Project: https://github.com/watson-developer-cloud/assistant-dialog-flow-analysis/
 # License: Apache 2.0 license.
 
+import io
+import os
+import gzip
 import json
+import base64
+import zlib
+import threading
+import itertools
+import collections
+import concurrent.futures
 import pandas as pd
 from conversation_analytics_toolkit import analysis
 from conversation_analytics_toolkit import transformation
-from conversation_analytics_toolkit import wa_assistant_skills
 from src.helper_functions import setup_logger
+from src.metrics.rollups import days_between, missing_ranges
+from src.dialogs.node_index import get_node_index, workspace_version
+from src.dialogs.node_metrics import NODE_METRIC_COLUMNS, node_metrics, merge_node_metrics
 
 logger = setup_logger()
 
@@ -162,7 +173,9 @@ _html_template = """
           node.data.dropped_off = undefined;
           node.data.dropped_offRatio = NaN;
         }} else if (node.children) {{
-          if (node.children.length > _config.maxChildrenInNode) {{
+          // "other" nodes from the server already merge the pruned children.
+          var nodeChildren = node.children.filter(function (child) {{ return child.data.type != "other"; }});
+          if (nodeChildren.length > _config.maxChildrenInNode) {{
             var topChildren = node.children.slice(0, _config.maxChildrenInNode);
             var otherChildren = node.children.slice(_config.maxChildrenInNode);
 
@@ -695,7 +708,9 @@ _html_template = """
         _chart.selectedD3Node.node().classList.add("selected");
 
         updateInfoDiv();
-        var selection = {{ "dropped_off": [], "rerouted": [], "name": _chart.selectedNode.name, "path": _chart.selectedNode.path }};
+        // The log id lists are a sample of at most MAX_LOG_IDS ids, the counts are the node totals.
+        var selection = {{ "dropped_off": [], "rerouted": [], "dropped_off_count": _chart.selectedNode.dropped_off || 0,
+                          "rerouted_count": _chart.selectedNode.rerouted || 0, "name": _chart.selectedNode.name, "path": _chart.selectedNode.path }};
         if (_chart.selectedNode.hasOwnProperty("conversation_log_ids_dropped_off"))
           selection.dropped_off = _chart.selectedNode.conversation_log_ids_dropped_off;
         if (_chart.selectedNode.hasOwnProperty("conversation_log_ids_rerouted"))
@@ -745,9 +760,20 @@ _html_template = """
     if (config["debugger"] === true) {{
       debugger;
     }};
-    var chart = draw(element, config, {data});
-    chart.on("export", function (e) {{
-      var selection = JSON.stringify(e.selection).replace(/"/g, "'");
+    // The flow data can be shipped as a base64 gzip string, decompressed by the browser.
+    function loadData(payload) {{
+      if (typeof payload !== "string")
+        return Promise.resolve(payload);
+      var bytes = Uint8Array.from(atob(payload), function (c) {{ return c.charCodeAt(0); }});
+      var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+      return new Response(stream).text().then(JSON.parse);
+    }}
+
+    loadData({data}).then(function (data) {{
+      var chart = draw(element, config, data);
+      chart.on("export", function (e) {{
+        var selection = JSON.stringify(e.selection).replace(/"/g, "'");
+      }});
     }});
   </script>
 </body>
@@ -756,33 +782,405 @@ _html_template = """
 """
 
 
-def prepare_data(logs, skill_id, workspace):
+FLOW_COLUMNS = ['path', 'name', 'type', 'is_conversation_start', 'flows', 'rerouted', 'dropped_off',
+                'conversation_log_ids_rerouted', 'conversation_log_ids_dropped_off', 'path_length']
+FLOW_CACHE_SIZE = 4
+# Log ids of the drop-offs and reroutes kept per node in the report, the counts are kept apart.
+MAX_LOG_IDS = 100
+# Below this number of logs the shards are processed in the current process.
+MIN_PARALLEL_LOGS = 2000
+
+_flow_caches = collections.OrderedDict()
+_flow_caches_lock = threading.Lock()
 
-    logger.info(
-        {"message": "Preparing data for dialog flow.", "skill_id": skill_id})
+
+def canonical_logs(logs, skill_id, workspace):
+    """
+    Transform Watson Assistant logs into the canonical data model of conversation_analytics_toolkit.
+    """
+
+    logger.info({"message": "Canonicalizing logs.", "skill_id": skill_id, "logs": len(logs)})
 
     df_logs = pd.DataFrame(logs)
+    if len(df_logs) == 0:
+        return df_logs
+
+    assistant_skills = get_node_index(workspace).assistant_skills(skill_id)
+
+    return transformation.to_canonical_WA_v2(df_logs, assistant_skills,
+                                             skill_id_field=None, include_nodes_visited_str_types=True,
+                                             include_context=False)
+
+
+def aggregate_canonical(df_canonical):
+    """
+    Turn-based flows of canonical logs, an empty DataFrame with FLOW_COLUMNS if there are no logs.
+    """
+    if len(df_canonical) == 0:
+        return pd.DataFrame(columns=FLOW_COLUMNS)
+
+    return analysis.aggregate_flows(df_canonical.copy(deep=False), mode="turn-based",
+                                    on_column="turn_label", max_depth=400, trim_reroutes=False)
+
+
+def merge_flows(frames):
+    """
+    Merge flows from aggregate_flows() of disjoint sets of conversations.
+
+    The counts are added and the log id lists are concatenated by path.
+
+    Arguments:
+    - frames (list, required): DataFrames with FLOW_COLUMNS.
+
+    Output:
+    - DataFrame with FLOW_COLUMNS.
+    """
+
+    frames = [frame for frame in frames if len(frame) > 0]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=FLOW_COLUMNS)
+    if len(frames) == 1:
+        return frames[0]
+
+    df = pd.concat(frames, ignore_index=True)
+    merged = df.groupby("path", sort=False).agg(
+        name=("name", "first"),
+        type=("type", "first"),
+        is_conversation_start=("is_conversation_start", "first"),
+        flows=("flows", "sum"),
+        rerouted=("rerouted", "sum"),
+        dropped_off=("dropped_off", "sum"),
+        conversation_log_ids_rerouted=("conversation_log_ids_rerouted", lambda x: [i for ids in x for i in ids]),
+        conversation_log_ids_dropped_off=("conversation_log_ids_dropped_off", lambda x: [i for ids in x for i in ids]),
+        path_length=("path_length", "first"))
+
+    return merged.reset_index()[FLOW_COLUMNS]
+
+
+def conversation_shards(logs, n_shards):
+    """
+    Split logs into n_shards lists, all logs of a conversation go to the same shard.
+    """
+    shards = [[] for _ in range(n_shards)]
+    for log in logs:
+        try:
+            conversation_id = log["response"]["context"]["conversation_id"]
+        except (KeyError, TypeError):
+            conversation_id = log.get("log_id", "")
+        shards[zlib.crc32(str(conversation_id).encode("utf-8")) % n_shards].append(log)
+    return [shard for shard in shards if len(shard) > 0]
+
+
+def conversation_days(df_canonical):
+    """
+    Day (UTC) of the first turn of the conversation of each canonical log, so a conversation
+    that crosses midnight belongs to a single day.
+    """
+    timestamps = pd.to_datetime(df_canonical["response_timestamp"], utc=True)
+    first_turns = timestamps.groupby(df_canonical["conversation_id"].to_numpy()).transform("min")
+    return first_turns.fillna(timestamps).dt.date
+
+
+def process_shard(logs, skill_id, workspace, by_day=True):
+    """
+    Canonicalize a shard of logs and aggregate its flows per day (UTC) of the conversations' first turn.
+
+    Output:
+    - A tuple with the canonical logs and a dict with datetime.date as key and flows as value.
+    If by_day is False, the flows of all logs are returned with None as key.
+    """
+    df_canonical = canonical_logs(logs, skill_id, workspace)
+    if len(df_canonical) == 0:
+        return df_canonical, {}
+    if not by_day:
+        return df_canonical, {None: aggregate_canonical(df_canonical)}
 
-    assistant_skills = wa_assistant_skills.WA_Assistant_Skills()
-    assistant_skills.add_skill(skill_id, workspace)
+    log_days = conversation_days(df_canonical)
+    flows = {day: aggregate_canonical(df_day) for day, df_day in df_canonical.groupby(log_days.to_numpy())}
+    return df_canonical, flows
 
-    df_logs_canonical = transformation.to_canonical_WA_v2(df_logs, assistant_skills,
-                                                          skill_id_field=None, include_nodes_visited_str_types=True,
-                                                          include_context=False)
 
-    df_logs_to_analyze = df_logs_canonical.copy(deep=False)
+def process_logs(logs, skill_id, workspace, n_jobs=None, by_day=True):
+    """
+    Canonicalize logs and aggregate their flows per day, with conversation shards in a process pool.
 
-    turn_based_path_flows = analysis.aggregate_flows(df_logs_to_analyze, mode="turn-based",
-                                                     on_column="turn_label", max_depth=400, trim_reroutes=False)
+    Conversations are independent, so the flows of the shards are merged with merge_flows().
 
-    return json.loads(turn_based_path_flows.to_json(orient='records'))
+    Arguments:
+    - logs (list, required): Watson Assistant logs.
+    - skill_id (str, required): Watson Assistant skill id.
+    - workspace (dict, required): workspace export.
+    - n_jobs (int, optional, default is the number of CPUs): processes, 1 runs in the current process.
+    - by_day (bool, optional, default is True): aggregate the flows per day, see process_shard().
 
+    Output:
+    - A tuple with the canonical logs and a dict with datetime.date as key and flows as value.
+    """
 
-def generate_html_report(config, data):
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if len(logs) < MIN_PARALLEL_LOGS:
+        n_jobs = 1
+
+    logger.info({"message": "Processing logs for dialog flow.", "skill_id": skill_id,
+                 "logs": len(logs), "n_jobs": n_jobs})
+
+    if n_jobs == 1:
+        return process_shard(logs, skill_id, workspace, by_day)
+
+    shards = conversation_shards(logs, n_jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        results = list(executor.map(process_shard, shards, [skill_id] * len(shards),
+                                    [workspace] * len(shards), [by_day] * len(shards)))
+
+    canonical = [df_canonical for df_canonical, _ in results if len(df_canonical) > 0]
+    df_canonical = pd.concat(canonical, ignore_index=True) if len(canonical) > 0 else pd.DataFrame()
+
+    days = collections.defaultdict(list)
+    for _, flows in results:
+        for day, df_flows in flows.items():
+            days[day].append(df_flows)
+
+    return df_canonical, {day: merge_flows(frames) for day, frames in days.items()}
+
+
+def flows_to_records(df_flows):
+    return json.loads(df_flows.to_json(orient='records'))
+
+
+def prepare_data(logs, skill_id, workspace, n_jobs=None):
+
+    logger.info(
+        {"message": "Preparing data for dialog flow.", "skill_id": skill_id})
+
+    _, flows = process_logs(logs, skill_id, workspace, n_jobs=n_jobs, by_day=False)
+    turn_based_path_flows = flows.get(None, pd.DataFrame(columns=FLOW_COLUMNS))
+
+    return flows_to_records(turn_based_path_flows)
+
+
+class FlowCache:
+    def __init__(self, skill_id, workspace, n_jobs=None):
+        """
+        Canonical logs, flows and dialog node metrics of a skill workspace version per day, so a report
+        of a date range only processes the days that were not processed yet.
+
+        Conversations belong to the day of their first turn, so the logs of a date range must include the
+        day before (to leave out the conversations that started then) and the day after (to complete the
+        conversations that cross the last midnight), see update().
+
+        Arguments:
+        - skill_id (str, required): Watson Assistant skill id.
+        - workspace (dict, required): workspace export, from WatsonAssistant.get_workspace().
+        - n_jobs (int, optional, default is the number of CPUs): processes used by process_logs().
+        """
+
+        logger.info({"message": "Instantiate FlowCache.", "skill_id": skill_id})
+
+        self.skill_id = skill_id
+        self.workspace = workspace
+        self.n_jobs = n_jobs
+        self.days = {}
+        self.loaded_days = set()
+        self._lock = threading.Lock()
+
+    def missing_ranges(self, start_date, end_date):
+        """
+        Date ranges [start, end) that were not processed yet, see src.metrics.rollups.missing_ranges().
+        """
+        with self._lock:
+            loaded_days = set(self.loaded_days)
+        return missing_ranges(loaded_days, start_date, end_date)
+
+    def update(self, logs, start_date, end_date, complete=True):
+        """
+        Canonicalize the logs and aggregate the flows and node metrics of the conversations started in each day
+        of [start_date, end_date).
+
+        Arguments:
+        - logs (list, required): all logs of the date range, the day before and the day after.
+        - start_date (datetime.date, required): first day.
+        - end_date (datetime.date, required): day after the last one.
+        - complete (bool or set, optional, default is True): False when logs may miss logs of the range (e.g. the
+        fetch reached max_logs), or the days of the range whose logs are all included. The other days are replaced
+        but not marked as loaded, so they are processed again.
+        """
+
+        logger.info({"message": "Updating flow cache.", "start_date": str(start_date),
+                     "end_date": str(end_date), "logs": len(logs)})
+
+        df_canonical, flows = process_logs(logs, self.skill_id, self.workspace, n_jobs=self.n_jobs)
+        days = {day: {"canonical": df_canonical.iloc[:0], "flows": pd.DataFrame(columns=FLOW_COLUMNS),
+                      "nodes": pd.DataFrame(columns=NODE_METRIC_COLUMNS)}
+                for day in days_between(start_date, end_date)}
+
+        if len(df_canonical) > 0:
+            node_index = get_node_index(self.workspace)
+            log_days = conversation_days(df_canonical)
+            for day, df_day in df_canonical.groupby(log_days.to_numpy()):
+                if day in days:
+                    days[day] = {"canonical": df_day, "flows": flows[day],
+                                 "nodes": node_metrics(df_day, node_index)}
+
+        if isinstance(complete, bool):
+            complete = set(days.keys()) if complete else set()
+        with self._lock:
+            self.days.update(days)
+            self.loaded_days.update(day for day in days.keys() if day in complete)
+            self.loaded_days.difference_update(day for day in days.keys() if day not in complete)
+
+    def canonical(self, start_date, end_date):
+        """
+        Canonical logs of the conversations started in [start_date, end_date).
+        """
+        with self._lock:
+            frames = [self.days[day]["canonical"] for day in days_between(start_date, end_date) if day in self.days]
+        if len(frames) == 0:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def flows(self, start_date, end_date):
+        """
+        Flows of [start_date, end_date) merged from the days, see merge_flows().
+        """
+        with self._lock:
+            frames = [self.days[day]["flows"] for day in days_between(start_date, end_date) if day in self.days]
+        return merge_flows(frames)
+
+    def node_metrics(self, start_date, end_date):
+        """
+        Dialog node metrics of [start_date, end_date) summed from the days, see src.dialogs.node_metrics.
+        """
+        with self._lock:
+            frames = [self.days[day]["nodes"] for day in days_between(start_date, end_date) if day in self.days]
+        return merge_node_metrics(frames)
+
+
+def get_flow_cache(skill_id, workspace):
+    """
+    Return the FlowCache of a skill workspace version, it's kept while the app is running.
+    The last FLOW_CACHE_SIZE versions are kept, a new workspace version starts an empty cache.
+    """
+
+    key = (skill_id, workspace_version(workspace))
+    with _flow_caches_lock:
+        if key in _flow_caches:
+            _flow_caches.move_to_end(key)
+        else:
+            _flow_caches[key] = FlowCache(skill_id, workspace)
+            if len(_flow_caches) > FLOW_CACHE_SIZE:
+                _flow_caches.popitem(last=False)
+        return _flow_caches[key]
+
+
+def prune_flows(df_flows, max_children=5, min_flows=1, sort_by="flows", max_log_ids=MAX_LOG_IDS):
+    """
+    Keep the flows that the report can show: the top max_children children of each node
+    with at least min_flows visits. The other children of a node are merged into a single
+    "others" node, so the visits and ratios of the report don't change, and their descendants are dropped.
+    The log id lists are cut to max_log_ids per node, "dropped_off" and "rerouted" keep the counts.
+
+    Arguments:
+    - df_flows (pd.DataFrame, required): flows with FLOW_COLUMNS.
+    - max_children (int, optional, default is 5): "maxChildrenInNode" of the report.
+    - min_flows (int, optional, default is 1): minimum visits of a node.
+    - sort_by (str, optional, default is "flows"): "sortByAttribute" of the report.
+    - max_log_ids (int, optional, default is MAX_LOG_IDS): log ids kept per node and list.
+
+    Output:
+    - DataFrame with FLOW_COLUMNS.
+    """
+
+    logger.info({"message": "Pruning flows.", "paths": len(df_flows), "max_children": max_children,
+                 "min_flows": min_flows, "sort_by": sort_by})
+
+    if len(df_flows) == 0:
+        return df_flows
+
+    max_children = max(1, int(max_children))
+    df = df_flows.copy()
+    df["parent"] = df["path"].str.rpartition("\\")[0]
+    df["depth"] = df["path"].str.count(r"\\")
+
+    if sort_by in ("flowRatio", "flows"):
+        df["sort_key"] = df["flows"]
+    elif sort_by == "dropped_offRatio":
+        df["sort_key"] = df["dropped_off"] / df["flows"].where(df["flows"] > 0)
+    else:
+        df["sort_key"] = df[sort_by]
+
+    kept, others = [], []
+    parents = {""}
+    for depth, df_depth in df.sort_values(by=["depth", "sort_key"], ascending=[True, False],
+                                          kind="mergesort").groupby("depth", sort=True):
+        df_depth = df_depth[df_depth["parent"].isin(parents)]
+        if len(df_depth) == 0:
+            break
+
+        rank = df_depth.groupby("parent").cumcount()
+        keep = (rank < max_children) & (df_depth["flows"] >= min_flows)
+
+        kept.append(df_depth[keep])
+        others.append(df_depth[~keep])
+        parents = set(df_depth.loc[keep, "path"])
+
+    df_kept = pd.concat(kept)
+    df_others = pd.concat(others)
+    if len(df_others) > 0:
+        df_others = df_others.groupby("parent", sort=False).agg(
+            count=("path", "size"),
+            is_conversation_start=("is_conversation_start", "first"),
+            flows=("flows", "sum"),
+            rerouted=("rerouted", "sum"),
+            dropped_off=("dropped_off", "sum"),
+            conversation_log_ids_rerouted=("conversation_log_ids_rerouted",
+                                           lambda x: list(itertools.islice((i for ids in x for i in ids), max_log_ids))),
+            conversation_log_ids_dropped_off=("conversation_log_ids_dropped_off",
+                                              lambda x: list(itertools.islice((i for ids in x for i in ids), max_log_ids))),
+            path_length=("path_length", "first")).reset_index()
+        df_others["name"] = df_others["count"].astype(str) + " others ..."
+        df_others["path"] = (df_others["parent"] + "\\").where(df_others["parent"] != "", "") + df_others["name"]
+        df_others["type"] = "other"
+        df_kept = pd.concat([df_kept, df_others])
+
+    df_kept = df_kept[FLOW_COLUMNS].reset_index(drop=True)
+    for column in ["conversation_log_ids_rerouted", "conversation_log_ids_dropped_off"]:
+        df_kept[column] = [list(ids[:max_log_ids]) for ids in df_kept[column]]
+    return df_kept
+
+
+def compress_data(data):
+    """
+    Encode data as JSON, gzip and base64, the JSON is written to gzip in chunks.
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as f:
+        for chunk in json.JSONEncoder().iterencode(data):
+            f.write(chunk.encode("utf-8"))
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def generate_html_report(config, data, min_flows=1, compress=True):
+    """
+    Generate the Dialog Flow HTML report.
+
+    Arguments:
+    - config (dict, required): report config, "maxChildrenInNode" and "sortByAttribute" are used to prune the flows.
+    - data (list, required): flows records, from prepare_data() or flows_to_records().
+    - min_flows (int, optional, default is 1): minimum visits of a node, see prune_flows().
+    - compress (bool, optional, default is True): ship the flows as gzip, decompressed by the browser.
+
+    Output:
+    - HTML report as str object.
+    """
 
     logger.info({"message": "Generating HTML report for Dialog Flow."})
-    
+
+    df_flows = prune_flows(pd.DataFrame(data, columns=FLOW_COLUMNS), config.get("maxChildrenInNode", 5),
+                           min_flows=min_flows, sort_by=config.get("sortByAttribute", "flows"))
+    data = flows_to_records(df_flows)
+
     config = json.dumps(config)
-    data = json.dumps(data)
+    data = json.dumps(compress_data(data) if compress else data)
 
     return _html_template.format(config=config, data=data)
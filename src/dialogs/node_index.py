@@ -0,0 +1,157 @@
+import json
+import hashlib
+import threading
+import collections
+import pandas as pd
+from conversation_analytics_toolkit import wa_assistant_skills
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+
+NODE_INDEX_CACHE_SIZE = 4
+NODE_COLUMNS = ["title", "type", "conditions", "parent", "depth", "children", "path"]
+
+_node_indexes = collections.OrderedDict()
+_node_indexes_lock = threading.Lock()
+
+
+def workspace_version(workspace):
+    """
+    Version of a workspace export: its "updated" timestamp or a hash of the dialog nodes.
+    """
+    if workspace.get("updated"):
+        return workspace["updated"]
+    nodes = json.dumps(workspace.get("dialog_nodes", []), sort_keys=True)
+    return hashlib.sha1(nodes.encode("utf-8")).hexdigest()
+
+
+class DialogNodeIndex:
+    def __init__(self, workspace):
+        """
+        Index of the dialog nodes of a workspace export, built once per workspace version.
+
+        Arguments:
+        - workspace (dict, required): workspace export, from WatsonAssistant.get_workspace().
+
+        Attributes:
+        - nodes (dict): dialog node id to the node.
+        - children (dict): dialog node id to the children ids, in the dialog order (None for the root nodes).
+        - frame (pd.DataFrame): one row per dialog node id with NODE_COLUMNS, "path" is the titles from the root.
+        """
+
+        logger.info({"message": "Building dialog node index.",
+                     "dialog_nodes": len(workspace.get("dialog_nodes", []))})
+
+        self.version = workspace_version(workspace)
+        self.workspace = workspace
+        self.nodes = {node["dialog_node"]: node for node in workspace.get("dialog_nodes", [])}
+        self.children = self._build_children()
+        self._paths = {}
+        self._assistant_skills = {}
+
+        ids = list(self.nodes.keys())
+        paths = [self.path_to_root(node_id) for node_id in ids]
+        self.frame = pd.DataFrame({
+            "title": [self.title(node_id) for node_id in ids],
+            "type": [self.nodes[node_id].get("type") for node_id in ids],
+            "conditions": [self.nodes[node_id].get("conditions") for node_id in ids],
+            "parent": [self.nodes[node_id].get("parent") for node_id in ids],
+            "depth": [len(path) - 1 for path in paths],
+            "children": [len(self.children.get(node_id, [])) for node_id in ids],
+            "path": [" > ".join(self.title(i) for i in reversed(path)) for path in paths]
+        }, index=pd.Index(ids, name="dialog_node"), columns=NODE_COLUMNS)
+
+    def _build_children(self):
+        # Siblings are a linked list by "previous_sibling".
+        siblings = collections.defaultdict(list)
+        for node_id, node in self.nodes.items():
+            siblings[node.get("parent")].append(node_id)
+
+        children = {}
+        for parent, node_ids in siblings.items():
+            next_sibling = {self.nodes[node_id].get("previous_sibling"): node_id for node_id in node_ids}
+            ordered, seen, current = [], set(), next_sibling.get(None)
+            while current is not None and current not in seen:
+                ordered.append(current)
+                seen.add(current)
+                current = next_sibling.get(current)
+            ordered += [node_id for node_id in node_ids if node_id not in seen]
+            children[parent] = ordered
+        return children
+
+    def title(self, node_id):
+        """
+        Title of a node, its id when it has no title.
+        """
+        node = self.nodes.get(node_id)
+        if node is None:
+            return node_id
+        return node.get("title") or node_id
+
+    def path_to_root(self, node_id):
+        """
+        Node ids from node_id to its root node.
+        """
+        if node_id in self._paths:
+            return self._paths[node_id]
+
+        path, current = [], node_id
+        while current is not None and current not in path:
+            if current in self._paths:
+                path += self._paths[current]
+                break
+            path.append(current)
+            current = self.nodes.get(current, {}).get("parent")
+
+        self._paths[node_id] = path
+        return path
+
+    def assistant_skills(self, skill_id):
+        """
+        conversation_analytics_toolkit WA_Assistant_Skills of this workspace, built once per skill id.
+        """
+        if skill_id not in self._assistant_skills:
+            assistant_skills = wa_assistant_skills.WA_Assistant_Skills()
+            assistant_skills.add_skill(skill_id, self.workspace)
+            self._assistant_skills[skill_id] = assistant_skills
+        return self._assistant_skills[skill_id]
+
+    def join(self, df, column="nodes_visited", columns=("log_id", "conversation_id", "response_timestamp")):
+        """
+        One row per visited node of each log, joined with the node attributes.
+
+        Arguments:
+        - df (pd.DataFrame, required): canonical logs, e.g. from canonical_logs().
+        - column (str, optional, default is "nodes_visited"): list of visited node ids.
+        - columns (tuple, optional): log columns to keep.
+
+        Output:
+        - DataFrame with the log columns, "step" (position in the list), "dialog_node" and NODE_COLUMNS.
+        """
+
+        columns = [c for c in columns if c in df.columns]
+        df_temp = df[columns + [column]].reset_index(drop=True).explode(column).rename(columns={column: "dialog_node"})
+        df_temp = df_temp[df_temp["dialog_node"].notnull()]
+        df_temp["step"] = df_temp.groupby(level=0).cumcount()
+        df_temp = df_temp.reset_index(drop=True)
+
+        nodes = self.frame.reindex(df_temp["dialog_node"].to_numpy())
+        for node_column in NODE_COLUMNS:
+            df_temp[node_column] = nodes[node_column].to_numpy()
+        return df_temp
+
+
+def get_node_index(workspace):
+    """
+    Return the DialogNodeIndex of a workspace version, it's kept while the app is running.
+    """
+
+    key = (workspace.get("workspace_id"), workspace_version(workspace))
+    with _node_indexes_lock:
+        if key in _node_indexes:
+            _node_indexes.move_to_end(key)
+        else:
+            _node_indexes[key] = DialogNodeIndex(workspace)
+            if len(_node_indexes) > NODE_INDEX_CACHE_SIZE:
+                _node_indexes.popitem(last=False)
+        return _node_indexes[key]
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+
+NODE_METRIC_COLUMNS = ["dialog_node", "visits", "conversations", "dropped_off", "rerouted", "turns_sum"]
+
+
+def node_metrics(df_canonical, node_index):
+    """
+    Visits, drop-offs and reroutes of each dialog node, from the nodes visited in each log.
+
+    - visits: logs that visited the node.
+    - conversations: conversations that visited the node.
+    - dropped_off: conversations whose last visited node is the node.
+    - rerouted: turns that ended in the node, when the node has children, and the next turn
+    of the conversation didn't continue in one of its children.
+    - turns_sum: sum of the turn number (1 is the first log of the conversation) of the visits,
+    turns_sum / visits is the average turns to reach the node.
+
+    The counts are additive, so metrics of disjoint sets of conversations (e.g. days) can be summed.
+
+    Arguments:
+    - df_canonical (pd.DataFrame, required): canonical logs with "conversation_id", "response_timestamp"
+    and "nodes_visited", e.g. from canonical_logs().
+    - node_index (DialogNodeIndex, required): dialog node index of the workspace.
+
+    Output:
+    - DataFrame with NODE_METRIC_COLUMNS.
+    """
+
+    logger.info({"message": "Computing dialog node metrics.", "logs": len(df_canonical)})
+
+    if len(df_canonical) == 0:
+        return pd.DataFrame(columns=NODE_METRIC_COLUMNS)
+
+    df = df_canonical[["conversation_id", "response_timestamp", "nodes_visited"]]
+    df = df.sort_values(by=["conversation_id", "response_timestamp"], kind="mergesort").reset_index(drop=True)
+    nodes_visited = df["nodes_visited"].map(lambda nodes: nodes if isinstance(nodes, list) and len(nodes) > 0 else None)
+
+    conversations = df["conversation_id"].to_numpy()
+    same_next = np.append(conversations[1:] == conversations[:-1], False)
+    turns = df.groupby("conversation_id", sort=False).cumcount().to_numpy() + 1
+
+    # Visits
+    df_visits = pd.DataFrame({"conversation_id": conversations, "turn": turns, "dialog_node": nodes_visited})
+    df_visits["log"] = np.arange(len(df_visits))
+    df_visits = df_visits.explode("dialog_node")
+    df_visits = df_visits[df_visits["dialog_node"].notnull()].drop_duplicates(subset=["log", "dialog_node"])
+
+    grouped = df_visits.groupby("dialog_node")
+    metrics = pd.DataFrame({
+        "visits": grouped.size(),
+        "conversations": grouped["conversation_id"].nunique(),
+        "turns_sum": grouped["turn"].sum()
+    })
+
+    # Drop-offs and reroutes by the last node of each turn.
+    last_nodes = nodes_visited.map(lambda nodes: nodes[-1] if nodes else None).to_numpy()
+    first_nodes = nodes_visited.map(lambda nodes: nodes[0] if nodes else None).to_numpy()
+    next_first_nodes = np.append(first_nodes[1:], None)
+
+    # The conversation drops off in the last node of its last turn with visited nodes.
+    has_nodes = pd.notnull(last_nodes)
+    positions = np.flatnonzero(has_nodes)
+    with_nodes = conversations[positions]
+    last_turn = positions[np.append(with_nodes[1:] != with_nodes[:-1], True)]
+    dropped_off = pd.Series(last_nodes[last_turn]).value_counts()
+
+    has_children = node_index.frame["children"].reindex(last_nodes).fillna(0).to_numpy() > 0
+    next_parent = node_index.frame["parent"].reindex(next_first_nodes).to_numpy()
+    rerouted = has_nodes & same_next & pd.notnull(next_first_nodes) & has_children & (next_parent != last_nodes)
+    rerouted = pd.Series(last_nodes[rerouted]).value_counts()
+
+    metrics["dropped_off"] = dropped_off.reindex(metrics.index).fillna(0)
+    metrics["rerouted"] = rerouted.reindex(metrics.index).fillna(0)
+    metrics = metrics.astype("int64").rename_axis("dialog_node").reset_index()
+
+    return metrics[NODE_METRIC_COLUMNS]
+
+
+def merge_node_metrics(frames):
+    """
+    Sum node metrics of disjoint sets of conversations, e.g. the days of a date range.
+    """
+    frames = [df for df in frames if len(df) > 0]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=NODE_METRIC_COLUMNS)
+    df_temp = pd.concat(frames, ignore_index=True).groupby("dialog_node", sort=False).sum()
+    return df_temp.astype("int64").reset_index()[NODE_METRIC_COLUMNS]
+
+
+def summarize_node_metrics(metrics, node_index):
+    """
+    Node metrics with the node title, path and depth, the drop-off and reroute rates and the average turns to node.
+
+    Arguments:
+    - metrics (pd.DataFrame, required): from node_metrics() or merge_node_metrics().
+    - node_index (DialogNodeIndex, required): dialog node index of the workspace.
+
+    Output:
+    - DataFrame indexed by dialog node id, sorted by visits.
+    """
+
+    df_temp = metrics.set_index("dialog_node")
+    nodes = node_index.frame.reindex(df_temp.index)
+    visits = df_temp["visits"].where(df_temp["visits"] > 0)
+
+    df_summary = pd.DataFrame({
+        "title": nodes["title"].fillna(pd.Series(df_temp.index, index=df_temp.index)),
+        "path": nodes["path"],
+        "depth": nodes["depth"],
+        "visits": df_temp["visits"],
+        "conversations": df_temp["conversations"],
+        "dropped_off": df_temp["dropped_off"],
+        "drop_off_rate": df_temp["dropped_off"] / df_temp["conversations"].where(df_temp["conversations"] > 0),
+        "rerouted": df_temp["rerouted"],
+        "reroute_rate": df_temp["rerouted"] / visits,
+        "avg_turns": df_temp["turns_sum"] / visits
+    }, index=df_temp.index)
+    return df_summary.sort_values(by="visits", ascending=False, kind="mergesort")
+
+
+def node_metric_deltas(current, previous):
+    """
+    Period-over-period changes of the node metrics.
+
+    Arguments:
+    - current (pd.DataFrame, required): from summarize_node_metrics() for the selected period.
+    - previous (pd.DataFrame, required): from summarize_node_metrics() for the previous period.
+
+    Output:
+    - current with a "<metric>_delta" column for visits, drop_off_rate, reroute_rate and avg_turns.
+    Nodes not visited in the previous period have a NaN rate delta.
+    """
+
+    df_temp = current.copy()
+    previous = previous.reindex(df_temp.index)
+    df_temp["visits_delta"] = df_temp["visits"] - previous["visits"].fillna(0).astype("int64")
+    for column in ["drop_off_rate", "reroute_rate", "avg_turns"]:
+        df_temp[column + "_delta"] = df_temp[column] - previous[column]
+    return df_temp
@@ -0,0 +1,204 @@
+import os
+import math
+import concurrent.futures
+import numpy as np
+import pandas as pd
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+
+PATH_SYMBOLS = ["intent", "node"]
+PATH_COLUMNS = ["path", "length", "conversations", "support"]
+# Below this number of conversations the shards are mined in the current process.
+MIN_PARALLEL_SEQUENCES = 20000
+
+
+def conversation_sequences(df_canonical, symbols=("intent", "node")):
+    """
+    One sequence of symbols per conversation, in the order of the turns.
+
+    Arguments:
+    - df_canonical (pd.DataFrame, required): canonical logs, e.g. from FlowCache.canonical().
+    - symbols (tuple, optional, default is ("intent", "node")): symbols of each turn, "intent" is the
+    top intent as "#intent" and "node" is the turn label (the dialog node that answered).
+
+    Output:
+    - pd.Series of lists indexed by conversation id.
+    """
+
+    invalid = [symbol for symbol in symbols if symbol not in PATH_SYMBOLS]
+    if len(symbols) == 0 or invalid:
+        logger.error({"message": "Invalid path symbols.", "symbols": list(symbols)})
+        raise ValueError(f"Invalid path symbols: {list(symbols)}. Use some of {PATH_SYMBOLS}.")
+
+    if len(df_canonical) == 0:
+        return pd.Series([], dtype=object)
+
+    df = df_canonical.sort_values(by=["conversation_id", "response_timestamp"], kind="mergesort")
+    columns = {"intent": "#" + df["intent_1"].replace("", np.nan),
+               "node": df["turn_label"].replace("", np.nan)}
+
+    # Turn symbols are interleaved as intent, node, intent, node...
+    df_symbols = pd.DataFrame({"conversation_id": np.repeat(df["conversation_id"].to_numpy(), len(symbols)),
+                               "symbol": np.column_stack([columns[s].to_numpy() for s in symbols]).ravel()})
+    df_symbols = df_symbols[df_symbols["symbol"].notnull()]
+    return df_symbols.groupby("conversation_id", sort=False)["symbol"].agg(list)
+
+
+def encode_sequences(sequences):
+    """
+    Integer-encode sequences of symbols into a flat array.
+
+    Output:
+    - A tuple with the flat int32 symbol array, the int64 start offset of each sequence
+    (with the total length at the end) and the vocabulary (symbol of each integer).
+    """
+    lengths = np.fromiter((len(sequence) for sequence in sequences), dtype=np.int64, count=len(sequences))
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    codes, vocabulary = pd.factorize(pd.Series([symbol for sequence in sequences for symbol in sequence],
+                                               dtype=object))
+    return codes.astype(np.int32), offsets, np.asarray(vocabulary, dtype=object)
+
+
+def prefix_span(flat, offsets, min_count, max_length=5, candidates=None):
+    """
+    Frequent contiguous paths (PrefixSpan pattern growth with pseudo-projections).
+
+    A projection is the list of (sequence, end position) of every occurrence of a pattern,
+    so paths are found anywhere in the conversations, not only from the first turn.
+    The support of a path is the number of sequences where it occurs.
+
+    Arguments:
+    - flat (np.ndarray, required): symbols from encode_sequences().
+    - offsets (np.ndarray, required): sequence offsets from encode_sequences().
+    - min_count (int, required): minimum support.
+    - max_length (int, optional, default is 5): maximum path length.
+    - candidates (set, optional): only grow these paths (tuples of symbols), e.g. to count them exactly.
+
+    Output:
+    - dict with the path (tuple of integers) as key and its support as value.
+    """
+
+    n_sequences = len(offsets) - 1
+    sequence_ids = np.repeat(np.arange(n_sequences, dtype=np.int64), np.diff(offsets))
+    ends = offsets[1:]
+    results = {}
+
+    base = int(flat.max()) + 1 if len(flat) > 0 else 1
+
+    # Stack of (pattern, sequences, positions of the next symbol).
+    stack = [((), sequence_ids, np.arange(len(flat), dtype=np.int64))]
+    while stack:
+        pattern, sequences, positions = stack.pop()
+        if len(positions) == 0:
+            continue
+        # Support of each next symbol: distinct (sequence, symbol) pairs.
+        symbols = flat[positions]
+        pairs = np.unique(sequences * base + symbols)
+        values, counts = np.unique(pairs % base, return_counts=True)
+        for symbol, support in zip(values, counts):
+            if support < min_count:
+                continue
+            extended = pattern + (int(symbol),)
+            if candidates is not None and extended not in candidates:
+                continue
+            results[extended] = int(support)
+            if len(extended) >= max_length:
+                continue
+            mask = symbols == symbol
+            next_positions = positions[mask] + 1
+            next_sequences = sequences[mask]
+            # Keep the occurrences with a next symbol in the same sequence.
+            inside = next_positions < ends[next_sequences]
+            stack.append((extended, next_sequences[inside], next_positions[inside]))
+
+    return results
+
+
+def mine_shard(flat, offsets, min_support, max_length, candidates=None):
+    """
+    prefix_span() of a shard with a relative support, see frequent_paths().
+    """
+    n_sequences = len(offsets) - 1
+    if candidates is None:
+        min_count = max(1, math.ceil(min_support * n_sequences))
+    else:
+        min_count = 1
+    return prefix_span(flat, offsets, min_count, max_length, candidates)
+
+
+def sequence_shards(flat, offsets, n_shards):
+    """
+    Split encoded sequences into n_shards contiguous groups of sequences.
+    """
+    bounds = np.linspace(0, len(offsets) - 1, n_shards + 1).astype(np.int64)
+    shards = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if end > start:
+            shard_offsets = offsets[start:end + 1]
+            shards.append((flat[shard_offsets[0]:shard_offsets[-1]], shard_offsets - shard_offsets[0]))
+    return shards
+
+
+def frequent_paths(sequences, min_support=0.01, max_length=5, min_length=2, n_jobs=None):
+    """
+    Most common paths of intents and dialog nodes anywhere in the conversations.
+
+    Conversation shards are mined in a process pool in two passes (partition algorithm): a path
+    frequent in all conversations is frequent in at least one shard, so the paths found in any
+    shard are the candidates, and their supports are then counted exactly in every shard.
+
+    Arguments:
+    - sequences (pd.Series or list, required): symbols of each conversation, from conversation_sequences().
+    - min_support (float, optional, default is 0.01): minimum fraction of conversations with the path.
+    - max_length (int, optional, default is 5): maximum path length, in symbols.
+    - min_length (int, optional, default is 2): minimum path length reported.
+    - n_jobs (int, optional, default is the number of CPUs): processes, 1 runs in the current process.
+
+    Output:
+    - DataFrame with PATH_COLUMNS, "path" joined by " → ", sorted by conversations.
+    """
+
+    sequences = list(sequences)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if len(sequences) < MIN_PARALLEL_SEQUENCES:
+        n_jobs = 1
+
+    logger.info({"message": "Mining frequent paths.", "conversations": len(sequences),
+                 "min_support": min_support, "max_length": max_length, "n_jobs": n_jobs})
+
+    if len(sequences) == 0 or sum(len(sequence) for sequence in sequences) == 0:
+        return pd.DataFrame(columns=PATH_COLUMNS)
+
+    flat, offsets, vocabulary = encode_sequences(sequences)
+    n_sequences = len(sequences)
+    min_count = max(1, math.ceil(min_support * n_sequences))
+
+    if n_jobs == 1:
+        supports = prefix_span(flat, offsets, min_count, max_length)
+    else:
+        shards = sequence_shards(flat, offsets, n_jobs)
+        n = len(shards)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n) as executor:
+            local = list(executor.map(mine_shard, [s[0] for s in shards], [s[1] for s in shards],
+                                      [min_support] * n, [max_length] * n))
+            candidates = set().union(*[paths.keys() for paths in local])
+            counts = list(executor.map(mine_shard, [s[0] for s in shards], [s[1] for s in shards],
+                                       [min_support] * n, [max_length] * n, [candidates] * n))
+
+        supports = {}
+        for paths in counts:
+            for path, support in paths.items():
+                supports[path] = supports.get(path, 0) + support
+        supports = {path: support for path, support in supports.items() if support >= min_count}
+
+    paths = [path for path in supports if len(path) >= min_length]
+    df_paths = pd.DataFrame({
+        "path": [" → ".join(vocabulary[list(path)]) for path in paths],
+        "length": [len(path) for path in paths],
+        "conversations": [supports[path] for path in paths]
+    }, columns=PATH_COLUMNS[:3])
+    df_paths["support"] = df_paths["conversations"] / n_sequences
+    df_paths = df_paths.sort_values(by=["conversations", "length"], ascending=[False, False], kind="mergesort")
+    return df_paths.reset_index(drop=True)[PATH_COLUMNS]
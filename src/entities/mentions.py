@@ -0,0 +1,232 @@
+import re
+import difflib
+import collections
+from unicodedata import normalize
+import pandas as pd
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+
+TOKEN_PATTERN = re.compile(r"\w+")
+SYNONYM_COLUMNS = ["entity", "value", "synonym", "mentions"]
+COVERAGE_COLUMNS = ["entity", "values", "synonyms", "matched_synonyms", "mentions", "logs", "logs_share"]
+UNMATCHED_COLUMNS = ["term", "count", "closest_synonym", "closest_value"]
+GAP_COLUMNS = ["entity", "value", "text", "count"]
+
+
+def tokenize(text):
+    """
+    Lowercase tokens of a text without accents, the same for synonyms and log inputs.
+    """
+    text = normalize("NFKD", str(text).lower()).encode("ASCII", "ignore").decode("ASCII")
+    return TOKEN_PATTERN.findall(text)
+
+
+class EntityMatcher:
+    def __init__(self, entities):
+        """
+        Multi-pattern matcher of entity values and synonyms (Aho-Corasick automaton over tokens).
+
+        All synonyms are compiled once into a trie of tokens with failure links, so a text
+        is scanned once, whatever the number of synonyms. Pattern values are not compiled.
+
+        Arguments:
+        - entities (list, required): "entities" of a workspace export, from WatsonAssistant.get_workspace().
+
+        Attributes:
+        - patterns (pd.DataFrame): "entity", "value", "synonym" and "length" (tokens) of each pattern id.
+        - pattern_values (set): (entity, value) of the pattern values.
+        """
+
+        rows = []
+        self.pattern_values = set()
+        for entity in entities:
+            for value in entity.get("values", []):
+                if value.get("type", "synonyms") != "synonyms":
+                    self.pattern_values.add((entity["entity"], value["value"]))
+                    continue
+                for synonym in [value["value"]] + value.get("synonyms", []):
+                    rows.append((entity["entity"], value["value"], synonym))
+
+        logger.info({"message": "Compiling entity matcher.", "entities": len(entities), "synonyms": len(rows)})
+
+        self._goto = [{}]
+        self._outputs = [[]]
+        lengths = []
+        for pattern_id, (_, _, synonym) in enumerate(rows):
+            tokens = tokenize(synonym)
+            lengths.append(len(tokens))
+            if len(tokens) == 0:
+                continue
+            state = 0
+            for token in tokens:
+                if token not in self._goto[state]:
+                    self._goto.append({})
+                    self._outputs.append([])
+                    self._goto[state][token] = len(self._goto) - 1
+                state = self._goto[state][token]
+            self._outputs[state].append(pattern_id)
+
+        self.patterns = pd.DataFrame(rows, columns=["entity", "value", "synonym"])
+        self.patterns["length"] = pd.Series(lengths, dtype="int64")
+        self._lengths = lengths
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        # Breadth-first, the failure of a state is the longest proper suffix that is also in the trie.
+        self._fail = [0] * len(self._goto)
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(token, 0)
+                self._fail[next_state] = fail if fail != next_state else 0
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    def find(self, tokens):
+        """
+        All matches in a list of tokens.
+
+        Output:
+        - list of (start, end, pattern id) tuples, tokens[start:end] is the synonym.
+        """
+        matches = []
+        state = 0
+        goto, fail, outputs, lengths = self._goto, self._fail, self._outputs, self._lengths
+        for position, token in enumerate(tokens):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            for pattern_id in outputs[state]:
+                matches.append((position + 1 - lengths[pattern_id], position + 1, pattern_id))
+        return matches
+
+
+def longest_matches(matches):
+    """
+    Non-overlapping matches, the longest one first and then the leftmost.
+    """
+    selected, covered = [], set()
+    for start, end, pattern_id in sorted(matches, key=lambda match: (match[0] - match[1], match[0])):
+        if not covered.intersection(range(start, end)):
+            selected.append((start, end, pattern_id))
+            covered.update(range(start, end))
+    return sorted(selected)
+
+
+def log_entity_inputs(logs):
+    """
+    Input text and entities detected by Watson Assistant of each log.
+
+    Output:
+    - A tuple with the list of texts and the list of detected entities (list of dicts) of each text.
+    """
+    texts, detected = [], []
+    for log in logs:
+        try:
+            text = log["request"]["input"]["text"]
+        except (KeyError, TypeError):
+            continue
+        if not text:
+            continue
+        texts.append(text)
+        detected.append((log.get("response") or {}).get("entities") or [])
+    return texts, detected
+
+
+def mention_analysis(texts, matcher, detected=None, stopwords=None, top_terms=50, min_term_length=3):
+    """
+    Entity coverage, unmatched frequent terms and synonym gaps of log inputs.
+
+    Each text is tokenized and scanned once by the matcher, and the tokens not covered by
+    any match are counted as unmatched terms.
+
+    Arguments:
+    - texts (list, required): log inputs, e.g. from log_entity_inputs().
+    - matcher (EntityMatcher, required): matcher of the workspace entities.
+    - detected (list, optional): entities detected by Watson Assistant in each text, with "location".
+    Mentions detected (e.g. by fuzzy matching) whose text is not a synonym of the value are synonym gaps.
+    - stopwords (iterable, optional): terms not reported as unmatched.
+    - top_terms (int, optional, default is 50): number of unmatched terms reported.
+    - min_term_length (int, optional, default is 3): minimum length of an unmatched term.
+
+    Output:
+    - dict with "coverage" (per entity), "synonyms" (mentions of each synonym), "unmatched"
+    (frequent terms with their closest synonym), "gaps" (detected mentions that are not synonyms)
+    and "logs_share" (share of texts with at least one mention).
+    """
+
+    logger.info({"message": "Analyzing entity mentions.", "texts": len(texts)})
+
+    stopwords = set(stopwords or [])
+    patterns = matcher.patterns
+    pattern_entities = patterns["entity"].to_numpy()
+    mentions = collections.Counter()
+    entity_logs = collections.Counter()
+    unmatched = collections.Counter()
+    gaps = collections.Counter()
+    logs_with_mentions = 0
+
+    for i, text in enumerate(texts):
+        tokens = tokenize(text)
+        matches = longest_matches(matcher.find(tokens))
+        covered = set()
+        for start, end, pattern_id in matches:
+            mentions[pattern_id] += 1
+            covered.update(range(start, end))
+        if matches:
+            logs_with_mentions += 1
+            entity_logs.update({pattern_entities[pattern_id] for _, _, pattern_id in matches})
+
+        unmatched.update(token for position, token in enumerate(tokens)
+                         if position not in covered and len(token) >= min_term_length
+                         and token not in stopwords and not token.isdigit())
+
+        if detected is not None:
+            for entity in detected[i]:
+                location = entity.get("location")
+                if not location or entity.get("entity", "").startswith("sys-"):
+                    continue
+                mention = " ".join(tokenize(text[location[0]:location[1]]))
+                gaps[(entity.get("entity"), entity.get("value"), mention)] += 1
+
+    # Synonyms
+    df_synonyms = patterns[["entity", "value", "synonym"]].copy()
+    df_synonyms["mentions"] = [mentions.get(pattern_id, 0) for pattern_id in range(len(patterns))]
+    df_synonyms = df_synonyms[SYNONYM_COLUMNS]
+
+    # Coverage
+    grouped = df_synonyms.groupby("entity", sort=False)
+    df_coverage = pd.DataFrame({
+        "values": grouped["value"].nunique(),
+        "synonyms": grouped.size(),
+        "matched_synonyms": grouped["mentions"].agg(lambda x: int((x > 0).sum())),
+        "mentions": grouped["mentions"].sum()
+    })
+    df_coverage["logs"] = [entity_logs.get(entity, 0) for entity in df_coverage.index]
+    df_coverage["logs_share"] = df_coverage["logs"] / max(1, len(texts))
+    df_coverage = df_coverage.rename_axis("entity").reset_index()[COVERAGE_COLUMNS]
+    df_coverage = df_coverage.sort_values(by="mentions", ascending=False, kind="mergesort").reset_index(drop=True)
+
+    # Unmatched terms with the closest synonym, a possible missing synonym or misspelling.
+    synonyms = {}
+    for synonym, value in zip(patterns["synonym"], patterns["entity"] + ":" + patterns["value"]):
+        synonyms.setdefault(" ".join(tokenize(synonym)), value)
+    rows = []
+    for term, count in unmatched.most_common(top_terms):
+        closest = difflib.get_close_matches(term, synonyms.keys(), n=1, cutoff=0.8)
+        rows.append((term, count, closest[0] if closest else None, synonyms[closest[0]] if closest else None))
+    df_unmatched = pd.DataFrame(rows, columns=UNMATCHED_COLUMNS)
+
+    # Synonym gaps
+    known = set(zip(patterns["entity"], patterns["value"], [" ".join(tokenize(s)) for s in patterns["synonym"]]))
+    rows = [(entity, value, mention, count) for (entity, value, mention), count in gaps.most_common()
+            if (entity, value, mention) not in known and (entity, value) not in matcher.pattern_values and mention]
+    df_gaps = pd.DataFrame(rows, columns=GAP_COLUMNS)
+
+    return {"coverage": df_coverage, "synonyms": df_synonyms, "unmatched": df_unmatched,
+            "gaps": df_gaps, "logs_share": logs_with_mentions / max(1, len(texts))}
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.feature_extraction.text import TfidfVectorizer
+from src.nlp_utils.text_preprocessing import tfidf_pipeline
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+SEED = 1993
+
+COVERAGE_COLUMNS = ["input", "intent", "nearest_example", "nearest_intent", "similarity"]
+CLUSTER_COLUMNS = ["intent", "cluster", "logs", "intent_share", "mean_similarity", "nearest_intent", "inputs"]
+# Similarities computed at once by nearest_examples(), about 32 MB of float64.
+BLOCK_ELEMENTS = 2 ** 22
+
+
+def nearest_examples(X_inputs, X_examples, block_elements=BLOCK_ELEMENTS):
+    """
+    Nearest training example of each input by cosine similarity, with blocked matrix products.
+
+    Only a block of rows of the similarity matrix is kept in memory, so a month of logs
+    can be compared with thousands of examples.
+
+    Arguments:
+    - X_inputs (scipy.sparse matrix, required): L2-normalized vectors of the inputs.
+    - X_examples (scipy.sparse matrix, required): L2-normalized vectors of the examples, in the same space.
+    - block_elements (int, optional, default is BLOCK_ELEMENTS): similarities computed per block.
+
+    Output:
+    - A tuple with the index of the nearest example (-1 when nothing is shared) and the similarity of each input.
+    """
+
+    n_inputs, n_examples = X_inputs.shape[0], X_examples.shape[0]
+    block_size = max(1, block_elements // max(1, n_examples))
+
+    logger.info({"message": "Searching nearest examples.", "inputs": n_inputs,
+                 "examples": n_examples, "block_size": block_size})
+
+    nearest = np.full(n_inputs, -1, dtype=np.int64)
+    similarity = np.zeros(n_inputs)
+    if n_examples == 0:
+        return nearest, similarity
+
+    X_examples_t = X_examples.T.tocsc()
+    for start in range(0, n_inputs, block_size):
+        block = (X_inputs[start:start + block_size] @ X_examples_t).toarray()
+        nearest[start:start + block_size] = block.argmax(axis=1)
+        similarity[start:start + block_size] = block.max(axis=1)
+
+    nearest[similarity <= 0] = -1
+    return nearest, similarity
+
+
+def coverage_analysis(inputs, intents, examples, example_intents, block_elements=BLOCK_ELEMENTS):
+    """
+    Nearest training example of each log input, to find where the skill needs new examples.
+
+    Inputs and examples are vectorized in one TF-IDF space (tfidf_pipeline()), repeated
+    inputs are vectorized and searched once.
+
+    Arguments:
+    - inputs (list, required): log inputs.
+    - intents (list, required): intent predicted for each input.
+    - examples (list, required): training examples, from WatsonAssistant.get_intents().
+    - example_intents (list, required): intent of each example.
+    - block_elements (int, optional): see nearest_examples().
+
+    Output:
+    - DataFrame with COVERAGE_COLUMNS, one row per input.
+    """
+
+    logger.info({"message": "Computing training coverage.", "inputs": len(inputs), "examples": len(examples)})
+
+    codes, unique_inputs = pd.factorize(pd.Series(inputs, dtype=object).fillna(""))
+    pipeline = tfidf_pipeline()
+    pipeline.fit(list(examples) + list(unique_inputs))
+    nearest, similarity = nearest_examples(pipeline.transform(unique_inputs), pipeline.transform(examples),
+                                           block_elements)
+
+    examples = np.asarray(list(examples) + [None], dtype=object)
+    example_intents = np.asarray(list(example_intents) + [None], dtype=object)
+    # -1 points to the None at the end.
+    nearest = nearest[codes]
+
+    return pd.DataFrame({
+        "input": list(inputs),
+        "intent": list(intents),
+        "nearest_example": examples[nearest],
+        "nearest_intent": example_intents[nearest],
+        "similarity": similarity[codes]
+    }, columns=COVERAGE_COLUMNS)
+
+
+def low_coverage_clusters(df_coverage, max_similarity=0.5, max_clusters=5, min_cluster_size=3, top_inputs=3):
+    """
+    Clusters of the inputs far from all training examples, per predicted intent.
+
+    Arguments:
+    - df_coverage (pd.DataFrame, required): from coverage_analysis().
+    - max_similarity (float, optional, default is 0.5): inputs with a lower nearest example similarity are low coverage.
+    - max_clusters (int, optional, default is 5): maximum clusters per intent.
+    - min_cluster_size (int, optional, default is 3): average inputs per cluster, fewer inputs give fewer clusters.
+    - top_inputs (int, optional, default is 3): most frequent inputs shown per cluster.
+
+    Output:
+    - DataFrame with CLUSTER_COLUMNS, "cluster" is named by the top terms of its centroid, sorted by logs.
+    """
+
+    logger.info({"message": "Clustering low coverage inputs.", "max_similarity": max_similarity,
+                 "max_clusters": max_clusters})
+
+    intent_logs = df_coverage["intent"].fillna("Irrelevant").value_counts()
+    df_low = df_coverage[(df_coverage["similarity"] < max_similarity)
+                         & (df_coverage["input"].fillna("").str.strip() != "")].copy()
+    df_low["intent"] = df_low["intent"].fillna("Irrelevant")
+
+    rows = []
+    for intent, df_intent in df_low.groupby("intent", sort=False):
+        n_clusters = int(min(max_clusters, max(1, len(df_intent) // min_cluster_size)))
+        labels = np.zeros(len(df_intent), dtype=np.int64)
+        names = {0: ""}
+        try:
+            vectorizer = TfidfVectorizer(ngram_range=(1, 2), strip_accents="unicode")
+            X = vectorizer.fit_transform(df_intent["input"])
+            n_clusters = min(n_clusters, X.shape[0])
+            if n_clusters > 1:
+                labels = KMeans(n_clusters=n_clusters, n_init=10, random_state=SEED).fit_predict(X)
+            terms = np.asarray(vectorizer.get_feature_names_out() if hasattr(vectorizer, "get_feature_names_out")
+                               else vectorizer.get_feature_names())
+            for label in np.unique(labels):
+                centroid = np.asarray(X[labels == label].mean(axis=0)).ravel()
+                names[label] = ", ".join(terms[np.argsort(-centroid)[:3]]) if centroid.max() > 0 else ""
+        except ValueError:
+            # Only stop words or empty inputs.
+            pass
+
+        for label in np.unique(labels):
+            df_cluster = df_intent[labels == label]
+            nearest_intent = df_cluster["nearest_intent"].mode()
+            rows.append({
+                "intent": intent,
+                "cluster": names.get(label, ""),
+                "logs": len(df_cluster),
+                "intent_share": len(df_cluster) / intent_logs[intent],
+                "mean_similarity": df_cluster["similarity"].mean(),
+                "nearest_intent": nearest_intent.iloc[0] if len(nearest_intent) > 0 else None,
+                "inputs": " | ".join(df_cluster["input"].value_counts().head(top_inputs).index)
+            })
+
+    df_clusters = pd.DataFrame(rows, columns=CLUSTER_COLUMNS)
+    return df_clusters.sort_values(by="logs", ascending=False, kind="mergesort").reset_index(drop=True)
@@ -1,6 +1,11 @@
 # Default libs
+import hashlib
+import functools
+import threading
+import collections
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from src.helper_functions import setup_logger
 
 logger = setup_logger()
@@ -9,13 +14,13 @@ SEED = 1993
 np.random.seed(SEED)
 
 # ML libs
-from sklearn.decomposition import PCA
 from sklearn.decomposition import TruncatedSVD
 from sklearn.manifold import TSNE
+from sklearn.neighbors import NearestNeighbors
 import nltk
 import spacy
 
-from src.nlp_utils.text_preprocessing import normalize_text, load_stopwords, apply_tfidf
+from src.nlp_utils.text_preprocessing import normalize_text, load_stopwords, tfidf_pipeline
 
 # Graph libs
 import plotly.express as px
@@ -25,43 +30,426 @@ import plotly.io as pio
 # set default theme
 pio.templates.default = "seaborn"
 
+DECOMPOSITION_METHODS = ["pca", "tsne", "truncated svd"]
 
-def decomposition_reduction(examples, intents, method="PCA"):
-    logger.info({"message": "Initializing decomposition reduction."})
-    X = apply_tfidf(examples)
+# Examples chart budget, above it a sample is drawn over a density heatmap.
+MAX_POINTS = 5000
+DENSITY_BINS = 80
+# Above this number of intents the charts use a single trace without legend.
+LEGEND_MAX_CATEGORIES = 40
+
+# Fitted projections kept in memory, by (examples fingerprint, method, params).
+PROJECTION_CACHE_SIZE = 8
+_projection_cache = collections.OrderedDict()
+_projection_cache_lock = threading.Lock()
+
+# Analyses of the Decomposition Analysis page, the session state keeps only their keys.
+ANALYSIS_CACHE_SIZE = 4
+_analysis_cache = collections.OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+
+def check_method(method):
+    method = method.lower()
+    if method not in DECOMPOSITION_METHODS:
+        logger.error({"message": "Decomposition method not available.", "method": method})
+        raise ValueError("Decomposition method not available: {}.".format(method))
+    return method
+
+
+def examples_fingerprint(examples):
+    sha = hashlib.sha1()
+    for example in examples:
+        sha.update(example.encode("utf-8"))
+        sha.update(b"\x00")
+    return sha.hexdigest()
+
+
+class CenteredPCA():
+    def __init__(self, n_components=2, n_oversamples=10, n_iter=7):
+        """
+        PCA by randomized SVD that centers the data implicitly,
+        so the sparse TF-IDF matrix never needs to be densified.
+
+        Arguments:
+        - n_components (int, optional, default is 2): number of components to keep.
+        - n_oversamples (int, optional, default is 10): additional random vectors used by the range finder.
+        - n_iter (int, optional, default is 7): power iterations used by the range finder.
+        """
+
+        self.n_components = n_components
+        self.n_oversamples = n_oversamples
+        self.n_iter = n_iter
+        self.mean_ = None
+        self.components_ = None
+
+    def _dot(self, X, Q):
+        # (X - mean) @ Q
+        return X @ Q - self.mean_ @ Q
+
+    def _rdot(self, X, Q):
+        # (X - mean).T @ Q
+        return X.T @ Q - np.outer(self.mean_, Q.sum(axis=0))
+
+    def fit(self, X):
+        random_state = np.random.RandomState(SEED)
+        self.mean_ = np.asarray(X.mean(axis=0)).ravel()
+
+        n_random = min(self.n_components + self.n_oversamples, min(X.shape))
+        Q = random_state.normal(size=(X.shape[1], n_random))
+        Q, _ = np.linalg.qr(self._dot(X, Q))
+        for _ in range(self.n_iter):
+            Q, _ = np.linalg.qr(self._rdot(X, Q))
+            Q, _ = np.linalg.qr(self._dot(X, Q))
+
+        _, _, Vt = np.linalg.svd(self._rdot(X, Q).T, full_matrices=False)
+        components = Vt[:self.n_components]
+
+        # Deterministic signs: the largest loading of each component is positive.
+        signs = np.sign(components[range(len(components)), np.argmax(np.abs(components), axis=1)])
+        self.components_ = components * signs[:, np.newaxis]
+        return self
+
+    def transform(self, X):
+        return np.asarray(self._dot(X, self.components_.T))
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+
+class Projection():
+    def __init__(self, method="pca", svd_components=50, perplexity=30.0):
+        """
+        TF-IDF vectorizer and 2D projection fitted over a set of examples.
+
+        The TF-IDF matrix is kept sparse. t-SNE runs with Barnes-Hut over a truncated SVD pre-reduction.
+
+        Arguments:
+        - method (str, optional, default is "pca"): "pca", "tsne" or "truncated svd".
+        - svd_components (int, optional, default is 50): dimensions kept by truncated SVD before t-SNE.
+        - perplexity (float, optional, default is 30.0): t-SNE perplexity.
+        """
+
+        self.method = check_method(method)
+        self.svd_components = svd_components
+        self.perplexity = perplexity
+        self.vectorizer = None
+        self.reducer = None
+        self.model = None
+        self.neighbors = None
+        self.X = None
+        self.coords = None
+
+    def fit(self, examples):
+        logger.info({"message": "Fitting projection.", "method": self.method,
+                     "examples_count": len(examples)})
+
+        self.vectorizer = tfidf_pipeline()
+        self.X = self.vectorizer.fit_transform(examples)
+
+        if self.method == "truncated svd":
+            self.model = TruncatedSVD(n_components=2, algorithm="randomized", random_state=SEED)
+            self.coords = self.model.fit_transform(self.X)
+        elif self.method == "tsne":
+            svd_components = min(self.svd_components, self.X.shape[0] - 1, self.X.shape[1] - 1)
+            if svd_components > 2:
+                self.reducer = TruncatedSVD(n_components=svd_components,
+                                            algorithm="randomized", random_state=SEED)
+                X = self.reducer.fit_transform(self.X)
+            else:
+                X = self.X.toarray()
 
-    if method.lower() == "TSNE":
-        model = TSNE(n_components=2, random_state=SEED)
-    elif method.lower() == "truncated SVD":
-        model = TruncatedSVD(n_components=2, random_state=SEED)
-    else:
-        model = PCA(n_components=2, random_state=SEED)
+            self.model = TSNE(n_components=2, method="barnes_hut", init="pca",
+                              perplexity=min(self.perplexity, self.X.shape[0] - 1),
+                              random_state=SEED)
+            self.coords = self.model.fit_transform(X)
+            self.neighbors = NearestNeighbors().fit(X)
+        else:
+            self.model = CenteredPCA(n_components=2)
+            self.coords = self.model.fit_transform(self.X)
+
+        return self
+
+    def transform(self, examples, n_neighbors=10):
+        """
+        Project new examples into the fitted 2D map without refitting it.
+
+        t-SNE has no transform, so new examples are placed at the distance-weighted
+        mean of their nearest fitted examples.
+
+        Arguments:
+        - examples (list, required): examples to be projected.
+        - n_neighbors (int, optional, default is 10): fitted examples used by t-SNE placement.
+
+        Output:
+        - np.ndarray with x and y of each example.
+        """
+
+        logger.info({"message": "Projecting new examples.", "method": self.method,
+                     "examples_count": len(examples)})
+
+        X = self.vectorizer.transform(examples)
+        if self.method != "tsne":
+            return np.asarray(self.model.transform(X))
+
+        if self.reducer is not None:
+            X = self.reducer.transform(X)
+        else:
+            X = X.toarray()
+
+        distances, indices = self.neighbors.kneighbors(
+            X, n_neighbors=min(n_neighbors, len(self.coords)))
+        weights = 1.0 / (distances + 1e-6)
+        return (self.coords[indices] * weights[:, :, np.newaxis]).sum(axis=1) / weights.sum(axis=1, keepdims=True)
+
+
+def fit_projection(examples, method="pca", **params):
+    """
+    Return the projection of examples, fitting it only if it isn't cached yet.
+
+    Arguments:
+    - examples (list, required): examples to be projected.
+    - method (str, optional, default is "pca"): "pca", "tsne" or "truncated svd".
+    - params: other Projection arguments.
+
+    Output:
+    - Projection object.
+    """
 
-    data2D = model.fit_transform(X)
+    key = (examples_fingerprint(examples), check_method(method), tuple(sorted(params.items())))
 
-    df = pd.DataFrame(data2D, columns=["x", "y"])
+    with _projection_cache_lock:
+        if key in _projection_cache:
+            logger.info({"message": "Using cached projection.", "method": key[1]})
+            _projection_cache.move_to_end(key)
+            return _projection_cache[key]
+
+    projection = Projection(method=method, **params).fit(examples)
+
+    with _projection_cache_lock:
+        _projection_cache[key] = projection
+        while len(_projection_cache) > PROJECTION_CACHE_SIZE:
+            _projection_cache.popitem(last=False)
+
+    return projection
+
+
+def decomposition_reduction(examples, intents, method="PCA", projection=None):
+    logger.info({"message": "Initializing decomposition reduction."})
+    if projection is None:
+        projection = fit_projection(examples, method=method)
+
+    df = pd.DataFrame(projection.coords, columns=["x", "y"])
 
     df["example"] = examples
     df["intent"] = intents
     return df
 
 
+@functools.lru_cache(maxsize=None)
+def load_spacy_model(name):
+    return spacy.load(name)
+
+
+def project_examples(projection, examples, stopwords=None, processed=False):
+    """
+    Project new examples into an existing 2D map.
+
+    Arguments:
+    - projection (Projection, required): fitted projection.
+    - examples (list, required): new examples.
+    - stopwords (list, optional): stopwords used when the fitted examples were processed.
+    - processed (bool, optional, default is False): apply the same text processing of the fitted examples.
+
+    Output:
+    - DataFrame with "x", "y" and "example" columns.
+    """
+
+    if processed:
+        nlp = load_spacy_model('pt_core_news_md')
+        texts = [normalize_text(example, nlp, stopwords) for example in examples]
+    else:
+        texts = examples
+
+    df = pd.DataFrame(projection.transform(texts), columns=["x", "y"])
+    df["example"] = examples
+    return df
+
+
+def add_examples_trace(fig, df, name="New examples"):
+    hover_texts = "<b>New example:</b> " + df["example"]
+    fig.add_trace(go.Scatter(
+        x=df["x"], y=df["y"],
+        mode="markers",
+        marker_symbol="star",
+        marker_size=14,
+        marker_color="black",
+        name=name,
+        hovertext=hover_texts,
+        hoverinfo="text"
+    ))
+    return fig
+
+
+def stratified_sample(df, column, max_rows):
+    """
+    Sample at most max_rows rows keeping the share of each group of column.
+
+    Groups too small for their share get one row while max_rows allows it, the largest groups first.
+    """
+    random_state = np.random.RandomState(SEED)
+    fraction = min(1, max_rows / len(df))
+
+    group_size = df.groupby(column)[column].size()
+    quota = np.floor(group_size * fraction).astype(np.int64)
+    small = quota[quota == 0].index
+    spare = max(0, max_rows - int(quota.sum()))
+    quota[group_size[small].sort_values(ascending=False, kind="mergesort").index[:spare]] = 1
+
+    rank = pd.Series(random_state.random_sample(len(df)), index=df.index).groupby(df[column]).rank(method="first")
+    keep = rank <= df[column].map(quota).astype(np.int64)
+    return df[keep.values]
+
+
+def category_colors(n_categories):
+    """
+    Distinct color of each category code, sampled from a continuous colorscale when the palette is too short.
+    """
+    palette = px.colors.qualitative.Plotly + px.colors.qualitative.D3 + px.colors.qualitative.Dark24
+    if n_categories <= len(palette):
+        return palette[:n_categories]
+    return px.colors.sample_colorscale("Turbo", n_categories)
+
+
+def categorical_marker(codes, n_categories):
+    """
+    Marker coloured by category codes with a discrete colorscale, so one trace holds all categories.
+    """
+    n_categories = max(n_categories, 1)
+
+    colorscale = []
+    for i, color in enumerate(category_colors(n_categories)):
+        colorscale.append([i / n_categories, color])
+        colorscale.append([(i + 1) / n_categories, color])
+
+    return dict(color=codes, colorscale=colorscale, cmin=-0.5,
+                cmax=n_categories - 0.5, showscale=False)
+
+
+def add_categorical_scatter(fig, df, codes, categories, hover_texts, name, marker=None, **kwargs):
+    """
+    Add the points of df ("x" and "y") coloured by category.
+
+    Up to LEGEND_MAX_CATEGORIES there is a trace per category, so the legend shows and hides them.
+    Above it a single WebGL trace keeps the figure small, without legend: the category is in the hover text.
+
+    Arguments:
+    - fig (go.Figure, required): figure.
+    - df (pd.DataFrame, required): points with "x" and "y".
+    - codes (array-like, required): category code of each point.
+    - categories (list, required): category of each code.
+    - hover_texts (pd.Series, required): hover text of each point.
+    - name (str, required): name of the single trace.
+    - marker (dict, optional): other marker properties, arrays have a value per point.
+    - kwargs: other Scattergl properties.
+    """
+    codes = np.asarray(codes)
+    marker = dict(marker or {})
+    hover_texts = np.asarray(hover_texts)
+
+    if len(categories) > LEGEND_MAX_CATEGORIES:
+        marker.update(categorical_marker(codes, len(categories)))
+        fig.add_trace(go.Scattergl(x=df["x"], y=df["y"], mode="markers", marker=marker, name=name,
+                                   hovertext=hover_texts, hoverinfo="text", showlegend=False, **kwargs))
+        return fig
+
+    for code, (category, color) in enumerate(zip(categories, category_colors(len(categories)))):
+        mask = codes == code
+        category_marker = {key: np.asarray(value)[mask] if np.ndim(value) > 0 else value
+                           for key, value in marker.items()}
+        fig.add_trace(go.Scattergl(x=df["x"].to_numpy()[mask], y=df["y"].to_numpy()[mask], mode="markers",
+                                   marker=dict(category_marker, color=color), name=str(category),
+                                   hovertext=hover_texts[mask], hoverinfo="text", **kwargs))
+    return fig
+
+
+def add_density_trace(fig, x, y, bins=DENSITY_BINS):
+    """
+    Add a heatmap with the density of all points, aggregated before it is sent to the browser.
+    """
+    z, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    z[z == 0] = np.nan
+    fig.add_trace(go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2,
+        y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=z.T,
+        colorscale="Greys",
+        opacity=0.5,
+        showscale=False,
+        hoverinfo="skip",
+        name="Density"
+    ))
+    return fig
+
+
 def prepareDataIntents(df):
-    unique_intents = list(set(df["intent"]))
-
-    lst = []
-    for intent in unique_intents:
-        df_temp = df[df["intent"] == intent]
-        examples_count = len(df_temp["example"])
-        x = np.mean(df_temp["x"].values)
-        y = np.mean(df_temp["y"].values)
-        lst.append({"intent": intent, "x": x, "y": y,
-                    "examples_count": examples_count})
-
-    df = pd.DataFrame(lst)
+    df = df.groupby("intent").agg(x=("x", "mean"), y=("y", "mean"),
+                                  examples_count=("example", "size"))
+    df.reset_index(inplace=True)
     return df
 
 
+def intents_overlap(X, intents, top_n=20):
+    """
+    Compare intents in the original feature space (e.g. TF-IDF) instead of the 2D projection.
+
+    Each intent has a centroid and a spread (root mean squared distance of its examples to the centroid),
+    both computed with a sparse group aggregation. The overlap of two intents is the sum of their spreads
+    divided by the distance between their centroids, the higher it is the more they conflict.
+
+    Arguments:
+    - X (sparse matrix or np.ndarray, required): examples vectors.
+    - intents (list, required): intent of each example.
+    - top_n (int, optional, default is 20): number of conflicting pairs returned.
+
+    Output:
+    - A dict with "distance" and "overlap" DataFrames (intent x intent), "spread" Series and "pairs" DataFrame.
+    """
+
+    logger.info({"message": "Computing intents overlap.", "top_n": top_n})
+
+    X = sparse.csr_matrix(X)
+    labels, codes = np.unique(np.asarray(intents), return_inverse=True)
+    counts = np.bincount(codes)
+
+    # Mean of the examples of each intent as a (n_intents x n_examples) @ (n_examples x n_features) product.
+    groups = sparse.csr_matrix((1.0 / counts[codes], (codes, np.arange(len(codes)))),
+                               shape=(len(labels), len(codes)))
+    centroids = groups @ X
+
+    gram = np.asarray((centroids @ centroids.T).todense())
+    centroid_sq_norms = np.diag(gram)
+    mean_sq_norms = groups @ np.asarray(X.multiply(X).sum(axis=1)).ravel()
+
+    spread = np.sqrt(np.clip(mean_sq_norms - centroid_sq_norms, 0, None))
+    distance = np.sqrt(np.clip(centroid_sq_norms[:, np.newaxis] + centroid_sq_norms[np.newaxis, :] - 2 * gram, 0, None))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        overlap = (spread[:, np.newaxis] + spread[np.newaxis, :]) / distance
+    np.fill_diagonal(overlap, np.nan)
+
+    rows, cols = np.triu_indices(len(labels), k=1)
+    pairs = pd.DataFrame({"intent": labels[rows], "conflicting intent": labels[cols],
+                          "distance": distance[rows, cols], "overlap": overlap[rows, cols]})
+    pairs.sort_values(by=["overlap", "distance"], ascending=[False, True], inplace=True)
+    pairs.reset_index(drop=True, inplace=True)
+
+    return {"distance": pd.DataFrame(distance, index=labels, columns=labels),
+            "overlap": pd.DataFrame(overlap, index=labels, columns=labels),
+            "spread": pd.Series(spread, index=labels),
+            "pairs": pairs.head(top_n)}
+
+
 class ExamplesDA():
     def __init__(self, examples, intents, decomposition_method="pca"):
 
@@ -71,6 +459,8 @@ class ExamplesDA():
         self.intents = intents
         self.decomposition_method = decomposition_method
         self.examples_processed = None
+        self.stopwords = None
+        self.projection = None
         self.data = None
         self.fig = None
 
@@ -82,42 +472,51 @@ class ExamplesDA():
             else:
                 stopwords = nltk.corpus.stopwords.words('portuguese')
 
-        nlp = spacy.load('pt_core_news_md')
+        nlp = load_spacy_model('pt_core_news_md')
+        self.stopwords = stopwords
         self.examples_processed = [normalize_text(
             example, nlp, stopwords) for example in self.examples]
 
     def prepare_data(self):
         logger.info({"message": "Preparing data."})
         if isinstance(self.examples_processed, list):
-            self.data = decomposition_reduction(
-                self.examples_processed, self.intents, method=self.decomposition_method)
-            self.data["example"] = self.examples
+            examples = self.examples_processed
         else:
-            self.data = decomposition_reduction(
-                self.examples, self.intents, method=self.decomposition_method)
+            examples = self.examples
+
+        self.projection = fit_projection(examples, method=self.decomposition_method)
+        self.data = decomposition_reduction(examples, self.intents, projection=self.projection)
+        self.data["example"] = self.examples
 
         self.data["example_len"] = [len(example.split())
                                     for example in self.data["example"]]
         return self.data
 
-    def generate_fig(self, title="Example - Decomposition Analysis"):
-        logger.info({"message": "Generating figure."})
-        if not isinstance(self.data, pd.DataFrame):
+    def project(self, examples):
+        """
+        Project new examples into the examples map without refitting it.
+        """
+        logger.info({"message": "Projecting new examples."})
+        if self.projection is None:
             self.prepare_data()
 
-        data = self.data.copy()
+        return project_examples(self.projection, examples, stopwords=self.stopwords,
+                                processed=isinstance(self.examples_processed, list))
 
-        intents = data["intent"].unique().tolist()
-        intents = sorted(intents)
+    def generate_fig(self, title="Example - Decomposition Analysis", max_points=MAX_POINTS):
+        """
+        Generate the examples chart coloured by intent, with a WebGL trace per intent
+        or a single one above LEGEND_MAX_CATEGORIES intents (without legend toggling).
 
-        hover_texts = []
-        for i in range(len(self.data)):
-            hover_text = "<b>Example:</b> {}<br><b>Example words:</b> {}<br><b>Intent:</b> {}".format(data["example"][i],
-                                                                                                      data["example_len"][i],
-                                                                                                      data["intent"][i])
-            hover_texts.append(hover_text)
+        Above max_points, a sample stratified by intent is drawn over a density heatmap of all examples,
+        so the figure size doesn't grow with the skill size.
+        """
+        logger.info({"message": "Generating figure.", "max_points": max_points})
+        if not isinstance(self.data, pd.DataFrame):
+            self.prepare_data()
 
-        data["hovertext"] = hover_texts
+        data = self.data
+        categories = sorted(data["intent"].unique())
 
         layout = go.Layout(
             title=title,
@@ -130,18 +529,18 @@ class ExamplesDA():
         )
 
         fig = go.Figure(layout=layout)
-        for intent in intents:
-            temp = data[data["intent"] == intent].copy()
-
-            fig.add_trace(go.Scatter(
-                x=temp["x"], y=temp["y"],
-                mode="markers",
-                text=temp["example"],
-                opacity=0.6,
-                name=intent,
-                hovertext=temp["hovertext"],
-                hoverinfo="text"
-            ))
+
+        if len(data) > max_points:
+            add_density_trace(fig, data["x"].values, data["y"].values)
+            data = stratified_sample(data, "intent", max_points)
+            fig.update_layout(title="{} ({} of {} examples)".format(title, len(data), len(self.data)))
+
+        intents = pd.Categorical(data["intent"], categories=categories)
+        hover_texts = ("<b>Example:</b> " + data["example"].astype(str) +
+                       "<br><b>Example words:</b> " + data["example_len"].astype(str) +
+                       "<br><b>Intent:</b> " + data["intent"].astype(str))
+
+        add_categorical_scatter(fig, data, intents.codes, categories, hover_texts, "Examples", opacity=0.6)
 
         self.fig = fig
 
@@ -169,6 +568,8 @@ class IntentsDA():
         self.intents = intents
         self.decomposition_method = decomposition_method
         self.examples_processed = None
+        self.stopwords = None
+        self.projection = None
         self.data = None
         self.fig = None
 
@@ -180,7 +581,8 @@ class IntentsDA():
             else:
                 stopwords = nltk.corpus.stopwords.words('portuguese')
 
-        nlp = spacy.load('pt_core_news_md')
+        nlp = load_spacy_model('pt_core_news_md')
+        self.stopwords = stopwords
         self.examples_processed = [normalize_text(
             example, nlp, stopwords) for example in self.examples]
 
@@ -191,18 +593,38 @@ class IntentsDA():
         else:
             examples = self.examples
 
-        data = decomposition_reduction(
-            examples, self.intents, method=self.decomposition_method)
+        self.projection = fit_projection(examples, method=self.decomposition_method)
+        data = decomposition_reduction(examples, self.intents, projection=self.projection)
         self.data = prepareDataIntents(data)
         return self.data
 
+    def overlap(self, top_n=20):
+        """
+        Intents overlap computed in the TF-IDF space of the fitted projection, see intents_overlap().
+        """
+        logger.info({"message": "Computing intents overlap."})
+        if self.projection is None:
+            self.prepare_data()
+
+        return intents_overlap(self.projection.X, self.intents, top_n=top_n)
+
+    def project(self, examples):
+        """
+        Project new examples into the intents map without refitting it.
+        """
+        logger.info({"message": "Projecting new examples."})
+        if self.projection is None:
+            self.prepare_data()
+
+        return project_examples(self.projection, examples, stopwords=self.stopwords,
+                                processed=isinstance(self.examples_processed, list))
+
     def generate_fig(self, title="Intents - Decomposition Analysis"):
         logger.info({"message": "Generating figure."})
         if not isinstance(self.data, pd.DataFrame):
             self.prepare_data()
 
-        data = self.data.copy()
-        data.sort_values(by="intent", inplace=True)
+        data = self.data.sort_values(by="intent").reset_index(drop=True)
 
         layout = go.Layout(
             title=title,
@@ -215,20 +637,13 @@ class IntentsDA():
         )
         fig = go.Figure(layout=layout)
 
-        for row in data.to_dict(orient="records"):
-            hover_text = "<b>Intent:</b> {}<br><b>Examples count:</b> {}".format(
-                row["intent"], row["examples_count"])
-
-            fig.add_trace(go.Scatter(
-                x=[row["x"]], y=[row["y"]],
-                mode="markers",
-                marker_size=[row["examples_count"]],
-                text=[row["intent"]],
-                opacity=0.6,
-                name=row["intent"],
-                hovertext=hover_text,
-                hoverinfo="text"
-            ))
+        hover_texts = ("<b>Intent:</b> " + data["intent"].astype(str) +
+                       "<br><b>Examples count:</b> " + data["examples_count"].astype(str))
+
+        marker = dict(size=data["examples_count"], sizemode="area",
+                      sizeref=2.0 * data["examples_count"].max() / (40.0 ** 2), sizemin=4)
+        add_categorical_scatter(fig, data, np.arange(len(data)), data["intent"].tolist(), hover_texts, "Intents",
+                                marker=marker, opacity=0.6)
 
         self.fig = fig
 
@@ -245,3 +660,55 @@ class IntentsDA():
             self.generate_fig()
 
         self.fig.write_html(file_name)
+
+
+def run_decomposition(examples, intents, method="pca", stopwords=False, stopwords_file=None, overlap_top_n=50):
+    """
+    Fit the examples and intents maps and the intents overlap, kept in memory by a key.
+
+    Streamlit hashes the session state on each rerun, so the page keeps only the key and
+    the fitted objects stay here (and the projection in the fit_projection() cache).
+
+    Arguments:
+    - examples (list, required): examples, from WatsonAssistant.get_intents().
+    - intents (list, required): intent of each example.
+    - method (str, optional, default is "pca"): "pca", "tsne" or "truncated svd".
+    - stopwords (bool, optional, default is False): process the examples without stopwords, see ExamplesDA.text_processing().
+    - stopwords_file (str, optional): stopwords file.
+    - overlap_top_n (int, optional, default is 50): conflicting intent pairs kept.
+
+    Output:
+    - Analysis key, see get_decomposition().
+    """
+
+    key = (examples_fingerprint(examples), examples_fingerprint(intents), check_method(method),
+           stopwords, stopwords_file if isinstance(stopwords_file, str) else None)
+    with _analysis_cache_lock:
+        if key in _analysis_cache:
+            _analysis_cache.move_to_end(key)
+            return key
+
+    examples_da = ExamplesDA(examples=examples, intents=intents, decomposition_method=method)
+    if stopwords:
+        examples_da.text_processing(stopwords=True, stopwords_file=stopwords_file)
+    examples_da.prepare_data()
+
+    intents_da = IntentsDA(examples=examples, intents=intents, decomposition_method=method)
+    intents_da.data = prepareDataIntents(examples_da.data)
+    intents_da.projection = examples_da.projection
+
+    analysis = {"examples": examples_da, "intents": intents_da, "overlap": intents_da.overlap(top_n=overlap_top_n)}
+    with _analysis_cache_lock:
+        _analysis_cache[key] = analysis
+        while len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+    return key
+
+
+def get_decomposition(key):
+    """
+    Analysis of run_decomposition() with "examples" (ExamplesDA), "intents" (IntentsDA) and "overlap",
+    None if it's not in memory anymore.
+    """
+    with _analysis_cache_lock:
+        return _analysis_cache.get(key)
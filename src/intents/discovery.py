@@ -1,12 +1,16 @@
 import spacy
 import nltk
+import collections
 import numpy as np
 import pandas as pd
 import streamlit as st
 from nltk.util import ngrams
 from nltk.tokenize import word_tokenize
+from scipy.cluster.hierarchy import linkage, fcluster
 from sklearn.metrics import silhouette_score
 from sklearn.cluster import KMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
 from src.nlp_utils.text_preprocessing import normalize_text, apply_tfidf
 from src.helper_functions import setup_logger
 
@@ -25,6 +29,7 @@ class IntentsDiscovery:
         self.data = data
         self.data_processed = None
         self.search_data = []
+        self.cluster_tree = None
         self._stopwords = None
         self.spacy_model = spacy.load(spacy_model)
 
@@ -167,3 +172,118 @@ class IntentsDiscovery:
                 df["label"].replace(label, cluster_name, inplace=True)
 
         self.labels = df["label"].tolist()
+
+    def build_cluster_tree(self, data=None, n_components=100, clean_texts=True):
+        """
+        Compute the hierarchical (agglomerative) clustering tree once.
+
+        The TF-IDF vectors are reduced with truncated SVD before the Ward linkage is computed,
+        so the tree can be cut at any number of clusters without training a new model.
+
+        Arguments:
+        - data (list, optional): phrases to be clustered, default is the processed data or the raw data.
+        - n_components (int, optional, default is 100): dimensions kept by truncated SVD.
+        - clean_texts (bool, optional, default is True): normalize texts before extracting cluster names.
+
+        Output:
+        - ClusterTree object.
+        """
+
+        logger.info({"message": "Building hierarchical cluster tree.",
+                     "n_components": n_components, "clean_texts": clean_texts})
+
+        if data != None:
+            self.data = data
+        elif self.data_processed != None:
+            data = self.data_processed
+        else:
+            data = self.data
+
+        # The sparse TF-IDF matrix goes straight to the randomized SVD, it's never densified.
+        X = apply_tfidf(data, dense=False)
+
+        # Truncated SVD needs fewer components than samples and features.
+        n_components = min(n_components, X.shape[0] - 1, X.shape[1] - 1)
+        if n_components >= 2:
+            X = TruncatedSVD(n_components=n_components,
+                             random_state=SEED).fit_transform(X)
+        else:
+            # Only a couple of examples or terms.
+            X = X.toarray()
+
+        # Ward linkage is euclidean, on unit vectors it follows the cosine distance.
+        X = normalize(X)
+        linkage_matrix = linkage(X, method="ward")
+
+        if clean_texts:
+            examples = [normalize_text(
+                text, self.spacy_model, self._stopwords, lemmatizer=False) for text in self.data]
+        else:
+            examples = self.data
+
+        self.cluster_tree = ClusterTree(data=self.data, linkage_matrix=linkage_matrix,
+                                        bigrams=[self.get_ngrams(e) for e in examples],
+                                        unigrams=[self.get_ngrams(e, n_grams=1) for e in examples])
+        return self.cluster_tree
+
+
+class ClusterTree:
+    def __init__(self, data: list, linkage_matrix: np.ndarray,
+                 bigrams: list, unigrams: list):
+        """
+        Hierarchical clustering tree that can be cut at any number of clusters.
+
+        The n-grams of each phrase are extracted only once, so naming the clusters
+        of a new cut is a count over the cached n-grams.
+
+        Arguments:
+        - data (list, required): clustered phrases.
+        - linkage_matrix (np.ndarray, required): linkage matrix from scipy.
+        - bigrams (list, required): bi-grams of each phrase.
+        - unigrams (list, required): uni-grams of each phrase, used when a cluster has no bi-grams.
+        """
+
+        logger.info({"message": "Instantiate ClusterTree object.",
+                     "examples_count": len(data)})
+
+        self.data = data
+        self.linkage = linkage_matrix
+        self.bigrams = bigrams
+        self.unigrams = unigrams
+        self._cuts = {}
+
+    def cut(self, n_clusters):
+        """
+        Cut the tree at n_clusters and name each cluster by its most frequent n-gram.
+
+        Arguments:
+        - n_clusters (int, required): number of clusters.
+
+        Output:
+        - A list with the cluster name of each phrase.
+        """
+
+        logger.info({"message": "Cutting cluster tree.", "n_clusters": n_clusters})
+
+        if n_clusters not in self._cuts:
+            labels = fcluster(self.linkage, t=n_clusters, criterion="maxclust")
+            self._cuts[n_clusters] = self.name_clusters(labels)
+
+        return self._cuts[n_clusters]
+
+    def name_clusters(self, labels):
+        bigrams = collections.defaultdict(collections.Counter)
+        unigrams = collections.defaultdict(collections.Counter)
+        for label, example_bigrams, example_unigrams in zip(labels, self.bigrams, self.unigrams):
+            bigrams[label].update(example_bigrams)
+            unigrams[label].update(example_unigrams)
+
+        names = {}
+        for label in set(labels):
+            counter = bigrams[label] or unigrams[label]
+            if len(counter) > 0:
+                names[label] = counter.most_common(1)[0][0]
+            else:
+                names[label] = "undefined cluster"
+
+        return [names[label] for label in labels]
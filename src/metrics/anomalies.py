@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+
+ANOMALY_METHODS = ["mad", "ewma"]
+# Lower bound of the spread of each metric, see anomaly_scores().
+MIN_SPREAD = {"volume": 1.0, "confidence": 0.01}
+
+
+def anomaly_scores(series, method="mad", window=7, min_periods=None, min_spread=1.0):
+    """
+    Score each time bucket of all intents at once against the previous buckets.
+
+    Arguments:
+    - series (pd.DataFrame, required): time buckets as index and intents as columns,
+    e.g. "volume" from RollupStore.intent_series().
+    - method (str, optional, default is "mad"): "mad" for a rolling median and median absolute deviation
+    (robust z-score) or "ewma" for an exponentially weighted mean and standard deviation.
+    - window (int, optional, default is 7): rolling window size or EWMA span, in time buckets.
+    - min_periods (int, optional): previous buckets required to score, default is half of the window.
+    - min_spread (float, optional, default is 1.0): lower bound of the spread, so a constant history
+    doesn't give infinite scores (e.g. 1 message for volume, 0.01 for confidence).
+
+    Output:
+    - A tuple of DataFrames like series: the score and the expected value of each bucket.
+    The current bucket is not used to compute its own expected value.
+    """
+
+    if method not in ANOMALY_METHODS:
+        logger.error({"message": "Invalid anomaly method.", "method": method})
+        raise ValueError(f"Invalid anomaly method: {method}. Use one of {ANOMALY_METHODS}.")
+
+    logger.info({"message": "Computing anomaly scores.", "method": method, "window": window,
+                 "shape": series.shape})
+
+    if min_periods is None:
+        min_periods = max(2, window // 2)
+
+    previous = series.shift(1)
+    if method == "mad":
+        rolling = previous.rolling(window, min_periods=min_periods)
+        expected = rolling.median()
+        # Median absolute deviation from the median of the same window.
+        deviation = rolling.apply(lambda w: np.nanmedian(np.abs(w - np.nanmedian(w))), raw=True)
+        # 1.4826 * MAD estimates the standard deviation of normal data.
+        spread = 1.4826 * deviation
+    else:
+        ewm = previous.ewm(span=window, min_periods=min_periods)
+        expected, spread = ewm.mean(), ewm.std()
+
+    scores = (series - expected) / np.maximum(spread, min_spread)
+    return scores, expected
+
+
+def flag_anomalies(series, scores, expected, threshold=3.5, metric="volume"):
+    """
+    Time buckets and intents with an absolute score larger than threshold.
+
+    Arguments:
+    - series (pd.DataFrame, required): observed values, time buckets as index and intents as columns.
+    - scores (pd.DataFrame, required): scores from anomaly_scores().
+    - expected (pd.DataFrame, required): expected values from anomaly_scores().
+    - threshold (float, optional, default is 3.5): minimum absolute score.
+    - metric (str, optional, default is "volume"): metric name added to the output.
+
+    Output:
+    - DataFrame with "Date", "intent", "metric", "value", "expected" and "score" columns,
+    sorted by the absolute score.
+    """
+
+    values = scores.to_numpy()
+    rows, columns = np.nonzero(np.abs(np.nan_to_num(values)) > threshold)
+
+    df_temp = pd.DataFrame({
+        "Date": scores.index[rows],
+        "intent": scores.columns[columns],
+        "metric": metric,
+        "value": series.to_numpy()[rows, columns],
+        "expected": expected.to_numpy()[rows, columns],
+        "score": values[rows, columns]
+    })
+    order = np.argsort(-np.abs(df_temp["score"].to_numpy()), kind="mergesort")
+    return df_temp.iloc[order].reset_index(drop=True)
+
+
+def detect_intent_anomalies(series, method="mad", window=7, threshold=3.5):
+    """
+    Flag the intents whose volume or mean confidence deviates from their recent history.
+
+    Arguments:
+    - series (dict, required): "volume" and "confidence" from RollupStore.intent_series().
+    - method (str, optional, default is "mad"): see anomaly_scores().
+    - window (int, optional, default is 7): see anomaly_scores().
+    - threshold (float, optional, default is 3.5): see flag_anomalies().
+
+    Output:
+    - DataFrame from flag_anomalies() with both metrics.
+    """
+
+    anomalies = []
+    for metric in ["volume", "confidence"]:
+        scores, expected = anomaly_scores(series[metric], method, window, min_spread=MIN_SPREAD[metric])
+        anomalies.append(flag_anomalies(series[metric], scores, expected, threshold, metric))
+
+    df_temp = pd.concat(anomalies, ignore_index=True)
+    order = np.argsort(-np.abs(df_temp["score"].to_numpy()), kind="mergesort")
+    return df_temp.iloc[order].reset_index(drop=True)
+
+
+def gen_plotly_anomalies(series, anomalies, intent, metric="volume"):
+    """
+    Time series of an intent metric with its anomalies highlighted.
+    """
+    logger.info({"message": "Generating anomalies plot.", "intent": intent, "metric": metric})
+    values = series[metric][intent]
+    flagged = anomalies[(anomalies["intent"] == intent) & (anomalies["metric"] == metric)]
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=values.index, y=values.values, mode="lines+markers", name=metric))
+    fig.add_trace(go.Scatter(x=flagged["Date"], y=flagged["value"], mode="markers", name="anomaly",
+                             marker=dict(color="red", size=12, symbol="x")))
+    fig.update_layout(title=f"{intent} - {metric}")
+    return fig
@@ -1,89 +1,76 @@
 import pandas as pd
-import streamlit as st
 import plotly_express as px
-from src.helper_functions import flatten, setup_logger
+from src.helper_functions import setup_logger
+from src.metrics.log_frame import DEFAULT_LOG_COLUMNS, project_logs, compact_log_frame
 
 logger = setup_logger()
 
 
-def logs_to_dataframe(logs, datetime_var):
-    lst = []
+def logs_to_dataframe(logs, datetime_var, columns=None):
+    """
+    Create a DataFrame with the columns required by the metrics pages.
+
+    Arguments:
+    - logs (list, required): Watson Assistant logs.
+    - datetime_var (str, required): timestamp column used to create the "Date" column.
+    - columns (list or dict, optional): other paths to be extracted besides DEFAULT_LOG_COLUMNS.
+    As a dict, the values are the column type, see project_logs().
+
+    Output:
+    - DataFrame with a column per path and "Date".
+    """
+    paths = dict(DEFAULT_LOG_COLUMNS)
+    if not isinstance(columns, dict):
+        columns = {path: "object" for path in columns or []}
+    for path, dtype in columns.items():
+        paths.setdefault(path, dtype)
+    paths[datetime_var] = "datetime"
 
-    for log in logs:
-        lst.append(flatten(log))
-    
     # Create DataFrame
-    df = pd.DataFrame(lst)
+    df = compact_log_frame(project_logs(logs, paths))
 
     # Add Date
-    df[datetime_var] = pd.to_datetime(df[datetime_var])
-    df['Date'] = [each.date() for each in df[datetime_var]]
+    df['Date'] = df[datetime_var].dt.normalize()
 
     return df
 
-def get_metrics(df, args):
-    metrics = {}
-
-    # Session count
-    try:
-        metrics['sessions_count'] = len(df[args['Sessions']].unique())
-    except Exception as error:
-        metrics['sessions_count'] = None
-        logger.error({"message": "Failed to get session counts.", "exception": error})
-        st.error("Failed to get session counts.")
-
-    # Messages count
-    try:
-        metrics["messages_count"] = len(df)
-    except Exception as error:
-        metrics["messages_count"] = None
-        logger.error({"message": "Failed to get messages count.", "exception": error})
-        st.error("Failed to get messages count.")
-
-    # Avg messages
-    try:
-        metrics['avg_messages'] = len(df) / len(df[args['Sessions']].unique())
-        metrics['avg_messages'] = round(metrics['avg_messages'], 1)
-    except Exception as error:
-        metrics['avg_messages'] = None
-        logger.error({"message": "Failed to get average messages.", "exception": error})
-        st.error("Failed to get average messages.")
-
-    # Active users
-    try:
-        metrics['active_users'] = len(df[args['Active users']].unique())
-    except Exception as error:
-        metrics['active_users'] = None
-        logger.error({"message": "Failed to get active users. Please, check User variable.", "exception": error})
-        st.error('Failed to get active users. Please, check "User variable" on advanced options.')
-
-    return metrics
-
-def filter_columns(df, args):
-    columns = []
-    for arg in args.values():
-        if arg in df.columns:
-            columns.append(arg)
-            
-    # Add datetime column
-    columns.append('Date')
-    return columns
-
-def gen_plotly_datetime(df, args, var):
-    columns = filter_columns(df, args)
-    df_temp = df[columns]
-    df_temp = df_temp[df_temp[args[var]].notnull()]
-    df_temp = df_temp[['Date', args[var]]]
-    df_temp.drop_duplicates(inplace=True)
-    df_temp = pd.DataFrame(df_temp['Date'].value_counts())
-    df_temp.sort_index(inplace=True)
-    df_temp.reset_index(inplace=True)
-    df_temp.columns = ['Date', args.get(var)]
-    df_temp.rename(columns={args[var]: var}, inplace=True)
-    
+# Time buckets available on the metrics charts.
+FREQUENCIES = {"Hour": "H", "Day": "D", "Week": "W", "Month": "M"}
+DATE_FORMATS = {"H": "%Y-%m-%d %H:00", "D": "%Y-%m-%d", "W": "%Y-%m-%d", "M": "%Y-%m"}
+FREQUENCY_NAMES = {"H": "hour", "D": "day", "W": "week", "M": "month"}
+
+
+def time_buckets(timestamps, freq="D", tz="UTC"):
+    """
+    Start of the time bucket of each timestamp, in the local time of tz.
+
+    Arguments:
+    - timestamps (pd.Series, required): datetime Series, naive timestamps are considered UTC.
+    - freq (str, optional, default is "D"): "H", "D", "W" (weeks start on Monday) or "M".
+    - tz (str, optional, default is "UTC"): timezone name, e.g. "America/Sao_Paulo".
+
+    Output:
+    - pd.Series with naive timestamps.
+    """
+    if timestamps.dt.tz is None:
+        timestamps = timestamps.dt.tz_localize("UTC")
+
+    local = timestamps.dt.tz_convert(tz).dt.tz_localize(None)
+    if freq in ("W", "M"):
+        return local.dt.to_period(freq).dt.start_time
+    return local.dt.floor(freq)
+
+
+def gen_plotly_datetime(df, var, freq="D"):
+    """
+    Bar chart of a metric from RollupStore.resample().
+    """
+    df_temp = df[df[var].notnull()].copy()
+    df_temp['Date'] = df_temp['Date'].dt.strftime(DATE_FORMATS[freq])
+
     fig = px.bar(df_temp, x='Date', y=var,
-                 title="{} per day".format(var))
-    fig.update_xaxes(tickformat="%Y-%m-%d", type="category")
+                 title="{} per {}".format(var, FREQUENCY_NAMES[freq]))
+    fig.update_xaxes(type="category")
     fig.update_layout(showlegend=False)
-    
-    return fig
\ No newline at end of file
+
+    return fig
@@ -0,0 +1,82 @@
+import math
+import numpy as np
+import pandas as pd
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+
+
+def _bit_length(x):
+    # Vectorized int.bit_length() for uint64 arrays.
+    n = np.zeros(x.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = x >= (np.uint64(1) << np.uint64(shift))
+        n[mask] += shift
+        x = np.where(mask, x >> np.uint64(shift), x)
+    n += (x > 0).astype(np.uint8)
+    return n
+
+
+class HyperLogLog:
+    def __init__(self, error_rate: float = 0.01):
+        """
+        HyperLogLog sketch to count distinct values with a bounded memory.
+
+        Sketches with the same error rate can be merged, e.g. per day sketches into a month count.
+
+        Arguments:
+        - error_rate (float, optional, default is 0.01): relative standard error of the count,
+        it defines the number of registers (1.04 / sqrt(registers)), from 16 to 65536.
+        """
+
+        self.error_rate = error_rate
+        self.p = int(min(max(math.ceil(2 * math.log2(1.04 / error_rate)), 4), 16))
+        self.m = 1 << self.p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def update(self, values):
+        """
+        Add values to the sketch.
+
+        Arguments:
+        - values (list-like, required): values to be counted, they are hashed with pandas.
+
+        Output:
+        - The HyperLogLog object.
+        """
+        values = np.asarray(values, dtype="object")
+        if len(values) == 0:
+            return self
+
+        hashes = pd.util.hash_array(values)
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p + 1) - _bit_length(rest)
+
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+        return self
+
+    def merge(self, other):
+        if self.p != other.p:
+            logger.error({"message": "HyperLogLog sketches with different precision can't be merged.",
+                          "p": self.p, "other_p": other.p})
+            raise ValueError("HyperLogLog sketches with different precision can't be merged.")
+
+        merged = HyperLogLog(self.error_rate)
+        merged.registers = np.maximum(self.registers, other.registers)
+        return merged
+
+    def count(self):
+        if self.m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / self.m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.m]
+
+        estimate = alpha * self.m ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+
+        # Small range correction (linear counting).
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros > 0:
+            estimate = self.m * math.log(self.m / zeros)
+
+        return int(round(estimate))
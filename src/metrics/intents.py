@@ -1,3 +1,5 @@
+import numpy as np
+import pandas as pd
 import plotly_express as px
 from src.helper_functions import setup_logger
 
@@ -6,23 +8,215 @@ logger = setup_logger()
 
 def gen_plotly_intents(df, threshold=(0.6, 1.0)):
     logger.info({"message": "Generating intents plot."})
-    df_temp = df[["response.intents.0.intent",
-                  "response.intents.0.confidence"]]
-    df_temp.columns = ["intent", "confidence"]
-    df_temp = df_temp[(df_temp["confidence"] >= threshold[0]) & (df_temp["confidence"] <= threshold[1])]
-    
-    df_temp = df_temp.groupby("intent").count().sort_values(by="confidence")
-    df_temp.reset_index(inplace=True)
-    df_temp.columns = ["intent", "quantity"]
-    df_temp = df_temp.head(20)
+    confidence = df["response.intents.0.confidence"]
+    intents = df.loc[(confidence >= threshold[0]) & (confidence <= threshold[1]), "response.intents.0.intent"]
+
+    df_temp = intents.value_counts().head(20).rename_axis("intent").reset_index(name="quantity")
+    df_temp = df_temp[df_temp["quantity"] > 0].sort_values(by="quantity")
     return px.bar(df_temp, x="quantity", y="intent",
                   title="Top 20 intents", height=600)
 
-def filter_df(df, threshold=(0.6, 1.0)):
-    logger.info({"message": "Filtering intents dataframe."})
-    df_temp = df[["response.intents.0.intent", "response.intents.0.confidence", "request.input.text", "Date"]]
-    df_temp.columns = ["intent", "confidence", "input", "date"]
-    df_temp = df_temp[(df_temp["confidence"] >= threshold[0]) & (df_temp["confidence"] <= threshold[1])]
-    df_temp.sort_values(by="confidence", inplace=True, ascending=False)
-    df_temp.sort_values(by="intent", inplace=True)
-    return df_temp
\ No newline at end of file
+
+class IntentLogIndex:
+    def __init__(self, df):
+        """
+        Logs grouped by top intent once and sorted by confidence, to browse them by pages.
+
+        The threshold and search are applied over the row offsets of each intent,
+        so the logs are not filtered or sorted again when the parameters change.
+
+        Arguments:
+        - df (pd.DataFrame, required): logs DataFrame from logs_to_dataframe().
+        """
+
+        logger.info({"message": "Indexing intent logs.", "rows": len(df)})
+
+        df_temp = df[["response.intents.0.intent", "response.intents.0.confidence",
+                      "request.input.text", "Date"]]
+        df_temp.columns = ["intent", "confidence", "input", "date"]
+        df_temp = df_temp[df_temp["intent"].notnull()].astype({"intent": "object"})
+        df_temp = df_temp.sort_values(by=["intent", "confidence"], ascending=[True, False],
+                                      kind="mergesort")
+        self.rows = df_temp.reset_index(drop=True)
+
+        intents, starts = np.unique(self.rows["intent"].to_numpy(), return_index=True)
+        ends = np.append(starts[1:], len(self.rows))
+        self.offsets = {intent: (start, end) for intent, start, end in zip(intents, starts, ends)}
+
+        # Ascending within each intent, so a threshold is a binary search.
+        self._confidence = -self.rows["confidence"].to_numpy(dtype=float)
+        self._texts = self.rows["input"].fillna("").astype(str).str.lower().to_numpy()
+        self._last_search = (None, None)
+
+    def intent_range(self, intent, threshold=(0.6, 1.0)):
+        """
+        Row positions [start, end) of an intent with confidence within the threshold.
+        """
+        start, end = self.offsets[intent]
+        confidence = self._confidence[start:end]
+        return (start + np.searchsorted(confidence, -threshold[1], side="left"),
+                start + np.searchsorted(confidence, -threshold[0], side="right"))
+
+    def counts(self, threshold=(0.6, 1.0)):
+        """
+        Number of logs of each intent within the threshold.
+        """
+        counts = {}
+        for intent in self.offsets:
+            start, end = self.intent_range(intent, threshold)
+            counts[intent] = int(end - start)
+        return counts
+
+    def search(self, intent=None, threshold=(0.6, 1.0), query=""):
+        """
+        Row positions of the logs within the threshold that contain the query (case insensitive).
+
+        Arguments:
+        - intent (str, optional): top intent, all intents if None.
+        - threshold (tuple, optional, default is (0.6, 1.0)): confidence range.
+        - query (str, optional): text to be searched in the user input.
+
+        Output:
+        - numpy array of row positions, the last result is kept for the next pages.
+        """
+
+        key = (intent, tuple(threshold), query.strip().lower())
+        if self._last_search[0] == key:
+            return self._last_search[1]
+
+        intents = list(self.offsets.keys()) if intent is None else [intent]
+        ranges = [self.intent_range(i, threshold) for i in intents]
+        positions = np.concatenate([np.arange(start, end) for start, end in ranges] or [np.array([], dtype=int)])
+
+        if key[2] != "":
+            found = pd.Series(self._texts[positions]).str.contains(key[2], regex=False).to_numpy()
+            positions = positions[found]
+
+        self._last_search = (key, positions)
+        return positions
+
+    def page(self, positions, page=0, page_size=25):
+        """
+        Rows of a page of the positions returned by search().
+        """
+        return self.rows.iloc[positions[page * page_size:(page + 1) * page_size]]
+
+
+INTENTS_COLUMN = "response.intents"
+
+
+def intent_ranks(df, column=INTENTS_COLUMN):
+    """
+    Flatten the intents returned in each log into one row per (log, rank).
+
+    Arguments:
+    - df (pd.DataFrame, required): logs DataFrame with the intents list column.
+    - column (str, optional, default is "response.intents"): intents list column.
+
+    Output:
+    - DataFrame with "log" (row position in df), "rank", "intent" and "confidence" columns.
+    """
+
+    logger.info({"message": "Flattening intent ranks.", "rows": len(df)})
+
+    values = df[column].to_numpy() if column in df.columns else np.full(len(df), None)
+    lengths = np.fromiter((len(v) if isinstance(v, list) else 0 for v in values), dtype=np.int64, count=len(values))
+    flat = [intent for v in values if isinstance(v, list) for intent in v]
+
+    logs = np.repeat(np.arange(len(values)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    return pd.DataFrame({
+        "log": logs,
+        "rank": np.arange(len(flat)) - np.repeat(starts, lengths),
+        "intent": [intent.get("intent") if isinstance(intent, dict) else None for intent in flat],
+        "confidence": np.array([intent.get("confidence") if isinstance(intent, dict) else np.nan
+                                for intent in flat], dtype=float)
+    })
+
+
+def ambiguity_analysis(df, column=INTENTS_COLUMN, bins=20):
+    """
+    Confidence and ambiguity analysis over all returned intent ranks, computed once per logs load.
+
+    Arguments:
+    - df (pd.DataFrame, required): logs DataFrame with the intents list column and "request.input.text".
+    - column (str, optional, default is "response.intents"): intents list column.
+    - bins (int, optional, default is 20): confidence histogram bins in [0, 1].
+
+    Output:
+    - A dict with:
+        - "histograms": DataFrame with top intents as index, bins lower bound as columns and logs count as values.
+        - "ambiguous": DataFrame of logs with 2 or more intents sorted by "margin" (top-1 minus top-2 confidence),
+        with "input", "intent", "confidence", "competing intent" and "competing confidence" columns.
+        - "margins": top-1 minus top-2 margin of each log (top-1 confidence if a single intent was returned).
+    """
+
+    logger.info({"message": "Analyzing intents ambiguity.", "rows": len(df), "bins": bins})
+
+    ranks = intent_ranks(df, column)
+    ranks = ranks[ranks["intent"].notnull()]
+    top1 = ranks[ranks["rank"] == 0].set_index("log")
+    top2 = ranks[ranks["rank"] == 1].set_index("log")
+    top2 = top2[top2.index.isin(top1.index)]
+
+    # Histograms of the top-1 confidence per intent.
+    bin_index = np.clip(np.floor(top1["confidence"].to_numpy() * bins), 0, bins - 1)
+    histograms = pd.crosstab(top1["intent"].to_numpy(), bin_index / bins)
+    histograms.index.name = "intent"
+    histograms.columns.name = "confidence"
+
+    margins = pd.Series(np.nan, index=np.arange(len(df)))
+    margins[top1.index] = top1["confidence"]
+    margins[top2.index] = top1.loc[top2.index, "confidence"] - top2["confidence"]
+
+    texts = df["request.input.text"].to_numpy() if "request.input.text" in df.columns else np.full(len(df), None)
+    ambiguous = pd.DataFrame({
+        "input": texts[top2.index],
+        "intent": top1.loc[top2.index, "intent"].to_numpy(),
+        "confidence": top1.loc[top2.index, "confidence"].to_numpy(),
+        "competing intent": top2["intent"].to_numpy(),
+        "competing confidence": top2["confidence"].to_numpy(),
+        "margin": margins[top2.index].to_numpy()
+    }).sort_values(by="margin", kind="mergesort").reset_index(drop=True)
+
+    return {"histograms": histograms, "ambiguous": ambiguous, "margins": margins.to_numpy()}
+
+
+def ambiguous_pairs(ambiguous, max_margin=0.1):
+    """
+    Intent pairs that compete in the logs with a margin up to max_margin.
+
+    Arguments:
+    - ambiguous (pd.DataFrame, required): "ambiguous" from ambiguity_analysis(), sorted by margin.
+    - max_margin (float, optional, default is 0.1): largest top-1 minus top-2 margin.
+
+    Output:
+    - DataFrame with "intent", "competing intent", "logs" and "mean margin" columns, sorted by logs.
+    """
+
+    end = np.searchsorted(ambiguous["margin"].to_numpy(), max_margin, side="right")
+    df_temp = ambiguous.iloc[:end]
+    pairs = df_temp.groupby(["intent", "competing intent"]).agg(
+        logs=("margin", "size"), mean_margin=("margin", "mean")).reset_index()
+    pairs.columns = ["intent", "competing intent", "logs", "mean margin"]
+    return pairs.sort_values(by="logs", ascending=False, kind="mergesort").reset_index(drop=True)
+
+
+def gen_plotly_confidence(histograms, intent=None):
+    """
+    Top-1 confidence histogram of an intent, or of all intents if intent is None.
+    """
+    logger.info({"message": "Generating confidence histogram.", "intent": intent})
+    counts = histograms.sum(axis=0) if intent is None else histograms.loc[intent]
+    df_temp = counts.rename_axis("confidence").reset_index(name="logs")
+    return px.bar(df_temp, x="confidence", y="logs",
+                  title=f"Confidence distribution - {intent or 'all intents'}")
+
+
+def gen_plotly_margins(margins, bins=20):
+    """
+    Histogram of the top-1 minus top-2 confidence margin.
+    """
+    logger.info({"message": "Generating margins histogram."})
+    df_temp = pd.DataFrame({"margin": margins[~np.isnan(margins)]})
+    return px.histogram(df_temp, x="margin", nbins=bins, title="Top-1 vs top-2 confidence margin")
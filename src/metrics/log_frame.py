@@ -0,0 +1,183 @@
+import io
+import functools
+import pandas as pd
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+
+# Paths extracted from Watson Assistant logs by default, with the column type.
+DEFAULT_LOG_COLUMNS = {
+    "log_id": "object",
+    "request_timestamp": "datetime",
+    "response_timestamp": "datetime",
+    "request.input.text": "object",
+    "response.context.conversation_id": "object",
+    "response.context.global.system.user_id": "object",
+    "response.intents.0.intent": "object",
+    "response.intents.0.confidence": "float"
+}
+
+# Column type of the empty columns when there are no logs.
+EMPTY_COLUMN_TYPES = {
+    "float": "float64",
+    "datetime": "datetime64[ns, UTC]"
+}
+
+
+def compile_path(path, sep="."):
+    """
+    Compile a path like "response.intents.0.intent" into a getter function.
+
+    Arguments:
+    - path (str, required): keys separated by sep, digits are used as list indexes.
+    - sep (str, optional, default is "."): keys separator.
+
+    Output:
+    - A function that returns the value of the path in a log or None if the path doesn't exist.
+    """
+
+    keys = tuple(int(key) if key.isdigit() else key for key in path.split(sep))
+
+    def getter(log):
+        value = log
+        try:
+            for key in keys:
+                value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+        return value
+
+    return getter
+
+
+def project_logs(logs, columns=None, sep="."):
+    """
+    Extract only the required paths of each log into typed columns.
+
+    Arguments:
+    - logs (list, required): Watson Assistant logs.
+    - columns (dict or list, optional, default is DEFAULT_LOG_COLUMNS): paths to be extracted.
+    As a dict, the values are the column type: "object", "float", "datetime" or "list" (value kept as is).
+    - sep (str, optional, default is "."): keys separator.
+
+    Output:
+    - DataFrame with a column per path. Paths not found in any log are dropped, like flatten() does,
+    except when there are no logs: all columns are kept empty, datetimes in UTC like the Watson Assistant timestamps.
+    """
+
+    if columns is None:
+        columns = DEFAULT_LOG_COLUMNS
+    if not isinstance(columns, dict):
+        columns = {path: "object" for path in columns}
+
+    logger.info({"message": "Projecting logs.", "logs_count": len(logs),
+                 "columns": list(columns.keys())})
+
+    data = {}
+    for path, dtype in columns.items():
+        getter = compile_path(path, sep=sep)
+        values = [getter(log) for log in logs]
+        if len(logs) == 0:
+            data[path] = pd.Series([], dtype=EMPTY_COLUMN_TYPES.get(dtype, "object"))
+            continue
+        if all(value is None for value in values):
+            continue
+
+        if dtype == "float":
+            values = pd.to_numeric(pd.Series(values, dtype="object"), errors="coerce")
+        elif dtype == "datetime":
+            values = pd.to_datetime(pd.Series(values, dtype="object"))
+        data[path] = values
+
+    return pd.DataFrame(data, index=pd.RangeIndex(len(logs)))
+
+
+def compact_log_frame(df, max_unique_ratio=0.5):
+    """
+    Reduce the memory of a log DataFrame.
+
+    Text columns with repeated values (intents, conversation and user ids) become categorical
+    and float columns (confidences) become float32.
+
+    Arguments:
+    - df (pd.DataFrame, required): logs DataFrame, e.g. from project_logs().
+    - max_unique_ratio (float, optional, default is 0.5): text columns with fewer unique values
+    than this ratio of the rows become categorical.
+
+    Output:
+    - Compacted DataFrame.
+    """
+
+    logger.info({"message": "Compacting logs DataFrame.", "rows": len(df)})
+
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype("float32")
+        elif pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column]):
+            try:
+                n_unique = df[column].nunique(dropna=True)
+            except TypeError:
+                # Unhashable values, e.g. lists.
+                continue
+            if n_unique <= max_unique_ratio * len(df):
+                df[column] = df[column].astype("category")
+
+    return df
+
+
+def log_frame_to_parquet(df, path=None):
+    """
+    Write a log DataFrame with Arrow (parquet), dtypes like categorical and float32 are kept.
+
+    Arguments:
+    - df (pd.DataFrame, required): logs DataFrame.
+    - path (str, optional): file path, if None the parquet bytes are returned.
+
+    Output:
+    - parquet bytes when path is None.
+    """
+
+    logger.info({"message": "Writing logs DataFrame to parquet.", "path": path})
+
+    if path is None:
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, engine="pyarrow", index=False)
+        return buffer.getvalue()
+
+    df.to_parquet(path, engine="pyarrow", index=False)
+
+
+def log_frame_from_parquet(source):
+    """
+    Read a log DataFrame written by log_frame_to_parquet().
+
+    Arguments:
+    - source (str or bytes, required): file path or parquet bytes.
+
+    Output:
+    - DataFrame.
+    """
+
+    logger.info({"message": "Reading logs DataFrame from parquet."})
+
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    return pd.read_parquet(source, engine="pyarrow")
+
+
+@functools.lru_cache(maxsize=4)
+def cached_log_frame(data):
+    """
+    log_frame_from_parquet() of parquet bytes, decoded once while they are in use.
+
+    Pages hand log frames over as parquet bytes in the session state, which is hashed on each rerun:
+    hashing bytes is cheap, hashing a DataFrame is not. The frame is shared, so don't modify it.
+
+    Arguments:
+    - data (bytes, required): parquet bytes from log_frame_to_parquet().
+
+    Output:
+    - DataFrame.
+    """
+    return log_frame_from_parquet(data)
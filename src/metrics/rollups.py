@@ -0,0 +1,501 @@
+import datetime
+import functools
+import collections
+import threading
+import numpy as np
+import pandas as pd
+from src.helper_functions import setup_logger
+from src.metrics.hyperloglog import HyperLogLog
+from src.metrics.conversation import time_buckets
+from src.metrics.sessions import SESSION_COLUMNS, session_features, merge_session_fragments
+
+logger = setup_logger()
+
+INTENT_COLUMN = "response.intents.0.intent"
+CONFIDENCE_COLUMN = "response.intents.0.confidence"
+INTENT_ROLLUP_COLUMNS = ["bucket", "intent", "messages", "confidence_sum"]
+
+# Smallest HyperLogLog error rate per bucket size: a sketch of 1% error is 16 KB and an hourly
+# store keeps one per bucket and field, so hourly sketches get at most 1024 registers (1 KB).
+MIN_ERROR_RATES = {"H": 1.04 / 32}
+
+# Stores kept in memory, the least recently used one is dropped first.
+STORES_SIZE = 4
+_stores = collections.OrderedDict()
+_stores_lock = threading.Lock()
+
+
+class ExactDistinct:
+    def __init__(self):
+        """
+        Mergeable distinct counter that keeps the values, the count is exact.
+        """
+        self.values = set()
+
+    def update(self, values):
+        self.values.update(values)
+        return self
+
+    def merge(self, other):
+        merged = ExactDistinct()
+        merged.values = self.values | other.values
+        return merged
+
+    def count(self):
+        return len(self.values)
+
+
+def to_utc_timestamp(date):
+    date = pd.Timestamp(date)
+    if date.tzinfo is None:
+        return date.tz_localize("UTC")
+    return date.tz_convert("UTC")
+
+
+def days_between(start_date, end_date):
+    """
+    Days of the range [start_date, end_date).
+    """
+    return [day for day in pd.date_range(start_date, end_date, freq="D").date if day < end_date]
+
+
+def covered_days(timestamps, start_date, end_date, truncated=False):
+    """
+    Days of [start_date, end_date) with all their logs in a fetch sorted by descending request timestamp.
+
+    Arguments:
+    - timestamps (pd.Series or list, required): request timestamps of the fetched logs.
+    - start_date (datetime.date, required): first day of the fetch.
+    - end_date (datetime.date, required): day after the last one of the fetch.
+    - truncated (bool, optional, default is False): True when the fetch reached its max logs,
+    so only the days after the oldest log are complete.
+
+    Output:
+    - List of datetime.date.
+    """
+    days = days_between(start_date, end_date)
+    if not truncated:
+        return days
+    if len(timestamps) == 0:
+        return []
+    oldest = pd.to_datetime(timestamps, utc=True).min()
+    # Logs are filtered by response timestamp, a log of the day may be requested a little before midnight.
+    return [day for day in days if to_utc_timestamp(day) - pd.Timedelta(minutes=1) > oldest]
+
+
+def missing_ranges(loaded_days, start_date, end_date):
+    """
+    Date ranges [start, end) of the days not in loaded_days. Today is always missing, its logs keep coming.
+
+    Arguments:
+    - loaded_days (set, required): datetime.date already loaded.
+    - start_date (datetime.date, required): first day.
+    - end_date (datetime.date, required): day after the last one, like define_query_by_date().
+
+    Output:
+    - A list of (start, end) tuples of datetime.date.
+    """
+
+    today = datetime.datetime.utcnow().date()
+
+    ranges = []
+    for day in days_between(start_date, end_date):
+        if day in loaded_days and day < today:
+            continue
+        if len(ranges) > 0 and ranges[-1][1] == day:
+            ranges[-1] = (ranges[-1][0], day + datetime.timedelta(days=1))
+        else:
+            ranges.append((day, day + datetime.timedelta(days=1)))
+
+    return ranges
+
+
+def rollup_logs(df, datetime_var, sessions_var, users_var, sketch=ExactDistinct, freq="D"):
+    """
+    Aggregate a logs DataFrame by time bucket.
+
+    Arguments:
+    - df (pd.DataFrame, required): logs DataFrame, e.g. from logs_to_dataframe().
+    - datetime_var (str, required): timestamp column.
+    - sessions_var (str, required): conversation id column.
+    - users_var (str, required): user id column.
+    - sketch (callable, optional, default is ExactDistinct): creates a mergeable distinct counter.
+    - freq (str, optional, default is "D"): bucket size as a pandas frequency.
+
+    Output:
+    - A dict with the bucket start (UTC) as key and a dict with "messages" count,
+    "sessions" and "users" distinct counters as value. Counters are None if the column is missing.
+    """
+
+    logger.info({"message": "Rolling up logs.", "rows": len(df), "freq": freq})
+
+    if len(df) == 0:
+        return {}
+
+    buckets = df[datetime_var].dt.tz_convert("UTC").dt.floor(freq)
+    messages = buckets.value_counts()
+
+    distinct = {}
+    for key, column in [("sessions", sessions_var), ("users", users_var)]:
+        if column in df.columns:
+            values = df[column].astype("object")
+            distinct[key] = values[values.notnull()].groupby(buckets[values.notnull()]).unique()
+        else:
+            distinct[key] = None
+
+    rollups = {}
+    for bucket, count in messages.items():
+        rollups[bucket] = {"messages": int(count)}
+        for key, values in distinct.items():
+            if values is None:
+                rollups[bucket][key] = None
+            else:
+                rollups[bucket][key] = sketch().update(values.get(bucket, []))
+
+    return rollups
+
+
+def rollup_intents(df, datetime_var, freq="D"):
+    """
+    Messages count and confidence sum of each top intent per time bucket.
+
+    Arguments:
+    - df (pd.DataFrame, required): logs DataFrame, e.g. from logs_to_dataframe().
+    - datetime_var (str, required): timestamp column.
+    - freq (str, optional, default is "D"): bucket size as a pandas frequency.
+
+    Output:
+    - DataFrame with "bucket" (UTC), "intent", "messages" and "confidence_sum" columns.
+    """
+
+    if len(df) == 0 or INTENT_COLUMN not in df.columns:
+        return pd.DataFrame(columns=INTENT_ROLLUP_COLUMNS)
+
+    df_temp = pd.DataFrame({
+        "bucket": df[datetime_var].dt.tz_convert("UTC").dt.floor(freq),
+        "intent": df[INTENT_COLUMN].astype("object"),
+        "confidence": df[CONFIDENCE_COLUMN].astype(float) if CONFIDENCE_COLUMN in df.columns else float("nan")
+    })
+    df_temp = df_temp[df_temp["intent"].notnull()]
+
+    df_temp = df_temp.groupby(["bucket", "intent"]).agg(
+        messages=("confidence", "size"), confidence_sum=("confidence", "sum"))
+    return df_temp.reset_index()[INTENT_ROLLUP_COLUMNS]
+
+
+def resample_rollups(buckets, freq="D", tz="UTC"):
+    """
+    Merge buckets into larger time buckets, e.g. hours into days of a timezone.
+
+    Arguments:
+    - buckets (dict, required): buckets from rollup_logs().
+    - freq (str, optional, default is "D"): "H", "D", "W" or "M".
+    - tz (str, optional, default is "UTC"): timezone name.
+
+    Output:
+    - DataFrame with "Date", "Messages", "Sessions" and "Active users" columns.
+    """
+
+    columns = ["Date", "Messages", "Sessions", "Active users"]
+    if len(buckets) == 0:
+        return pd.DataFrame(columns=columns)
+
+    new_buckets = time_buckets(pd.Series(list(buckets.keys())), freq, tz)
+
+    merged = {}
+    for bucket, rollup in zip(new_buckets, buckets.values()):
+        if bucket not in merged:
+            merged[bucket] = dict(rollup)
+            continue
+        merged[bucket]["messages"] += rollup["messages"]
+        for key in ["sessions", "users"]:
+            if merged[bucket][key] is not None and rollup[key] is not None:
+                merged[bucket][key] = merged[bucket][key].merge(rollup[key])
+            else:
+                merged[bucket][key] = None
+
+    rows = []
+    for bucket, rollup in sorted(merged.items()):
+        rows.append([bucket, rollup["messages"],
+                     rollup["sessions"].count() if rollup["sessions"] is not None else None,
+                     rollup["users"].count() if rollup["users"] is not None else None])
+
+    return pd.DataFrame(rows, columns=columns)
+
+
+class RollupStore:
+    def __init__(self, datetime_var, sessions_var, users_var, sketch=ExactDistinct, freq="D",
+                 resolution_intents=(), gap_minutes=30):
+        """
+        Time bucket aggregates of a skill logs, updated as new logs are loaded.
+
+        Each bucket keeps the messages count and mergeable distinct counters of sessions and users,
+        so any date range can be answered without the raw logs. The features of each session
+        (see session_features()) are kept too.
+
+        Arguments:
+        - datetime_var (str, required): timestamp column.
+        - sessions_var (str, required): conversation id column, None to not count sessions.
+        - users_var (str, required): user id column, None to not count users.
+        - sketch (callable, optional, default is ExactDistinct): creates a mergeable distinct counter,
+        e.g. HyperLogLog to keep a bounded memory per bucket.
+        - freq (str, optional, default is "D"): bucket size as a pandas frequency.
+        - resolution_intents (tuple, optional): top intents that mean the session was resolved.
+        - gap_minutes (int, optional, default is 30): inactivity that starts a new session without conversation id.
+        """
+
+        logger.info({"message": "Instantiate RollupStore.", "freq": freq})
+
+        self.datetime_var = datetime_var
+        self.sessions_var = sessions_var
+        self.users_var = users_var
+        self.sketch = sketch
+        self.freq = freq
+        self.resolution_intents = resolution_intents
+        self.gap_minutes = gap_minutes
+        self.buckets = {}
+        self.sessions = pd.DataFrame(columns=SESSION_COLUMNS)
+        self.intents = pd.DataFrame(columns=INTENT_ROLLUP_COLUMNS)
+        self.loaded_days = set()
+        self._resampled = {}
+        self._lock = threading.Lock()
+
+    def missing_ranges(self, start_date, end_date):
+        """
+        Date ranges [start, end) that were not loaded yet. Today is always reloaded.
+
+        Arguments:
+        - start_date (datetime.date, required): first day.
+        - end_date (datetime.date, required): day after the last one, like define_query_by_date().
+
+        Output:
+        - A list of (start, end) tuples of datetime.date.
+        """
+
+        return missing_ranges(self.loaded_days, start_date, end_date)
+
+    def update(self, df, start_date, end_date, complete=True):
+        """
+        Replace the buckets of [start_date, end_date) by the aggregates of the logs in df.
+
+        Arguments:
+        - df (pd.DataFrame, required): all logs of the date range, it can be empty.
+        - start_date (datetime.date, required): first day.
+        - end_date (datetime.date, required): day after the last one.
+        - complete (bool, optional, default is True): False when df may miss logs of the range (e.g. the fetch
+        reached max_logs), the buckets are replaced but the days are not marked as loaded, so they are fetched again.
+        """
+
+        logger.info({"message": "Updating rollups.", "start_date": str(start_date),
+                     "end_date": str(end_date), "rows": len(df)})
+
+        rollups = rollup_logs(df, self.datetime_var, self.sessions_var, self.users_var,
+                              sketch=self.sketch, freq=self.freq)
+        start, end = to_utc_timestamp(start_date), to_utc_timestamp(end_date)
+
+        resolved = None
+        if len(self.resolution_intents) > 0 and INTENT_COLUMN in df.columns:
+            resolved = df[INTENT_COLUMN].isin(self.resolution_intents)
+        sessions = session_features(df, self.datetime_var, self.sessions_var, self.users_var,
+                                    resolved=resolved, gap_minutes=self.gap_minutes)
+        # Unique ids across updates, sessions crossing start_date or end_date are merged by select_sessions().
+        sessions["session"] = str(start_date) + "-" + sessions["session"].astype(str)
+        intents = rollup_intents(df, self.datetime_var, freq=self.freq)
+
+        with self._lock:
+            self.buckets = {bucket: rollup for bucket, rollup in self.buckets.items()
+                            if bucket < start or bucket >= end}
+            self.buckets.update(rollups)
+            kept = (self.sessions["start"] < start) | (self.sessions["start"] >= end)
+            self.sessions = pd.concat([self.sessions[kept], sessions], ignore_index=True)
+            kept = (self.intents["bucket"] < start) | (self.intents["bucket"] >= end)
+            self.intents = pd.concat([self.intents[kept], intents], ignore_index=True)
+            if complete:
+                self.loaded_days.update(days_between(start_date, end_date))
+            self._resampled = {}
+
+    def select(self, start_date, end_date):
+        start, end = to_utc_timestamp(start_date), to_utc_timestamp(end_date)
+        with self._lock:
+            return {bucket: rollup for bucket, rollup in self.buckets.items()
+                    if bucket >= start and bucket < end}
+
+    def select_sessions(self, start_date, end_date):
+        """
+        Features of the sessions started in [start_date, end_date).
+
+        Sessions of the updates are fragments cut at the date range of each update (e.g. at midnight),
+        the fragments of the range and one day around it are merged, see merge_session_fragments().
+        """
+        start, end = to_utc_timestamp(start_date), to_utc_timestamp(end_date)
+        margin = pd.Timedelta(days=1)
+        with self._lock:
+            sessions = self.sessions
+        sessions = sessions[(sessions["start"] >= start - margin) & (sessions["start"] < end + margin)]
+        sessions = merge_session_fragments(sessions, self.gap_minutes)
+        return sessions[(sessions["start"] >= start) & (sessions["start"] < end)]
+
+    def loaded_range(self):
+        """
+        First day and the day after the last one loaded, None if nothing was loaded.
+        """
+        with self._lock:
+            if len(self.loaded_days) == 0:
+                return None
+            return min(self.loaded_days), max(self.loaded_days) + datetime.timedelta(days=1)
+
+    def metrics(self, start_date, end_date):
+        """
+        Metrics of [start_date, end_date) merged from the buckets: "messages_count", "sessions_count",
+        "avg_messages" and "active_users" (None when the column is missing).
+        """
+
+        logger.info({"message": "Getting metrics from rollups.",
+                     "start_date": str(start_date), "end_date": str(end_date)})
+
+        buckets = list(self.select(start_date, end_date).values())
+        metrics = {"messages_count": sum(rollup["messages"] for rollup in buckets)}
+
+        for key, metric in [("sessions", "sessions_count"), ("users", "active_users")]:
+            sketches = [rollup[key] for rollup in buckets]
+            if len(sketches) == 0 or any(sketch is None for sketch in sketches):
+                metrics[metric] = None
+                continue
+
+            merged = sketches[0]
+            for sketch in sketches[1:]:
+                merged = merged.merge(sketch)
+            metrics[metric] = merged.count()
+
+        if metrics["sessions_count"]:
+            metrics["avg_messages"] = round(metrics["messages_count"] / metrics["sessions_count"], 1)
+        else:
+            metrics["avg_messages"] = None
+
+        return metrics
+
+    def resample(self, start_date, end_date, freq="D", tz="UTC"):
+        """
+        Metrics of [start_date, end_date) per time bucket, see resample_rollups().
+        The result is kept until the store is updated, so switching metrics doesn't recompute it.
+        """
+
+        key = (start_date, end_date, freq, tz)
+        with self._lock:
+            if key in self._resampled:
+                return self._resampled[key]
+
+        logger.info({"message": "Resampling rollups.", "freq": freq, "tz": tz})
+        df = resample_rollups(self.select(start_date, end_date), freq=freq, tz=tz)
+
+        with self._lock:
+            self._resampled[key] = df
+        return df
+
+    def intent_series(self, start_date, end_date, freq="D", tz="UTC"):
+        """
+        Volume and mean confidence of each top intent per time bucket of [start_date, end_date).
+
+        Output:
+        - A dict with "volume" and "confidence" DataFrames, time buckets as index and intents as columns.
+        All time buckets of the loaded days until now are kept, so an intent without messages in a bucket
+        has volume 0 and confidence NaN. Days not loaded (e.g. truncated fetches) and the current bucket,
+        still incomplete, are left out.
+        """
+
+        key = ("intents", start_date, end_date, freq, tz)
+        with self._lock:
+            if key in self._resampled:
+                return self._resampled[key]
+            intents = self.intents
+            loaded_days = set(self.loaded_days)
+
+        logger.info({"message": "Resampling intent rollups.", "freq": freq, "tz": tz})
+
+        start, end = to_utc_timestamp(start_date), to_utc_timestamp(end_date)
+        now = pd.Timestamp.utcnow()
+        hours = pd.date_range(start, end, freq="H")
+        hours = hours[(hours < min(end, now))
+                      & np.array([day in loaded_days for day in hours.date], dtype=bool)]
+        intents = intents[intents["bucket"].isin(hours)]
+        index = pd.Index(time_buckets(pd.Series(hours), freq, tz).unique(), name="Date").sort_values()
+        if end > now:
+            # The bucket of now is still filling up, its volume would look like a drop.
+            index = index[index < time_buckets(pd.Series([now]), freq, tz).iloc[0]]
+
+        buckets = time_buckets(pd.Series(intents["bucket"].to_numpy(), dtype="datetime64[ns, UTC]"), freq, tz)
+        df_temp = intents.astype({"messages": "int64", "confidence_sum": "float64"}).assign(Date=buckets.to_numpy())
+        df_temp = df_temp.groupby(["Date", "intent"])[["messages", "confidence_sum"]].sum()
+
+        volume = df_temp["messages"].unstack("intent").reindex(index).fillna(0)
+        confidence = (df_temp["confidence_sum"] / df_temp["messages"]).unstack("intent").reindex(index)
+        series = {"volume": volume.astype(float), "confidence": confidence.astype(float)}
+
+        with self._lock:
+            self._resampled[key] = series
+        return series
+
+
+def _cached_store(key, create):
+    # LRU of the stores of all skills and variables, like get_flow_cache().
+    with _stores_lock:
+        if key in _stores:
+            _stores.move_to_end(key)
+        else:
+            _stores[key] = create()
+            if len(_stores) > STORES_SIZE:
+                _stores.popitem(last=False)
+        return _stores[key]
+
+
+def get_rollup_store(skill_id, datetime_var, sessions_var, users_var,
+                     approximate=False, error_rate=0.01, freq="D", resolution_intents=()):
+    """
+    Return the RollupStore of a skill and variables, the last STORES_SIZE stores are kept in memory.
+
+    Arguments:
+    - skill_id (str, required): Watson Assistant skill id.
+    - datetime_var (str, required): timestamp column.
+    - sessions_var (str, required): conversation id column.
+    - users_var (str, required): user id column.
+    - approximate (bool, optional, default is False): count distinct sessions and users with HyperLogLog.
+    - error_rate (float, optional, default is 0.01): HyperLogLog relative standard error,
+    at least MIN_ERROR_RATES of freq so the memory of small buckets stays low.
+    - freq (str, optional, default is "D"): bucket size as a pandas frequency.
+    - resolution_intents (tuple, optional): top intents that mean the session was resolved.
+
+    Output:
+    - RollupStore object.
+    """
+
+    if approximate:
+        error_rate = max(error_rate, MIN_ERROR_RATES.get(freq, 0))
+        sketch = functools.partial(HyperLogLog, error_rate=error_rate)
+    else:
+        sketch = ExactDistinct
+        error_rate = None
+
+    resolution_intents = tuple(sorted(resolution_intents))
+    key = (skill_id, datetime_var, sessions_var, users_var, error_rate, freq, resolution_intents)
+    return _cached_store(key, lambda: RollupStore(datetime_var, sessions_var, users_var, sketch=sketch,
+                                                  freq=freq, resolution_intents=resolution_intents))
+
+
+def get_intent_store(skill_id, datetime_var, freq="H"):
+    """
+    Return the RollupStore of the intent volumes of a skill, used by the anomaly detection.
+
+    It's kept apart from the stores of get_rollup_store(), so logs loaded with other columns
+    don't replace their buckets. Sessions and users are not counted.
+
+    Arguments:
+    - skill_id (str, required): Watson Assistant skill id.
+    - datetime_var (str, required): timestamp column.
+    - freq (str, optional, default is "H"): bucket size as a pandas frequency.
+
+    Output:
+    - RollupStore object.
+    """
+
+    key = ("intents", skill_id, datetime_var, freq)
+    return _cached_store(key, lambda: RollupStore(datetime_var, None, None, freq=freq))
@@ -0,0 +1,181 @@
+import numpy as np
+import pandas as pd
+import plotly_express as px
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+
+SESSION_COLUMNS = ["session", "conversation", "by_user", "start", "end", "duration_seconds",
+                   "turns", "turns_to_resolution"]
+
+
+def _utc_nanoseconds(timestamps):
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert("UTC").dt.tz_localize(None)
+    return timestamps.values.astype("datetime64[ns]").view("int64")
+
+
+def sessionize(df, datetime_var, sessions_var=None, users_var=None, gap_minutes=30):
+    """
+    Assign a session number to each log.
+
+    Logs with a conversation id are grouped by it. Logs without it are grouped by user id
+    and split when the time between two messages is larger than gap_minutes.
+    The logs are sorted once by (key, timestamp) and the sessions are found with NumPy.
+
+    Arguments:
+    - df (pd.DataFrame, required): logs DataFrame.
+    - datetime_var (str, required): timestamp column.
+    - sessions_var (str, optional): conversation id column.
+    - users_var (str, optional): user id column, used when the conversation id is missing.
+    - gap_minutes (int, optional, default is 30): inactivity that starts a new session.
+
+    Output:
+    - A dict with "order" (row positions sorted by session and timestamp), "session" (session number of
+    each sorted row), "starts" (position where each session starts in the sorted rows), "keys"
+    (conversation or user id of each sorted row) and "by_user" (True when the key is the user id).
+    Logs without conversation and user id are left out.
+    """
+
+    logger.info({"message": "Sessionizing logs.", "rows": len(df), "gap_minutes": gap_minutes})
+
+    n = len(df)
+    if sessions_var in df.columns:
+        conversations, conversation_labels = pd.factorize(df[sessions_var].astype("object"))
+    else:
+        conversations, conversation_labels = np.full(n, -1), np.array([], dtype="object")
+    if users_var in df.columns:
+        users, user_labels = pd.factorize(df[users_var].astype("object"))
+    else:
+        users, user_labels = np.full(n, -1), np.array([], dtype="object")
+
+    # A single integer key: conversation codes first, then user codes for logs without conversation id.
+    by_user = (conversations < 0) & (users >= 0)
+    keys = np.where(by_user, len(conversation_labels) + users, conversations)
+    labels = np.concatenate([np.asarray(conversation_labels, dtype="object"),
+                             np.asarray(user_labels, dtype="object")])
+
+    timestamps = _utc_nanoseconds(df[datetime_var])
+    valid = np.flatnonzero(keys >= 0)
+    order = valid[np.lexsort((timestamps[valid], keys[valid]))]
+
+    sorted_keys = keys[order]
+    sorted_timestamps = timestamps[order]
+
+    new_session = np.ones(len(order), dtype=bool)
+    if len(order) > 1:
+        same_key = sorted_keys[1:] == sorted_keys[:-1]
+        gap = np.diff(sorted_timestamps) > gap_minutes * 60 * 10 ** 9
+        new_session[1:] = ~same_key | (gap & by_user[order][1:])
+
+    return {"order": order,
+            "session": np.cumsum(new_session) - 1,
+            "starts": np.flatnonzero(new_session),
+            "keys": labels[sorted_keys] if len(order) > 0 else np.array([], dtype="object"),
+            "by_user": by_user[order]}
+
+
+def session_features(df, datetime_var, sessions_var=None, users_var=None,
+                     resolved=None, gap_minutes=30):
+    """
+    Compute the features of each session with segment operations over the sorted logs.
+
+    Arguments:
+    - df (pd.DataFrame, required): logs DataFrame.
+    - datetime_var (str, required): timestamp column.
+    - sessions_var (str, optional): conversation id column.
+    - users_var (str, optional): user id column, used when the conversation id is missing.
+    - resolved (array-like of bool, optional): logs where the user need was resolved.
+    - gap_minutes (int, optional, default is 30): inactivity that starts a new session.
+
+    Output:
+    - DataFrame with one row per session: "session", "conversation" (conversation or user id), "by_user"
+    (True when "conversation" is the user id), "start", "end", "duration_seconds", "turns" and
+    "turns_to_resolution" (NaN if never resolved).
+    """
+
+    logger.info({"message": "Computing session features.", "rows": len(df)})
+
+    sessions = sessionize(df, datetime_var, sessions_var, users_var, gap_minutes)
+    order, starts = sessions["order"], sessions["starts"]
+    if len(order) == 0:
+        return pd.DataFrame(columns=SESSION_COLUMNS)
+
+    timestamps = _utc_nanoseconds(df[datetime_var])[order]
+    ends = np.append(starts[1:], len(order)) - 1
+
+    if resolved is not None:
+        resolved = np.asarray(resolved, dtype=bool)[order]
+        positions = np.where(resolved, np.arange(len(order)), len(order))
+        first_resolved = np.minimum.reduceat(positions, starts)
+        turns_to_resolution = np.where(first_resolved < len(order), first_resolved - starts + 1, np.nan)
+    else:
+        turns_to_resolution = np.full(len(starts), np.nan)
+
+    return pd.DataFrame({
+        "session": np.arange(len(starts)),
+        "conversation": sessions["keys"][starts],
+        "by_user": sessions["by_user"][starts],
+        "start": pd.to_datetime(timestamps[starts], utc=True),
+        "end": pd.to_datetime(timestamps[ends], utc=True),
+        "duration_seconds": (timestamps[ends] - timestamps[starts]) / 10 ** 9,
+        "turns": ends - starts + 1,
+        "turns_to_resolution": turns_to_resolution
+    }, columns=SESSION_COLUMNS)
+
+
+def merge_session_fragments(df, gap_minutes=30):
+    """
+    Merge the sessions computed over separate date ranges (e.g. a day each) that are the same session.
+
+    A session continues in the next fragment with the same conversation id, or with the same user id
+    (logs without conversation id) when it starts less than gap_minutes after the previous one ended,
+    like sessionize() does over all the logs.
+
+    Arguments:
+    - df (pd.DataFrame, required): sessions from session_features() of each date range, with unique "session" ids.
+    - gap_minutes (int, optional, default is 30): inactivity that starts a new session.
+
+    Output:
+    - DataFrame with SESSION_COLUMNS, a merged session keeps the id of its first fragment.
+    """
+
+    if len(df) == 0:
+        return df
+
+    df = df.assign(start=pd.to_datetime(df["start"], utc=True), end=pd.to_datetime(df["end"], utc=True))
+    keys = pd.factorize(df["conversation"].astype("object"))[0]
+    by_user = df["by_user"].astype(bool).to_numpy()
+    order = np.lexsort((_utc_nanoseconds(df["start"]), keys, by_user))
+    df = df.iloc[order].reset_index(drop=True)
+    keys, by_user = keys[order], by_user[order]
+
+    starts, ends = _utc_nanoseconds(df["start"]), _utc_nanoseconds(df["end"])
+    continuation = np.zeros(len(df), dtype=bool)
+    continuation[1:] = ((keys[1:] == keys[:-1]) & (by_user[1:] == by_user[:-1])
+                        & (~by_user[1:] | (starts[1:] - ends[:-1] <= gap_minutes * 60 * 10 ** 9)))
+    if not continuation.any():
+        return df.sort_values(by="start", kind="mergesort").reset_index(drop=True)[SESSION_COLUMNS]
+
+    groups = np.cumsum(~continuation)
+    turns = df["turns"].astype("int64")
+    # Turns to resolution of a merged session: turns of its previous fragments plus the ones of the first resolution.
+    previous_turns = turns.groupby(groups).cumsum() - turns
+    resolution = previous_turns + df["turns_to_resolution"].astype(float)
+
+    merged = df.groupby(groups).agg(session=("session", "first"), conversation=("conversation", "first"),
+                                    by_user=("by_user", "first"), start=("start", "min"), end=("end", "max"),
+                                    turns=("turns", "sum"))
+    merged["turns_to_resolution"] = resolution.groupby(groups).min()
+    merged["duration_seconds"] = (merged["end"] - merged["start"]).dt.total_seconds()
+    return merged.sort_values(by="start", kind="mergesort").reset_index(drop=True)[SESSION_COLUMNS]
+
+
+def gen_plotly_sessions(df, var, title):
+    """
+    Histogram of a session feature from session_features().
+    """
+    df_temp = df[df[var].notnull()]
+    fig = px.histogram(df_temp, x=var, title=title)
+    fig.update_layout(showlegend=False)
+    return fig
@@ -0,0 +1,187 @@
+import re
+import zlib
+import string
+from unicodedata import normalize
+import numpy as np
+import pandas as pd
+from src.helper_functions import setup_logger
+
+logger = setup_logger()
+SEED = 1993
+
+# Mersenne prime of the MinHash permutations, shingle hashes are kept below it.
+MERSENNE_PRIME = (1 << 31) - 1
+# Shingles hashed at once per permutation chunk in MinHashLSH.signatures().
+CHUNK_SHINGLES = 1 << 18
+
+_punctuation = re.compile("[" + re.escape(string.punctuation) + "]")
+_spaces = re.compile(r"\s+")
+
+
+def normalize_for_shingles(text):
+    """
+    Lowercase text without accents, punctuation and repeated spaces.
+    """
+    text = normalize("NFKD", str(text).lower()).encode("ASCII", "ignore").decode("ASCII")
+    return _spaces.sub(" ", _punctuation.sub(" ", text)).strip()
+
+
+def shingles(text, size=5):
+    """
+    Hashes of the character shingles of a normalized text, the whole text when it's shorter than size.
+    """
+    if len(text) == 0:
+        return set()
+    if len(text) <= size:
+        return {zlib.crc32(text.encode("utf-8")) & MERSENNE_PRIME}
+    return {zlib.crc32(text[i:i + size].encode("utf-8")) & MERSENNE_PRIME for i in range(len(text) - size + 1)}
+
+
+def lsh_params(threshold, num_perm):
+    """
+    Bands and rows per band of num_perm permutations whose LSH S-curve, (1 / bands) ** (1 / rows),
+    is the closest to the Jaccard threshold.
+    """
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm // rows > 0]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+
+class MinHashLSH:
+    def __init__(self, threshold=0.8, num_perm=128, shingle_size=5, seed=SEED):
+        """
+        Near-duplicate detector with MinHash signatures and locality-sensitive hashing (LSH).
+
+        Texts are normalized and split into character shingles, each text gets a MinHash signature
+        and the signatures are split into bands. Texts sharing a band are candidates, and candidates
+        with an estimated Jaccard similarity of at least threshold are grouped, so the cost is
+        near-linear instead of comparing all pairs.
+
+        Arguments:
+        - threshold (float, optional, default is 0.8): minimum Jaccard similarity of the shingles of two duplicates.
+        - num_perm (int, optional, default is 128): MinHash permutations, more is more accurate and slower.
+        - shingle_size (int, optional, default is 5): characters per shingle.
+        - seed (int, optional, default is SEED): random seed of the permutations.
+        """
+
+        logger.info({"message": "Instantiate MinHashLSH object.", "threshold": threshold,
+                     "num_perm": num_perm, "shingle_size": shingle_size})
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+        self._b = generator.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+
+    def signatures(self, texts):
+        """
+        MinHash signature of each text.
+
+        Output:
+        - np.ndarray of shape (len(texts), num_perm), texts without shingles have MERSENNE_PRIME in all positions.
+        """
+        # Repeated texts (common in logs) are hashed once.
+        codes, unique_texts = pd.factorize(pd.Series([normalize_for_shingles(text) for text in texts], dtype=object))
+        text_shingles = [shingles(text, self.shingle_size) for text in unique_texts]
+        lengths = np.fromiter((len(s) for s in text_shingles), dtype=np.int64, count=len(text_shingles))
+        hashes = np.fromiter((h for s in text_shingles for h in s), dtype=np.int64, count=int(lengths.sum()))
+
+        signatures = np.full((len(unique_texts), self.num_perm), MERSENNE_PRIME, dtype=np.int64)
+        non_empty = np.flatnonzero(lengths > 0)
+        if len(non_empty) == 0:
+            return signatures[codes]
+
+        starts = np.concatenate([[0], np.cumsum(lengths)])[:-1][non_empty]
+        # (a * x + b) mod p of all shingles, a few permutations at a time to bound the memory.
+        step = max(1, CHUNK_SHINGLES // max(1, len(hashes)))
+        for start in range(0, self.num_perm, step):
+            a, b = self._a[start:start + step, None], self._b[start:start + step, None]
+            permuted = (a * hashes[None, :] + b) % MERSENNE_PRIME
+            signatures[non_empty, start:start + step] = np.minimum.reduceat(permuted, starts, axis=1).T
+        return signatures[codes]
+
+    def fit(self, texts):
+        """
+        Group the near-duplicate texts.
+
+        Texts sharing a band bucket are not compared pairwise: each one is compared with the first and
+        the previous text of the bucket, and groups are the connected pairs. Two similar texts of a bucket
+        may stay apart when neither is similar to those texts, though they usually share other bands too.
+
+        Arguments:
+        - texts (list, required): texts, e.g. examples or log inputs.
+
+        Output:
+        - np.ndarray with the group of each text: the position of the first text of its group.
+        """
+
+        logger.info({"message": "Searching near-duplicates.", "texts": len(texts),
+                     "bands": self.bands, "rows": self.rows})
+
+        signatures = self.signatures(texts)
+        parents = np.arange(len(texts))
+        # Texts without shingles (e.g. empty) are not duplicates of anything.
+        positions = np.flatnonzero((signatures != MERSENNE_PRIME).any(axis=1))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        for band in range(self.bands):
+            columns = signatures[positions, band * self.rows:(band + 1) * self.rows]
+            keys = pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+            order = np.argsort(keys, kind="mergesort")
+            sorted_keys = keys[order]
+            same = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1]) + 1
+            if len(same) == 0:
+                continue
+            # Each candidate is compared with the first and the previous text of its bucket.
+            bucket_starts = np.concatenate([[0], np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1])
+            first = positions[order[bucket_starts[np.searchsorted(bucket_starts, same, side="right") - 1]]]
+            previous = positions[order[same - 1]]
+            candidates = np.concatenate([positions[order[same]]] * 2)
+            others = np.concatenate([first, previous])
+            similar = (signatures[others] == signatures[candidates]).mean(axis=1) >= self.threshold
+            for i, j in zip(others[similar], candidates[similar]):
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parents[max(root_i, root_j)] = min(root_i, root_j)
+
+        return np.array([find(i) for i in range(len(texts))], dtype=np.int64)
+
+
+def near_duplicate_groups(texts, threshold=0.8, num_perm=128, shingle_size=5):
+    """
+    Groups of near-duplicate texts, see MinHashLSH.
+
+    Output:
+    - list of lists with the positions of the texts of each group with more than one text,
+    the largest group first.
+    """
+    labels = MinHashLSH(threshold, num_perm, shingle_size).fit(texts)
+    groups = pd.Series(np.arange(len(labels))).groupby(labels).agg(list)
+    groups = [group for group in groups if len(group) > 1]
+    return sorted(groups, key=len, reverse=True)
+
+
+def deduplicate(texts, threshold=0.8, num_perm=128, shingle_size=5):
+    """
+    Dedup pre-stage: keep the first text of each group of near-duplicates.
+
+    Arguments:
+    - texts (list, required): texts.
+    - threshold (float, optional, default is 0.8): see MinHashLSH.
+    - num_perm (int, optional, default is 128): see MinHashLSH.
+    - shingle_size (int, optional, default is 5): see MinHashLSH.
+
+    Output:
+    - A tuple with the positions of the kept texts and the group (position of the kept text) of each text.
+    """
+    labels = MinHashLSH(threshold, num_perm, shingle_size).fit(texts)
+    kept = np.flatnonzero(labels == np.arange(len(labels)))
+    logger.info({"message": "Removed near-duplicates.", "texts": len(texts), "kept": len(kept)})
+    return kept, labels
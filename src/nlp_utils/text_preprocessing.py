@@ -50,13 +50,19 @@ def load_stopwords(file_name):
     return stopwords
 
 
-def apply_tfidf(examples):
-    logger.info({"message": "Applying TF-IDF.",
-                "examples_count": len(examples)})
-    pipeline = Pipeline([
+def tfidf_pipeline():
+    return Pipeline([
         ('vect', CountVectorizer()),
         ('tfidf', TfidfTransformer()),
     ])
 
-    X = pipeline.fit_transform(examples).todense()
+
+def apply_tfidf(examples, dense=True):
+    logger.info({"message": "Applying TF-IDF.",
+                "examples_count": len(examples), "dense": dense})
+    pipeline = tfidf_pipeline()
+
+    X = pipeline.fit_transform(examples)
+    if dense:
+        X = X.todense()
     return X